@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+"""
+Benchmark the available JSON codecs.
+
+Compares encoding and decoding speed of each installed codec on two typical
+workloads: the body of an add_doc request, and a search response holding a
+page of result items together with some facet information.
+
+Usage::
+
+  python codec_bench.py [iterations]
+
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from restpose.codec import available_codecs, get_codec
+
+def make_doc(num):
+    """Make a document, as would be passed to add_doc.
+
+    """
+    return {
+        'id': str(num),
+        'type': 'article',
+        'title_text': u'Document number %d: a caf\xe9 review' % num,
+        '_text': u' '.join([u'word%d' % (i % 97) for i in range(400)]),
+        'tag': ['food', 'drink', 'tag%d' % (num % 13)],
+        'published': 1325376000 + num * 3600,
+        'lonlat': {'lat': 51.5357, 'lon': -0.1557},
+    }
+
+def make_search_response(size):
+    """Make a search response, as returned from a search.
+
+    """
+    return {
+        'from': 0,
+        'size_requested': size,
+        'check_at_least': size + 1,
+        'total_docs': 1000000,
+        'matches_lower_bound': 12000,
+        'matches_estimated': 12345,
+        'matches_upper_bound': 13000,
+        'items': [
+            dict((k, v if isinstance(v, list) else [v])
+                 for (k, v) in make_doc(num).items() if k != '_text')
+            for num in range(size)
+        ],
+        'info': [{
+            'type': 'facet_count',
+            'fieldname': 'tag',
+            'doc_count': 12345,
+            'terms_seen': 15,
+            'counts': [['tag%d' % i, 1000 - i] for i in range(15)],
+        }],
+    }
+
+def bench(codec, obj, iterations):
+    encoded = codec.dumps(obj)
+    enc = min(timeit.repeat(lambda: codec.dumps(obj),
+                            number=iterations, repeat=3))
+    dec = min(timeit.repeat(lambda: codec.loads(encoded),
+                            number=iterations, repeat=3))
+    return len(encoded), enc / iterations, dec / iterations
+
+def main(argv):
+    iterations = 1000
+    if len(argv) > 1:
+        iterations = int(argv[1])
+
+    workloads = [
+        ('add_doc payload', make_doc(1)),
+        ('search response (20 items)', make_search_response(20)),
+        ('search response (100 items)', make_search_response(100)),
+    ]
+
+    for title, obj in workloads:
+        print(title)
+        print('  %-12s %10s %12s %12s' % ('codec', 'bytes', 'encode (us)',
+                                         'decode (us)'))
+        for name in available_codecs():
+            size, enc, dec = bench(get_codec(name), obj, iterations)
+            print('  %-12s %10d %12.1f %12.1f' % (name, size, enc * 1e6,
+                                                dec * 1e6))
+        print('')
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+"""
+Benchmark encoding documents in worker processes.
+
+Compares the rate at which documents are built and encoded as JSON in the
+calling thread with the rate using an EncodingPool with increasing numbers of
+processes, both when the documents are built in the calling process and
+passed to the pool, and when the pool builds them itself.
+
+The CPU time used by the calling process for each document is also shown.
+With enough cores, this limits the rate a pool can reach.
+
+Usage::
+
+  python encoding_bench.py [documents]
+
+"""
+
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from codec_bench import make_doc
+from restpose.bulk import EncodingPool
+from restpose.codec import get_codec
+
+def make_item(num):
+    return make_doc(num), 'article', str(num)
+
+def items(count):
+    for num in range(count):
+        yield make_item(num)
+
+def cpu_time():
+    usage = os.times()
+    return usage[0] + usage[1]
+
+def bench_inline(count):
+    dumps = get_codec().dumps
+    start, start_cpu = time.time(), cpu_time()
+    for doc, doc_type, doc_id in items(count):
+        dumps(doc)
+    return time.time() - start, cpu_time() - start_cpu
+
+def bench_pool(count, processes, build_in_pool):
+    with EncodingPool(processes=processes) as pool:
+        # Start the worker processes before timing.
+        list(pool.imap(items(processes * pool.chunk_size)))
+        start, start_cpu = time.time(), cpu_time()
+        if build_in_pool:
+            results = pool.imap(range(count), func=make_item)
+        else:
+            results = pool.imap(items(count))
+        for result in results:
+            pass
+        return time.time() - start, cpu_time() - start_cpu
+
+def report(name, count, elapsed, cpu):
+    print("%-32s %10.0f docs/sec %8.1f us/doc in caller" % (
+        name, count / elapsed, cpu * 1e6 / count))
+
+def main():
+    count = 20000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    print("Encoding %d documents with the %s codec" %
+          (count, get_codec().name))
+    report("calling thread", count, *bench_inline(count))
+    processes = 1
+    while processes <= multiprocessing.cpu_count():
+        for build_in_pool, built in ((False, "built here"),
+                                     (True, "built in pool")):
+            report("%d processes, %s" % (processes, built), count,
+                   *bench_pool(count, processes, build_in_pool))
+        processes *= 2
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+"""
+Benchmark TCP loopback against Unix domain socket connections.
+
+Starts a stand-in server, which answers every request with a small JSON
+status document, listening both on a TCP port on 127.0.0.1 and on a Unix
+domain socket.  Then times sequential requests over a single keep-alive
+connection to each, both with raw HTTP requests (measuring the transport
+alone) and with restpose.Server (measuring the whole client).
+
+Usage::
+
+  python transport_bench.py [iterations]
+
+"""
+
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from six.moves import BaseHTTPServer, socketserver
+
+BODY = b'{"tasks":{"indexing":{"queue":0,"running":0}},"ok":1}'
+
+class StatusHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        if self.request.family == socket.AF_INET:
+            # Avoid delayed ACK stalls, since headers and body are written
+            # separately.
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def address_string(self):
+        # Unix domain socket clients have no address.
+        return 'local'
+
+    def log_message(self, *args):
+        pass
+
+class TCPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def serve(server):
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+def raw_bench(family, address, iterations):
+    """Time requests made directly over a socket.
+
+    """
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.connect(address)
+    if family == socket.AF_INET:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    request = b'GET /status HTTP/1.1\r\nHost: localhost\r\n\r\n'
+    expected = None
+    start = time.time()
+    for _ in range(iterations):
+        sock.sendall(request)
+        received = b''
+        while expected is None or len(received) < expected:
+            chunk = sock.recv(65536)
+            if not chunk:
+                raise IOError("Connection closed")
+            received += chunk
+            if expected is None and b'\r\n\r\n' in received:
+                head = received.split(b'\r\n\r\n', 1)[0]
+                expected = len(head) + 4 + len(BODY)
+    elapsed = time.time() - start
+    sock.close()
+    return elapsed / iterations
+
+def client_bench(uri, iterations):
+    """Time requests made with restpose.Server.
+
+    """
+    from restpose import Server
+    server = Server(uri, max_idle=1)
+    server.status
+    start = time.time()
+    for _ in range(iterations):
+        server.status
+    return (time.time() - start) / iterations
+
+def main(argv):
+    iterations = 5000
+    if len(argv) > 1:
+        iterations = int(argv[1])
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        socket_path = os.path.join(tmpdir, 'restpose.sock')
+        tcp = TCPServer(('127.0.0.1', 0), StatusHandler)
+        unix = UnixServer(socket_path, StatusHandler)
+        serve(tcp)
+        serve(unix)
+        port = tcp.server_address[1]
+
+        print('%-24s %14s' % ('transport', 'request (us)'))
+        print('%-24s %14.1f' % ('raw tcp loopback', 1e6 *
+            raw_bench(socket.AF_INET, ('127.0.0.1', port), iterations)))
+        print('%-24s %14.1f' % ('raw unix socket', 1e6 *
+            raw_bench(socket.AF_UNIX, socket_path, iterations)))
+
+        try:
+            import restkit
+        except ImportError:
+            print('restkit is not installed; skipping client benchmarks')
+            return
+        print('%-24s %14.1f' % ('Server tcp loopback', 1e6 *
+            client_bench('http://127.0.0.1:%d' % port, iterations)))
+        print('%-24s %14.1f' % ('Server unix socket', 1e6 *
+            client_bench('unix://' + socket_path, iterations)))
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    main(sys.argv)
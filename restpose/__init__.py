@@ -6,12 +6,34 @@
 
 """
 
-from .client import Server, Field, AnyField
-from .errors import RestPoseError, CheckPointExpiredError
+from .errors import RestPoseError, CheckPointExpiredError, BulkIndexError, \
+                    CheckPointTimeoutError, CopyVerificationError, \
+                    RateLimitExceeded
 from .query import Query, Searchable, And, Or, Xor, AndNot, Filter, \
                    AndMaybe, MultWeight
+from .target import Field, AnyField
 from .version import dev_release, version_info, __version__
+import sys
 
-from restkit import ResourceNotFound, Unauthorized, RequestFailed, \
-                    RedirectLimit, RequestError, InvalidUrl, \
-                    ResponseError, ProxyError, ResourceError
+try:
+    from .client import Server
+    from restkit import ResourceNotFound, Unauthorized, RequestFailed, \
+                        RedirectLimit, RequestError, InvalidUrl, \
+                        ResponseError, ProxyError, ResourceError
+except ImportError:
+    # restkit can't be imported on Python 3, but restpose.aio doesn't need it,
+    # so the package must still import there.  The error is raised again if
+    # any of the names which need restkit are used.
+    if sys.version_info < (3, 7):
+        raise
+    _client_import_error = sys.exc_info()[1]
+
+    def __getattr__(name):
+        if name in ('Server', 'ResourceNotFound', 'Unauthorized',
+                    'RequestFailed', 'RedirectLimit', 'RequestError',
+                    'InvalidUrl', 'ResponseError', 'ProxyError',
+                    'ResourceError'):
+            raise ImportError("restpose.%s is unavailable: %s" %
+                              (name, _client_import_error))
+        raise AttributeError("module %r has no attribute %r" %
+                             (__name__, name))
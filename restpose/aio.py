@@ -0,0 +1,952 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+"""
+Asynchronous RestPose client, built on asyncio.
+
+This module mirrors :class:`restpose.Server`, :class:`restpose.client.Collection`
+and :class:`restpose.client.DocumentType`, but every method which contacts the
+server is a coroutine.  Requests are made over a small HTTP/1.1 transport
+running directly on asyncio streams, with its own pool of keep-alive
+connections, so many concurrent searches can be in progress without needing a
+thread for each of them.
+
+Queries are built in exactly the same way as for the synchronous client, but
+must be passed to the `search` coroutine, rather than being iterated or sliced
+to get results::
+
+    server = AsyncServer('http://127.0.0.1:7777')
+    coll = server.collection('test_coll')
+    await coll.add_doc(doc, doc_type='blurb', doc_id='1')
+    chk = await coll.checkpoint()
+    await chk.wait()
+    results = await coll.search(coll.field.text.text('hello')[:10])
+    await server.close()
+
+The results are normal :class:`restpose.query.SearchResults` objects.
+
+This module requires Python 3.7 or later, and is not imported by the
+`restpose` package itself.  It doesn't use restkit, so errors are reported
+with the exception classes defined here, which mirror those raised by restkit
+for the synchronous client.
+
+"""
+
+import asyncio
+import time
+from urllib.parse import urlsplit, quote, urlencode
+
+from .codec import get_codec
+from .errors import RestPoseError, CheckPointExpiredError
+from .query import SearchResults
+from .response import BaseResponse
+from .target import QueryBuilder, _first
+from .version import __version__
+
+
+class ResourceError(RestPoseError):
+    """An error response from the server.
+
+    Mirrors :exc:`restkit.errors.ResourceError`.  As for the synchronous
+    client, `msg` is the error message sent by the server, and `msgobj` is
+    the decoded JSON body of the response, if it had one.
+
+    """
+
+    #: The HTTP status code of the response.
+    status_int = None
+
+    def __init__(self, msg=None, http_code=None, response=None):
+        super(ResourceError, self).__init__(msg)
+        self.msg = msg or ''
+        if http_code:
+            self.status_int = http_code
+        self.response = response
+        self.msgobj = None
+
+    def __str__(self):
+        return str(self.msg)
+
+
+class ResourceNotFound(ResourceError):
+    """The resource requested doesn't exist (status 404).
+
+    """
+    status_int = 404
+
+
+class ResourceGone(ResourceError):
+    """The resource requested no longer exists (status 410).
+
+    """
+    status_int = 410
+
+
+class Unauthorized(ResourceError):
+    """The request wasn't authorized (status 401 or 403).
+
+    """
+    status_int = 401
+
+
+class RequestFailed(ResourceError):
+    """Any other error response from the server.
+
+    """
+    pass
+
+
+class RequestError(RestPoseError):
+    """The request couldn't be made, or no valid response was received.
+
+    """
+    pass
+
+
+class RequestTimeout(RestPoseError):
+    """No response was received within the time allowed.
+
+    """
+    pass
+
+
+class _Headers(dict):
+    """Response headers, with case-insensitive lookup.
+
+    """
+    def get(self, key, default=None):
+        return dict.get(self, key.lower(), default)
+
+    def __getitem__(self, key):
+        return dict.__getitem__(self, key.lower())
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key.lower())
+
+
+class _StaleConnection(Exception):
+    """Raised when a connection was closed before any of a response arrived.
+
+    """
+    pass
+
+
+# Methods which can safely be sent again if a connection fails before any of
+# the response is read.
+_IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'PUT', 'DELETE'))
+
+
+class AsyncResponse(BaseResponse):
+    """A response from the RestPose server, read by the asyncio transport.
+
+    The body is read in full before the response is returned, so the `json`
+    property and `body_string` method can be used without awaiting.
+
+    """
+    def __init__(self, status, headers, body, keep_alive):
+        self.status = status
+        self.status_int = int(status[:3])
+        self.headers = headers
+        self.should_close = not keep_alive
+        self._body = body
+
+    #: Requests made by the asyncio transport are not timed.
+    request = None
+
+    def body_string(self, charset=None, unicode_errors="strict"):
+        """Get the response body.
+
+        """
+        return self._read_body(charset, unicode_errors)
+
+    def _read_body(self, charset=None, unicode_errors="strict"):
+        body = self._body
+        if charset is not None:
+            body = body.decode(charset, unicode_errors)
+        return body
+
+
+class _Connection(object):
+    def __init__(self, key, reader, writer):
+        self.key = key
+        self.reader = reader
+        self.writer = writer
+        self.last_used = time.time()
+        self.reused = False
+
+    @property
+    def closed(self):
+        return self.writer.is_closing() or self.reader.at_eof()
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncConnectionPool(object):
+    """A pool of keep-alive connections for the asyncio transport.
+
+    """
+    def __init__(self, max_connections=10, idle_timeout=60.0):
+        """
+        :param max_connections: The maximum number of connections to open to
+               each host.  Requests beyond this limit wait for a connection to
+               become free.
+
+        :param idle_timeout: The number of seconds for which an unused
+               connection is kept open.
+
+        """
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self._idle = {}
+        self._limits = {}
+
+    def _limit(self, key):
+        sem = self._limits.get(key)
+        if sem is None:
+            sem = self._limits[key] = asyncio.Semaphore(self.max_connections)
+        return sem
+
+    async def acquire(self, host, port, ssl=None):
+        """Get a connection to the given host and port.
+
+        Reuses an idle connection if one is available.  The connection must be
+        given back to the pool with `release()` when finished with.
+
+        """
+        key = (host, port, bool(ssl))
+        limit = self._limit(key)
+        await limit.acquire()
+        try:
+            idle = self._idle.get(key)
+            now = time.time()
+            while idle:
+                conn = idle.pop()
+                if not conn.closed and \
+                   now - conn.last_used < self.idle_timeout:
+                    conn.reused = True
+                    return conn
+                conn.close()
+            reader, writer = await asyncio.open_connection(host, port,
+                                                           ssl=ssl)
+        except BaseException:
+            limit.release()
+            raise
+        return _Connection(key, reader, writer)
+
+    def release(self, conn, reuse=True):
+        """Give a connection back to the pool.
+
+        :param reuse: If False, the connection is closed instead of being kept
+               for reuse.
+
+        """
+        if reuse and not conn.closed:
+            conn.last_used = time.time()
+            self._idle.setdefault(conn.key, []).append(conn)
+        else:
+            conn.close()
+        self._limit(conn.key).release()
+
+    async def close(self):
+        """Close all idle connections.
+
+        """
+        idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+                try:
+                    await conn.writer.wait_closed()
+                except (ConnectionError, OSError):
+                    pass
+
+
+class AsyncResource(object):
+    """A resource providing asynchronous access to a RestPose server.
+
+    """
+
+    #: The user agent to send when making requests.
+    user_agent = 'restpose_python/%s' % __version__
+
+    def __init__(self, uri, codec=None, pool=None, timeout=None):
+        """
+        :param uri: The full URI for the server.
+
+        :param codec: The JSON codec to use (see :mod:`restpose.codec`).
+
+        :param pool: The :class:`AsyncConnectionPool` to use.  If None, a new
+               pool is created.
+
+        :param timeout: The maximum time, in seconds, to wait for a complete
+               response to each request.  None means no limit.
+
+        """
+        parts = urlsplit(uri)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError("Unsupported URI scheme: %r" % parts.scheme)
+        self.uri = uri
+        self._host = parts.hostname
+        self._ssl = (parts.scheme == 'https') or None
+        self._port = parts.port or (443 if self._ssl else 80)
+        self._netloc = parts.netloc
+        self._basepath = parts.path.rstrip('/')
+        self.codec = get_codec(codec)
+        self.pool = pool or AsyncConnectionPool()
+        self.timeout = timeout
+
+    def get(self, path=None, headers=None, params_dict=None, **params):
+        return self.request("GET", path=path, headers=headers,
+                            params_dict=params_dict, **params)
+
+    def delete(self, path=None, headers=None, params_dict=None, **params):
+        return self.request("DELETE", path=path, headers=headers,
+                            params_dict=params_dict, **params)
+
+    def post(self, path=None, payload=None, headers=None,
+             params_dict=None, **params):
+        return self.request("POST", path=path, payload=payload,
+                            headers=headers, params_dict=params_dict,
+                            **params)
+
+    def put(self, path=None, payload=None, headers=None,
+            params_dict=None, **params):
+        return self.request("PUT", path=path, payload=payload,
+                            headers=headers, params_dict=params_dict,
+                            **params)
+
+    async def request(self, method, path=None, payload=None, headers=None,
+                      params_dict=None, **params):
+        """Perform a request.
+
+        Takes the same parameters as
+        :meth:`restpose.resource.RestPoseResource.request`.
+
+        :raises: :exc:`ResourceError` (or a subclass) for error responses,
+                 :exc:`RequestError` if no valid response was received, or
+                 :exc:`RequestTimeout` if the timeout expired.
+
+        :returns: an :class:`AsyncResponse`.
+
+        """
+        params.update(params_dict or {})
+        req_headers = {
+            'Accept': 'application/json',
+            'User-Agent': self.user_agent,
+        }
+        req_headers.update(headers or {})
+
+        body = b''
+        if payload is not None:
+            if isinstance(payload, str):
+                body = payload.encode('utf-8')
+            elif isinstance(payload, (bytes, bytearray, memoryview)):
+                body = bytes(payload)
+            else:
+                body = self.codec.dumps(payload)
+                req_headers.setdefault('Content-Type', 'application/json')
+
+        target = quote(self._basepath + '/' + (path or '').lstrip('/'),
+                       safe='/:')
+        if params:
+            target += '?' + urlencode(params, doseq=True)
+
+        perform = self._perform(method, target, req_headers, body)
+        if self.timeout is None:
+            resp = await perform
+        else:
+            try:
+                resp = await asyncio.wait_for(perform, self.timeout)
+            except asyncio.TimeoutError:
+                raise RequestTimeout("Timed out after %ss: %s %s" %
+                                     (self.timeout, method, target))
+
+        if resp.status_int >= 400:
+            self._raise_for_status(resp)
+        resp.codec = self.codec
+        return resp
+
+    def _raise_for_status(self, resp):
+        msg = resp.body_string()
+        if resp.status_int == 404:
+            e = ResourceNotFound(msg, response=resp)
+        elif resp.status_int == 410:
+            e = ResourceGone(msg, response=resp)
+        elif resp.status_int in (401, 403):
+            e = Unauthorized(msg, http_code=resp.status_int,
+                                     response=resp)
+        else:
+            e = RequestFailed(msg, http_code=resp.status_int,
+                                      response=resp)
+        # Unpack any errors which are in JSON format.
+        msgobj = None
+        if msg and resp.headers.get('Content-Type') == 'application/json':
+            msgobj = self.codec.loads(msg)
+        if msgobj is not None:
+            e.msg = msgobj.get('err', '')
+        e.msgobj = msgobj
+        raise e
+
+    async def _perform(self, method, target, headers, body):
+        lines = ['%s %s HTTP/1.1' % (method, target),
+                 'Host: %s' % self._netloc]
+        for k, v in headers.items():
+            lines.append('%s: %s' % (k, v))
+        if body or method in ('POST', 'PUT'):
+            lines.append('Content-Length: %d' % len(body))
+        data = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+        while True:
+            conn = await self.pool.acquire(self._host, self._port, self._ssl)
+            try:
+                try:
+                    conn.writer.write(data)
+                    await conn.writer.drain()
+                except ConnectionError as e:
+                    raise _StaleConnection(str(e) or "Connection closed")
+                resp = await self._read_response(conn.reader, method)
+            except _StaleConnection as e:
+                self.pool.release(conn, reuse=False)
+                if conn.reused and method in _IDEMPOTENT_METHODS:
+                    # The server probably closed an idle connection; nothing
+                    # of the response was read, so try again on a fresh
+                    # connection.
+                    continue
+                raise RequestError(str(e))
+            except ConnectionError as e:
+                self.pool.release(conn, reuse=False)
+                raise RequestError(str(e) or "Connection closed")
+            except asyncio.IncompleteReadError as e:
+                self.pool.release(conn, reuse=False)
+                raise RequestError("Incomplete response: %s" % e)
+            except BaseException:
+                self.pool.release(conn, reuse=False)
+                raise
+            self.pool.release(conn, reuse=not resp.should_close)
+            return resp
+
+    async def _read_response(self, reader, method):
+        try:
+            line = await reader.readline()
+        except ConnectionError as e:
+            raise _StaleConnection(str(e) or "Connection closed by server")
+        if not line:
+            raise _StaleConnection("Connection closed by server")
+        parts = line.decode('latin-1').rstrip('\r\n').split(' ', 1)
+        if len(parts) != 2 or not parts[0].startswith('HTTP/'):
+            raise RequestError("Bad status line: %r" % line)
+        version, status = parts
+
+        headers = _Headers()
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            parts = line.decode('latin-1').split(':', 1)
+            if len(parts) != 2:
+                raise RequestError("Bad header line: %r" % line)
+            headers[parts[0].strip().lower()] = parts[1].strip()
+
+        conn_hdr = headers.get('connection', '').lower()
+        if version == 'HTTP/1.1':
+            keep_alive = conn_hdr != 'close'
+        else:
+            keep_alive = conn_hdr == 'keep-alive'
+
+        status_int = int(status[:3])
+        if method == 'HEAD' or status_int in (204, 304) or status_int < 200:
+            body = b''
+        elif 'chunked' in headers.get('transfer-encoding', '').lower():
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';', 1)[0], 16)
+                if size == 0:
+                    # Skip any trailers.
+                    while (await reader.readline()) not in (b'\r\n', b'\n',
+                                                            b''):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b''.join(chunks)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            body = await reader.read()
+            keep_alive = False
+
+        return AsyncResponse(status, headers, body, keep_alive)
+
+    async def close(self):
+        """Close any idle connections held by this resource's pool.
+
+        """
+        await self.pool.close()
+
+
+class AsyncServer(object):
+    """Asynchronous representation of a RestPose server.
+
+    """
+
+    #: Type of waiting to use for calls which modify state.  See
+    #: :attr:`restpose.Server.wait`.
+    wait = "process"
+
+    def __init__(self, uri='http://127.0.0.1:7777', codec=None,
+                 max_connections=10, idle_timeout=60.0, timeout=None,
+                 resource_instance=None):
+        """
+        :param uri: Full URI to the top path of the server.
+
+        :param codec: The JSON codec to use (see :mod:`restpose.codec`).
+
+        :param max_connections: The maximum number of connections to open to
+               the server at once.
+
+        :param idle_timeout: The number of seconds for which an unused
+               connection is kept open.
+
+        :param timeout: The maximum time, in seconds, to wait for each
+               request to complete.  None means no limit.
+
+        :param resource_instance: If specified, an :class:`AsyncResource`
+               to use instead of creating one.
+
+        """
+        self.uri = uri = uri.rstrip('/')
+        if resource_instance is not None:
+            self._resource = resource_instance
+        else:
+            pool = AsyncConnectionPool(max_connections=max_connections,
+                                       idle_timeout=idle_timeout)
+            self._resource = AsyncResource(uri, codec=codec, pool=pool,
+                                           timeout=timeout)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, tb):
+        await self.close()
+
+    async def close(self):
+        """Close any idle connections to the server.
+
+        """
+        await self._resource.close()
+
+    @property
+    async def status(self):
+        """Get server status.
+
+        Must be awaited: ``status = await server.status``.
+
+        """
+        return (await self._resource.get('/status')).expect_status(200).json
+
+    @property
+    async def collections(self):
+        """Get a list of existing collections.
+
+        Must be awaited: ``names = await server.collections``.
+
+        """
+        resp = await self._resource.get('/coll')
+        return list(resp.expect_status(200).json.keys())
+
+    def collection(self, coll_name):
+        """Access to a collection.
+
+        No request is performed by this method.
+
+        """
+        return AsyncCollection(self, coll_name)
+
+
+class AsyncQueryTarget(QueryBuilder):
+    """An object which can be used to make and run queries asynchronously.
+
+    Queries may be built in the same way as for the synchronous client, but
+    must be run by awaiting `search()`.
+
+    """
+    async def search(self, search):
+        """Perform a search.
+
+        :param search: is a search structure to be sent to the server, or a
+                       Search or Query object.
+
+        :returns: a :class:`restpose.query.SearchResults` object.
+
+        """
+        if hasattr(search, '_build_search'):
+            body = search._build_search()
+            realiser = search._realiser
+        else:
+            body = search
+            realiser = None
+        resp = await self._resource.post(self._basepath + "/search",
+                                         payload=body)
+        return SearchResults(resp.expect_status(200).json,
+                             realiser or self._realiser)
+
+    async def matching_ids(self, query, page_size=1000):
+        """Get the types and IDs of all documents matching a query.
+
+        See :meth:`restpose.client.QueryTarget.matching_ids`.
+
+        """
+        query = query.set_target(self)
+        result = []
+        offset = 0
+        while True:
+            results = await self.search(query._build_search(offset=offset,
+                                                            size=page_size))
+            for item in results:
+                result.append((_first(item.data.get('type')),
+                               _first(item.data.get('id'))))
+            offset += len(results)
+            if len(results) < page_size or \
+               offset >= results.matches_upper_bound:
+                return result
+
+
+class AsyncDocument(object):
+    """A document fetched from the server.
+
+    """
+    def __init__(self, resource, path):
+        self._resource = resource
+        self._path = path
+        self._raw = None
+        self.data = None
+        self.terms = None
+        self.values = None
+
+    async def fetch(self):
+        """Fetch (or re-fetch) the document from the server.
+
+        :returns: self, with `data`, `terms` and `values` populated.
+
+        """
+        resp = await self._resource.get(self._path)
+        self._raw = resp.expect_status(200).json
+        self.data = self._raw.get('data', {})
+        self.terms = self._raw.get('terms', {})
+        self.values = self._raw.get('values', {})
+        return self
+
+
+class AsyncDocumentType(AsyncQueryTarget):
+    def __init__(self, collection, doc_type):
+        super(AsyncDocumentType, self).__init__()
+
+        #: The name of the document type
+        self.name = doc_type
+
+        self._basepath = collection._basepath + '/type/' + doc_type
+        self._server = collection._server
+        self._resource = collection._resource
+        self._realiser = collection._realiser
+
+    async def add_doc(self, doc, doc_id=None, wait=None):
+        """Add a document to the collection.
+
+        See :meth:`restpose.client.DocumentType.add_doc`.
+
+        """
+        wait = wait or self._server.wait
+        if doc_id is None:
+            resp = await self._resource.post(self._basepath, payload=doc,
+                                             wait=wait)
+        else:
+            resp = await self._resource.put(
+                self._basepath + '/id/%s' % doc_id, payload=doc, wait=wait)
+        return resp.expect_status(202).json
+
+    async def delete_doc(self, doc_id, wait=None):
+        """Delete a document with this type from the collection.
+
+        """
+        path = '%s/id/%s' % (self._basepath, doc_id)
+        resp = await self._resource.delete(path,
+                                           wait=wait or self._server.wait)
+        return resp.expect_status(202).json
+
+    async def get_doc(self, doc_id):
+        """Get a document.
+
+        :returns: an :class:`AsyncDocument`, already fetched.
+
+        """
+        return await AsyncDocument(self._resource,
+                                   self._basepath + '/id/' + doc_id).fetch()
+
+
+class AsyncCollection(AsyncQueryTarget):
+    def __init__(self, server, coll_name):
+        super(AsyncCollection, self).__init__()
+
+        #: The name of the collection
+        self.name = coll_name
+
+        self._basepath = '/coll/' + coll_name
+        self._resource = server._resource
+        self._server = server
+
+    def doc_type(self, doc_type):
+        return AsyncDocumentType(self, doc_type)
+
+    @property
+    async def status(self):
+        """The status of the collection.
+
+        Must be awaited: ``status = await coll.status``.
+
+        """
+        resp = await self._resource.get(self._basepath)
+        return resp.expect_status(200).json
+
+    @property
+    async def config(self):
+        """The configuration of the collection.
+
+        Must be awaited: ``config = await coll.config``.  Use `set_config()`
+        to change the configuration.
+
+        """
+        resp = await self._resource.get(self._basepath + '/config')
+        return resp.expect_status(200).json
+
+    async def set_config(self, value, wait=None):
+        """Set the configuration of the collection.
+
+        """
+        resp = await self._resource.put(self._basepath + '/config',
+                                        payload=value,
+                                        wait=wait or self._server.wait)
+        return resp.expect_status(202).json
+
+    async def add_doc(self, doc, doc_type=None, doc_id=None, wait=None):
+        """Add a document to the collection.
+
+        See :meth:`restpose.client.Collection.add_doc`.
+
+        """
+        path = self._basepath
+        use_put = True
+
+        if doc_type is None:
+            use_put = False
+        else:
+            path += '/type/%s' % doc_type
+
+        if doc_id is None:
+            use_put = False
+        else:
+            path += '/id/%s' % doc_id
+
+        if use_put:
+            meth = self._resource.put
+        else:
+            meth = self._resource.post
+
+        resp = await meth(path, payload=doc, wait=wait or self._server.wait)
+        return resp.expect_status(202).json
+
+    async def delete_doc(self, doc_type, doc_id, wait=None):
+        """Delete a document from the collection.
+
+        """
+        path = '%s/type/%s/id/%s' % (self._basepath, doc_type, doc_id)
+        resp = await self._resource.delete(path,
+                                           wait=wait or self._server.wait)
+        return resp.expect_status(202).json
+
+    async def get_doc(self, doc_type, doc_id):
+        """Get a document from the collection.
+
+        :returns: an :class:`AsyncDocument`, already fetched.
+
+        """
+        path = self._basepath + '/type/' + doc_type + '/id/' + doc_id
+        return await AsyncDocument(self._resource, path).fetch()
+
+    async def checkpoint(self, commit=True, wait=None):
+        """Set a checkpoint on the collection.
+
+        See :meth:`restpose.client.Collection.checkpoint`.
+
+        :returns: an :class:`AsyncCheckPoint`.
+
+        """
+        params_dict = {'wait': wait or self._server.wait,
+                       'commit': commit and '1' or '0'}
+        resp = await self._resource.post(self._basepath + "/checkpoint",
+                                         params_dict=params_dict)
+        return AsyncCheckPoint(self, resp.expect_status(201).json)
+
+    async def taxonomies(self):
+        """Get a list of the taxonomy names.
+
+        """
+        resp = await self._resource.get(self._basepath + "/taxonomy")
+        return resp.expect_status(200).json
+
+    def taxonomy(self, taxonomy_name):
+        """Access a taxonomy, for getting and setting its hierarchy.
+
+        """
+        return AsyncTaxonomy(self, taxonomy_name)
+
+    async def delete(self):
+        """Delete the entire collection.
+
+        """
+        resp = await self._resource.delete(self._basepath)
+        return resp.expect_status(202).json
+
+
+class AsyncCheckPoint(object):
+    """A checkpoint, used to check the progress of indexing.
+
+    """
+
+    #: The initial interval between polls of the server, in seconds.
+    min_poll = 0.01
+
+    #: The maximum interval between polls of the server, in seconds.
+    max_poll = 1.0
+
+    def __init__(self, collection, response):
+        self._check_id = response.get('checkid')
+        self._basepath = collection._basepath + '/checkpoint/' + self._check_id
+        self._resource = collection._resource
+
+        # As for CheckPoint: None if not yet reached, 'expired' if expired, or
+        # the raw representation of the checkpoint once reached.
+        self._raw = None
+
+    @property
+    def check_id(self):
+        """The ID of the checkpoint.
+
+        """
+        return self._check_id
+
+    async def refresh(self):
+        """Contact the server, and get the status of the checkpoint.
+
+        :returns: True if the checkpoint has been reached.
+
+        :raises: CheckPointExpiredError if the checkpoint has expired.
+
+        """
+        if self._raw is None:
+            resp = await self._resource.get(self._basepath)
+            resp = resp.expect_status(200).json
+            if resp is None:
+                self._raw = 'expired'
+            elif resp.get('reached', False):
+                self._raw = resp
+
+        if self._raw == 'expired':
+            raise CheckPointExpiredError("Checkpoint %s expired" %
+                                         self.check_id)
+        return self._raw is not None
+
+    @property
+    def errors(self):
+        """The list of errors associated with the CheckPoint.
+
+        Returns None if the checkpoint is not yet known to have been reached.
+
+        """
+        if self._raw is None or self._raw == 'expired':
+            return None
+        return self._raw.get('errors', [])
+
+    @property
+    def total_errors(self):
+        """The total count of errors associated with the CheckPoint.
+
+        Returns None if the checkpoint is not yet known to have been reached.
+
+        """
+        if self._raw is None or self._raw == 'expired':
+            return None
+        return self._raw.get('total_errors', 0)
+
+    async def wait(self):
+        """Wait for the checkpoint to be reached.
+
+        Polls the server, backing off from `min_poll` up to `max_poll`
+        seconds between polls.
+
+        :returns: self.
+
+        :raises: CheckPointExpiredError if the checkpoint expires.
+
+        """
+        delay = self.min_poll
+        while not (await self.refresh()):
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_poll)
+        return self
+
+
+class AsyncTaxonomy(object):
+    """A taxonomy; a hierarchy of category relationships.
+
+    See :class:`restpose.client.Taxonomy`.
+
+    """
+    def __init__(self, collection, taxonomy_name):
+        #: The name of the taxonomy
+        self.name = taxonomy_name
+
+        self._basepath = collection._basepath + '/taxonomy/' + taxonomy_name
+        self._resource = collection._resource
+        self._server = collection._server
+
+    async def all(self):
+        resp = await self._resource.get(self._basepath)
+        return resp.expect_status(200).json
+
+    async def top(self):
+        resp = await self._resource.get(self._basepath + '/top')
+        return resp.expect_status(200).json
+
+    async def get_category(self, category):
+        resp = await self._resource.get(self._basepath + '/id/' + category)
+        return resp.expect_status(200).json
+
+    async def add_category(self, category, wait=None):
+        resp = await self._resource.put(self._basepath + '/id/' + category,
+                                        wait=wait or self._server.wait)
+        return resp.expect_status(202).json
+
+    async def remove_category(self, category, wait=None):
+        resp = await self._resource.delete(self._basepath + '/id/' + category,
+                                           wait=wait or self._server.wait)
+        return resp.expect_status(202).json
+
+    async def add_parent(self, category, parent, wait=None):
+        resp = await self._resource.put(
+            self._basepath + '/id/' + category + '/parent/' + parent,
+            wait=wait or self._server.wait)
+        return resp.expect_status(202).json
+
+    async def remove_parent(self, category, parent, wait=None):
+        resp = await self._resource.delete(
+            self._basepath + '/id/' + category + '/parent/' + parent,
+            wait=wait or self._server.wait)
+        return resp.expect_status(202).json
+
+    async def remove(self, wait=None):
+        resp = await self._resource.delete(self._basepath,
+                                           wait=wait or self._server.wait)
+        return resp.expect_status(202).json
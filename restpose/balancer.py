@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+"""
+Load balancing across replicas of a RestPose server.
+
+A :class:`BalancedResource` sends requests to one of several RestPose
+servers holding the same data.  It is normally created by passing a list of
+URIs to :class:`restpose.Server`::
+
+    server = Server(['http://primary:7777',
+                     'http://replica1:7777',
+                     'http://replica2:7777'],
+                    balance_policy='ewma', probe_interval=5)
+
+The first URI is the primary: all requests which modify data are sent to it.
+Searches, document fetches and status reads are spread across all healthy
+endpoints, using either the number of outstanding requests on each endpoint
+(`least_outstanding`), or an exponentially weighted moving average of each
+endpoint's response time, scaled by its outstanding requests (`ewma`).
+
+Endpoints which fail repeatedly are ejected from the set used for reads.
+They are readmitted when a probe of their `/status` resource succeeds, or,
+if background probing is not enabled, after a cooling-off period.
+
+"""
+
+from .resource import RestPoseResource
+import random
+import restkit
+import sys
+import threading
+import time
+
+
+class Endpoint(object):
+    """The state of one server in a :class:`BalancedResource`.
+
+    """
+    def __init__(self, resource):
+        #: The resource used to make requests to this endpoint.
+        self.resource = resource
+
+        #: The URI of the endpoint.
+        self.uri = resource.uri
+
+        #: The number of requests currently in progress.
+        self.outstanding = 0
+
+        #: Moving average of the response time, in seconds; None until the
+        #: first response has been received.
+        self.latency = None
+
+        #: The number of consecutive failed requests.
+        self.failures = 0
+
+        #: If the endpoint has been ejected, the time at which it may be used
+        #: again; otherwise None.
+        self.ejected_until = None
+
+    @property
+    def healthy(self):
+        return self.ejected_until is None
+
+    def __repr__(self):
+        return '<Endpoint %s outstanding=%d latency=%s healthy=%s>' % (
+            self.uri, self.outstanding, self.latency, self.healthy)
+
+
+class BalancedResource(object):
+    """A resource which spreads requests across replicated servers.
+
+    This provides the same request methods as
+    :class:`restpose.resource.RestPoseResource`.
+
+    """
+
+    #: The routing policies which are supported.
+    policies = ('least_outstanding', 'ewma')
+
+    def __init__(self, uris, resource_class=RestPoseResource,
+                 balance_policy='least_outstanding', read_from_primary=True,
+                 max_failures=3, eject_time=30.0, probe_interval=None,
+                 ewma_decay=0.2, **client_opts):
+        """
+        :param uris: The URIs of the servers.  The first is the primary, to
+               which all writes are sent.
+
+        :param resource_class: The class used to make a resource for each
+               server.
+
+        :param balance_policy: The policy used to choose a server for reads;
+               'least_outstanding' or 'ewma'.
+
+        :param read_from_primary: If False, reads are only sent to the primary
+               when no other endpoint is healthy.
+
+        :param max_failures: The number of consecutive failures after which
+               an endpoint is ejected.
+
+        :param eject_time: The number of seconds for which an ejected
+               endpoint is not used, if no background probing is being done.
+
+        :param probe_interval: If set, a background thread checks the
+               `/status` of every endpoint at this interval (in seconds),
+               ejecting those which fail and readmitting those which succeed.
+
+        :param ewma_decay: The weight given to each new response time in the
+               moving average of response times.
+
+        :param client_opts: Options used when creating each resource.
+
+        """
+        if balance_policy not in self.policies:
+            raise ValueError("Unknown balance policy: %r" % balance_policy)
+        uris = list(uris)
+        if not uris:
+            raise ValueError("At least one URI must be supplied")
+
+        self.uri = uris[0]
+        self.initial = dict(uri=self.uri, client_opts=dict(
+            client_opts, uris=uris, resource_class=resource_class,
+            balance_policy=balance_policy,
+            read_from_primary=read_from_primary, max_failures=max_failures,
+            eject_time=eject_time, probe_interval=probe_interval,
+            ewma_decay=ewma_decay))
+        self.client_opts = client_opts
+
+        self.balance_policy = balance_policy
+        self.read_from_primary = read_from_primary
+        self.max_failures = max_failures
+        self.eject_time = eject_time
+        self.ewma_decay = ewma_decay
+
+        #: The endpoints; the first is the primary.
+        self.endpoints = [Endpoint(resource_class(uri, **client_opts))
+                          for uri in uris]
+
+        #: The JSON codec used by the endpoints' resources, so that documents
+        #: encoded in advance use the same codec as other requests.
+        self.codec = getattr(self.primary.resource, 'codec', None)
+        self._lock = threading.Lock()
+
+        self._prober = None
+        self._stop_probing = threading.Event()
+        if probe_interval:
+            self._prober = threading.Thread(target=self._probe_loop,
+                                            args=(probe_interval,))
+            self._prober.daemon = True
+            self._prober.start()
+
+    @property
+    def primary(self):
+        """The primary endpoint."""
+        return self.endpoints[0]
+
+    def clone(self):
+        opts = dict(self.initial['client_opts'])
+        return self.__class__(opts.pop('uris'), **opts)
+
+    def close(self):
+        """Stop any background probing.
+
+        """
+        self._stop_probing.set()
+
+    @staticmethod
+    def is_read(method, path):
+        """Return True if a request only reads data.
+
+        Checkpoints are only known to the server they were created on, so
+        requests for them are not treated as reads.
+
+        """
+        if path is not None and '/checkpoint' in path:
+            return False
+        if method in ('GET', 'HEAD'):
+            return True
+        return method == 'POST' and path is not None and \
+               path.rstrip('/').endswith('/search')
+
+    def _score(self, endpoint):
+        if self.balance_policy == 'ewma':
+            # An endpoint with no measurements scores 0, so that it gets
+            # tried.
+            return (endpoint.latency or 0.0) * (endpoint.outstanding + 1)
+        return endpoint.outstanding
+
+    def _candidates(self, exclude=()):
+        now = time.time()
+        candidates = []
+        for endpoint in self.endpoints:
+            if endpoint in exclude:
+                continue
+            if endpoint.ejected_until is not None and \
+               self._prober is None and endpoint.ejected_until <= now:
+                # Let the endpoint be tried again; one more failure will
+                # eject it again.
+                endpoint.ejected_until = None
+                endpoint.failures = self.max_failures - 1
+            if endpoint.healthy:
+                candidates.append(endpoint)
+        if not self.read_from_primary and len(candidates) > 1 and \
+           self.primary in candidates:
+            candidates.remove(self.primary)
+        return candidates
+
+    def choose(self, method, path, exclude=()):
+        """Choose the endpoint to send a request to.
+
+        The outstanding request count of the chosen endpoint is incremented;
+        the caller must decrement it when the request is complete.
+
+        :returns: an :class:`Endpoint`, or None if every endpoint has been
+                  excluded.
+
+        """
+        with self._lock:
+            if not self.is_read(method, path):
+                self.primary.outstanding += 1
+                return self.primary
+            candidates = self._candidates(exclude)
+            if not candidates:
+                # Nothing is healthy; try whatever hasn't been tried.
+                candidates = [e for e in self.endpoints if e not in exclude]
+                if not candidates:
+                    return None
+            best = min(self._score(e) for e in candidates)
+            endpoint = random.choice([e for e in candidates
+                                      if self._score(e) == best])
+            endpoint.outstanding += 1
+            return endpoint
+
+    def _record(self, endpoint, elapsed=None, failed=False):
+        with self._lock:
+            if failed:
+                endpoint.failures += 1
+                if endpoint.failures >= self.max_failures:
+                    endpoint.ejected_until = time.time() + self.eject_time
+            else:
+                endpoint.failures = 0
+                if elapsed is not None:
+                    if endpoint.latency is None:
+                        endpoint.latency = elapsed
+                    else:
+                        endpoint.latency += self.ewma_decay * \
+                            (elapsed - endpoint.latency)
+
+    def request(self, method, path=None, payload=None, headers=None,
+                **params):
+        """Perform a request, on an endpoint chosen by the balance policy.
+
+        Reads which fail to get a response from one endpoint are retried on
+        the other endpoints.
+
+        """
+        is_read = self.is_read(method, path)
+        tried = []
+        last_error = None
+        while True:
+            endpoint = self.choose(method, path, exclude=tried)
+            if endpoint is None:
+                raise last_error
+            tried.append(endpoint)
+            start = time.time()
+            try:
+                resp = endpoint.resource.request(
+                    method, path=path, payload=payload,
+                    headers=dict(headers or {}), **params)
+            except restkit.ResourceError:
+                e = sys.exc_info()[1] # Python 2/3 compatibility
+                # The server responded, so is only unhealthy if reporting a
+                # server-side error.
+                self._record(endpoint, failed=(e.status_int or 0) >= 500)
+                raise
+            except Exception:
+                last_error = sys.exc_info()[1] # Python 2/3 compatibility
+                self._record(endpoint, failed=True)
+                if not is_read:
+                    raise
+                continue
+            finally:
+                with self._lock:
+                    endpoint.outstanding -= 1
+            self._record(endpoint, time.time() - start)
+            return resp
+
+    def get(self, path=None, headers=None, params_dict=None, **params):
+        return self.request("GET", path=path, headers=headers,
+                            params_dict=params_dict, **params)
+
+    def head(self, path=None, headers=None, params_dict=None, **params):
+        return self.request("HEAD", path=path, headers=headers,
+                            params_dict=params_dict, **params)
+
+    def delete(self, path=None, headers=None, params_dict=None, **params):
+        return self.request("DELETE", path=path, headers=headers,
+                            params_dict=params_dict, **params)
+
+    def post(self, path=None, payload=None, headers=None, params_dict=None,
+             **params):
+        return self.request("POST", path=path, payload=payload,
+                            headers=headers, params_dict=params_dict,
+                            **params)
+
+    def put(self, path=None, payload=None, headers=None, params_dict=None,
+            **params):
+        return self.request("PUT", path=path, payload=payload,
+                            headers=headers, params_dict=params_dict,
+                            **params)
+
+    def probe(self):
+        """Check the `/status` of every endpoint.
+
+        Endpoints which respond are readmitted, and those which don't are
+        ejected.
+
+        """
+        for endpoint in self.endpoints:
+            try:
+                endpoint.resource.get('/status').expect_status(200).json
+            except Exception:
+                with self._lock:
+                    endpoint.failures = max(endpoint.failures + 1,
+                                            self.max_failures)
+                    endpoint.ejected_until = time.time() + self.eject_time
+            else:
+                with self._lock:
+                    endpoint.failures = 0
+                    endpoint.ejected_until = None
+
+    def _probe_loop(self, interval):
+        while not self._stop_probing.wait(interval):
+            self.probe()
@@ -0,0 +1,882 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+"""
+Sending large numbers of document updates to a RestPose server.
+
+Each call to :meth:`restpose.client.Collection.add_doc` makes one request,
+and waits for its response before returning.  A :class:`BulkIndexer` instead
+buffers updates, and sends them from a pool of worker threads, so that many
+requests are in progress at once::
+
+    coll = Server().collection('test_coll')
+    with BulkIndexer(coll, workers=8) as indexer:
+        for row in rows:
+            indexer.add(make_doc(row), doc_type='blurb', doc_id=row[0])
+    print(indexer.stats)
+
+Updates are collected into batches, one per worker.  A batch is handed to its
+worker when it holds `batch_size` updates, or `batch_bytes` bytes of
+documents, or when its first update has waited `flush_interval` seconds.
+Each worker has a queue of at most `max_pending` batches; when a queue is
+full, calls to :meth:`BulkIndexer.add` and :meth:`BulkIndexer.delete` block
+until the worker catches up, so memory use is bounded however fast updates
+are supplied.
+
+Updates to a document with a given type and ID are always sent by the same
+worker, and each worker is handed its batches in the order they were filled,
+so updates to a document are applied in the order in which they were
+supplied.  The type and ID are taken from the "type" and "id" fields of the
+document if they aren't given.
+
+When the indexer is closed (at the end of the `with` block), remaining
+updates are sent, a checkpoint is set on the collection, and the indexer
+waits for the checkpoint to be reached.  If any requests failed, or the
+checkpoint reports errors, a :exc:`restpose.errors.BulkIndexError` is raised.
+
+Building documents and encoding them as JSON can take more CPU time than
+sending them.  An :class:`EncodingPool` does this work in a pool of worker
+processes, handing back encoded buffers in order, so that it uses several
+cores.  The raw input is passed to the workers, with a function which turns
+each input item into a (doc, doc_type, doc_id) tuple::
+
+    def make_item(row):
+        return make_doc(row), 'blurb', row[0]
+
+    with EncodingPool(processes=4) as encoder:
+        with BulkIndexer(coll, workers=8) as indexer:
+            indexer.add_many(rows, encoder=encoder, func=make_item)
+
+Everything passed to and from the workers is pickled and unpickled in the
+calling process, which takes nearly as long as encoding a document with a
+fast codec such as orjson.  A pool therefore only helps when the workers do
+most of the work: when they build the documents, as above, or when the codec
+is slow.  Documents built in the calling process and encoded with orjson or
+ujson are sent faster without a pool.  `benchmarks/encoding_bench.py` shows
+the CPU time the calling process uses for each document in each case.
+
+Documents which have already been encoded may be passed to
+:meth:`BulkIndexer.add` (or :meth:`BulkIndexer.add_encoded`) as bytes,
+bytearray or memoryview objects, and are sent without being encoded again.
+
+An :class:`AdaptiveIndexer` works in the same way, but adjusts the number of
+requests in progress according to whether the server is accepting them, so
+that one job can keep the server busy without overloading it::
+
+    with AdaptiveIndexer(coll, max_concurrency=64) as indexer:
+        for doc in docs:
+            indexer.add(doc)
+            ...
+            print(indexer.concurrency, indexer.throughput)
+
+"""
+
+from .codec import get_codec
+from .errors import BulkIndexError
+from .ratelimit import WriteLimiter
+from .target import _first
+from restkit.errors import ResourceError
+from six.moves import queue
+import collections
+import multiprocessing
+import random
+import six
+import sys
+import threading
+import time
+
+
+#: Types of payload which are treated as already encoded.
+ENCODED_TYPES = (bytes, bytearray, memoryview)
+
+
+class BulkStats(object):
+    """Counters for a :class:`BulkIndexer`.
+
+    """
+    def __init__(self):
+        #: The number of documents added.
+        self.added = 0
+
+        #: The number of documents deleted.
+        self.deleted = 0
+
+        #: The number of requests sent to the server.
+        self.sent = 0
+
+        #: The number of requests which failed.
+        self.failed = 0
+
+        #: The number of batches handed to workers.
+        self.batches = 0
+
+        #: The number of bytes of documents sent.
+        self.bytes_sent = 0
+
+    def as_dict(self):
+        """Get the counters as a dictionary.
+
+        """
+        return dict(self.__dict__)
+
+    def __repr__(self):
+        return '<BulkStats %s>' % ' '.join(
+            '%s=%d' % item for item in sorted(self.__dict__.items()))
+
+
+class CopyStats(object):
+    """Counters for a copy made by :meth:`restpose.client.Collection.copy_to`.
+
+    """
+    def __init__(self):
+        #: The number of documents in the source collection.
+        self.source_count = 0
+
+        #: The number of documents read from the source collection.
+        self.read = 0
+
+        #: The number of documents written to the target collection.
+        self.written = 0
+
+        #: The number of documents dropped by the transform.
+        self.skipped = 0
+
+        #: The number of documents in the target collection after the copy,
+        #: or -1 if it wasn't counted.
+        self.target_count = -1
+
+    def as_dict(self):
+        """Get the counters as a dictionary.
+
+        """
+        return dict(self.__dict__)
+
+    def __repr__(self):
+        return '<CopyStats %s>' % ' '.join(
+            '%s=%d' % item for item in sorted(self.__dict__.items()))
+
+
+def _route_key(doc, doc_type, doc_id):
+    """Get the (type, ID) of a document, for choosing the worker to send it.
+
+    Values missing from the arguments are taken from the "type" and "id"
+    fields of the document.
+
+    """
+    if doc_type is None:
+        doc_type = _first(doc.get('type'))
+    if doc_id is None:
+        doc_id = _first(doc.get('id'))
+    if doc_id is not None and not isinstance(doc_id, six.string_types):
+        doc_id = six.text_type(doc_id)
+    return doc_type, doc_id
+
+
+def _as_bytes(payload):
+    if isinstance(payload, bytes):
+        return payload
+    return memoryview(payload).tobytes()
+
+
+class _Batch(object):
+    def __init__(self):
+        self.ops = []
+        self.size = 0
+        self.started = None
+
+
+class BulkIndexer(object):
+    """Send document updates to a collection or document type in bulk.
+
+    """
+
+    #: The maximum number of failed requests to keep details of.
+    max_errors_kept = 100
+
+    def __init__(self, target, workers=4, batch_size=100,
+                 batch_bytes=1024 * 1024, flush_interval=1.0, max_pending=2,
+                 wait=None, checkpoint=True, commit=True, rate_limit=None):
+        """
+        :param target: The :class:`restpose.client.Collection` or
+               :class:`restpose.client.DocumentType` to send updates to.
+
+        :param workers: The number of threads sending requests.
+
+        :param batch_size: The number of updates in a full batch.
+
+        :param batch_bytes: The size of documents in a full batch.
+
+        :param flush_interval: The longest time, in seconds, that an update
+               will be held before being handed to a worker.
+
+        :param max_pending: The number of full batches which may be waiting
+               for each worker.
+
+        :param wait: The type of waiting to use for each request.  Defaults
+               to that specified by server.wait.
+
+        :param checkpoint: If True, set a checkpoint when the indexer is
+               closed, and wait for it.
+
+        :param commit: If True, the final checkpoint causes a commit.
+
+        :param rate_limit: A :class:`restpose.ratelimit.TokenBucket` to take
+               a token from before sending each request, or a
+               :class:`restpose.ratelimit.WriteLimiter`.  Defaults to the
+               write limit of the target's collection or server, if any;
+               otherwise requests are sent as fast as possible.  Requests
+               refused by a non-blocking limiter count as failures.
+
+        """
+        if hasattr(target, 'checkpoint'):
+            self._collection = target
+            self._doc_type = None
+        else:
+            self._collection = target._collection
+            self._doc_type = target.name
+        self.target = target
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.flush_interval = flush_interval
+        self.wait = wait or target._server.wait
+        self.checkpoint = checkpoint
+        self.commit = commit
+        if rate_limit is None:
+            rate_limit = self._collection._active_write_limit()
+        self.rate_limit = rate_limit
+
+        resource = target._resource
+        self._resource = resource
+        self._codec = getattr(resource, 'codec', None) or get_codec()
+
+        #: Counters of updates and requests.
+        self.stats = BulkStats()
+
+        #: A list of (method, path, exception) tuples for failed requests.
+        #: Only the first `max_errors_kept` failures are kept.
+        self.errors = []
+
+        #: The sequence number of the update in each entry of `errors`.
+        #: Updates are numbered from 1, in the order they were given to the
+        #: indexer.
+        self.failed_seqs = []
+
+        #: The final checkpoint, once the indexer has been closed.
+        self.final_checkpoint = None
+
+        self._lock = threading.Lock()
+        self._closed = False
+        self._aborted = False
+        self._batches = [_Batch() for _ in range(workers)]
+        self._queues = [queue.Queue(max_pending) for _ in range(workers)]
+        # Batches are numbered for each worker as they are taken from
+        # _batches, and handed to the worker in that order.
+        self._batch_seqs = [0] * workers
+        self._dispatched = [0] * workers
+        self._dispatch_conds = [threading.Condition() for _ in range(workers)]
+        self._next_worker = 0
+        self._submitted = 0
+        self._acknowledged = 0
+        self._acked_ahead = set()
+        self._threads = []
+        for q in self._queues:
+            thread = threading.Thread(target=self._work, args=(q,))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        self._flush_event = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop)
+        self._flusher.daemon = True
+        self._flusher.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    @property
+    def submitted(self):
+        """The number of updates given to the indexer."""
+        return self._submitted
+
+    @property
+    def acknowledged(self):
+        """The number of updates, counting in the order they were given to
+        the indexer, which have all had a response from the server.
+
+        Updates are sent by several workers, so may complete out of order;
+        this is the point before which every update has completed (whether
+        or not it succeeded).
+
+        """
+        return self._acknowledged
+
+    def _doc_path(self, doc_type, doc_id):
+        path = self.target._basepath
+        if self._doc_type is not None:
+            if doc_type is not None and doc_type != self._doc_type:
+                raise ValueError("Document type %r doesn't match target %r" %
+                                 (doc_type, self._doc_type))
+        elif doc_type is not None:
+            path += '/type/%s' % doc_type
+        if doc_id is not None:
+            path += '/id/%s' % doc_id
+        return path
+
+    def add(self, doc, doc_type=None, doc_id=None):
+        """Add a document.
+
+        :param doc: The document to add (as a dictionary of fields), or the
+               document already encoded as JSON (as a bytes, bytearray or
+               memoryview object).
+
+        :param doc_type: The type of the document.  Must be omitted (or match)
+               if the target is a document type.
+
+        :param doc_id: The ID of the document.  If omitted, the ID (and type,
+               if the target is a collection) must be present in the document.
+
+        """
+        if isinstance(doc, ENCODED_TYPES):
+            self.add_encoded(doc, doc_type, doc_id)
+            return
+        key = _route_key(doc, doc_type or self._doc_type, doc_id)
+        self._add(self._codec.dumps(doc), doc_type, doc_id, key)
+
+    def add_encoded(self, payload, doc_type=None, doc_id=None):
+        """Add a document which has already been encoded as JSON.
+
+        :param payload: The JSON encoded document, as a bytes, bytearray or
+               memoryview object.  It is sent unchanged, so must not be
+               modified until the indexer has been closed.
+
+        Other parameters are as for :meth:`add`.  If `doc_id` (or, for a
+        collection, `doc_type`) is omitted, the document is decoded to find
+        it.
+
+        """
+        key_type = doc_type or self._doc_type
+        doc = {}
+        if doc_id is None or key_type is None:
+            doc = self._codec.loads(_as_bytes(payload))
+        self._add(payload, doc_type, doc_id, _route_key(doc, key_type, doc_id))
+
+    def _add(self, payload, doc_type, doc_id, key):
+        path = self._doc_path(doc_type, doc_id)
+        if doc_id is not None and (doc_type is not None or
+                                   self._doc_type is not None):
+            method = 'PUT'
+        else:
+            method = 'POST'
+        self._submit((method, path, payload), key)
+
+    def add_many(self, items, encoder=None, func=None):
+        """Add several documents.
+
+        :param items: An iterable of (doc, doc_type, doc_id) tuples, with
+               values as for :meth:`add`, or of items to pass to `func`.
+
+        :param encoder: An :class:`EncodingPool` to build and encode the
+               documents in.  If None, documents are built and encoded in
+               the calling thread.
+
+        :param func: A function to turn each item into a (doc, doc_type,
+               doc_id) tuple.  With an encoder, this is called in the
+               worker processes, so must be picklable (eg, a function
+               defined at the top level of a module).
+
+        """
+        if encoder is None:
+            if func is not None:
+                items = six.moves.map(func, items)
+            for doc, doc_type, doc_id in items:
+                self.add(doc, doc_type, doc_id)
+            return
+        add = self._add
+        for payload, doc_type, doc_id, key in encoder._imap(
+                items, func, self._doc_type):
+            add(payload, doc_type, doc_id, key)
+
+    def delete(self, doc_id, doc_type=None):
+        """Delete a document.
+
+        :param doc_id: The ID of the document.
+
+        :param doc_type: The type of the document.  Required if the target is
+               a collection.
+
+        """
+        if doc_type is None and self._doc_type is None:
+            raise ValueError("doc_type is required when deleting from a "
+                             "collection")
+        path = self._doc_path(doc_type, doc_id)
+        self._submit(('DELETE', path, None),
+                     _route_key({}, doc_type or self._doc_type, doc_id))
+
+    def _submit(self, op, key):
+        if self._closed:
+            raise ValueError("BulkIndexer has been closed")
+        with self._lock:
+            self._submitted += 1
+            op = op + (self._submitted,)
+            if key[1] is None:
+                # No ID, so the order doesn't matter; spread the load.
+                index = self._next_worker
+                self._next_worker = (index + 1) % len(self._batches)
+            else:
+                index = hash(key) % len(self._batches)
+            batch = self._batches[index]
+            batch.ops.append(op)
+            if op[2] is not None:
+                batch.size += len(op[2])
+            if batch.started is None:
+                batch.started = time.time()
+            full = len(batch.ops) >= self.batch_size or \
+                   batch.size >= self.batch_bytes
+            if full:
+                seq = self._take_batch(index)
+        if full:
+            self._dispatch(index, batch, seq)
+
+    def _take_batch(self, index):
+        """Replace the batch being filled for a worker, with the lock held.
+
+        :returns: The sequence number of the batch replaced, to pass to
+                  :meth:`_dispatch`.
+
+        """
+        self._batches[index] = _Batch()
+        self._batch_seqs[index] += 1
+        self.stats.batches += 1
+        return self._batch_seqs[index]
+
+    def _dispatch(self, index, batch, seq):
+        # Batches taken by different threads are queued in the order they
+        # were taken, so that updates to a document aren't reordered.  The
+        # main lock isn't held here, since the put blocks until the worker
+        # (which needs the main lock) has caught up.
+        cond = self._dispatch_conds[index]
+        with cond:
+            while self._dispatched[index] != seq - 1:
+                cond.wait()
+            # This blocks when the worker has max_pending batches waiting.
+            self._queues[index].put(batch)
+            self._dispatched[index] = seq
+            cond.notify_all()
+
+    def flush(self):
+        """Hand any buffered updates to the workers.
+
+        This doesn't wait for the updates to be sent.
+
+        """
+        with self._lock:
+            pending = [(index, batch, self._take_batch(index))
+                       for (index, batch) in enumerate(self._batches)
+                       if batch.ops]
+        for index, batch, seq in pending:
+            self._dispatch(index, batch, seq)
+
+    def _flush_loop(self):
+        while not self._flush_event.wait(self.flush_interval / 4.0):
+            now = time.time()
+            with self._lock:
+                stale = [(index, batch, self._take_batch(index))
+                         for (index, batch) in enumerate(self._batches)
+                         if batch.started is not None and
+                         now - batch.started >= self.flush_interval]
+            for index, batch, seq in stale:
+                self._dispatch(index, batch, seq)
+
+    def _work(self, q):
+        while True:
+            batch = q.get()
+            if batch is None:
+                return
+            if self._aborted:
+                continue
+            for method, path, payload, seq in batch.ops:
+                self._send(method, path, payload, seq)
+                self._acknowledge(seq)
+
+    def _acknowledge(self, seq):
+        with self._lock:
+            if seq != self._acknowledged + 1:
+                self._acked_ahead.add(seq)
+                return
+            seq += 1
+            while seq in self._acked_ahead:
+                self._acked_ahead.remove(seq)
+                seq += 1
+            self._acknowledged = seq - 1
+
+    def _perform(self, method, path, payload):
+        """Send a single update to the server.
+
+        """
+        limit = self.rate_limit
+        if isinstance(limit, WriteLimiter):
+            limit.acquire(0 if payload is None else len(payload))
+        elif limit is not None:
+            limit.acquire()
+        if payload is None:
+            headers = None
+        else:
+            headers = {'Content-Type': 'application/json'}
+        self._resource.request(method, path=path, payload=payload,
+                               headers=headers, wait=self.wait) \
+            .expect_status(202).json
+
+    def _send(self, method, path, payload, seq=None):
+        try:
+            self._perform(method, path, payload)
+        except Exception:
+            e = sys.exc_info()[1] # Python 2/3 compatibility
+            with self._lock:
+                self.stats.failed += 1
+                if len(self.errors) < self.max_errors_kept:
+                    self.errors.append((method, path, e))
+                    self.failed_seqs.append(seq)
+            return
+        with self._lock:
+            stats = self.stats
+            stats.sent += 1
+            if payload is None:
+                stats.deleted += 1
+            else:
+                stats.added += 1
+                stats.bytes_sent += len(payload)
+
+    def _stop(self):
+        self._closed = True
+        self._flush_event.set()
+        self._flusher.join()
+        for q in self._queues:
+            q.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def abort(self):
+        """Stop the indexer, discarding any updates not yet sent.
+
+        """
+        if self._closed:
+            return
+        self._aborted = True
+        self._stop()
+
+    def close(self):
+        """Send any remaining updates, and wait for them to be indexed.
+
+        :raises: :exc:`restpose.errors.BulkIndexError` if any requests failed,
+                 or if the final checkpoint reported errors.
+
+        """
+        if self._closed:
+            return
+        self.flush()
+        self._stop()
+
+        checkpoint_errors = []
+        checkpoint_total_errors = 0
+        if self.checkpoint:
+            self.final_checkpoint = self._collection \
+                .checkpoint(commit=self.commit).wait()
+            checkpoint_errors = self.final_checkpoint.errors
+            checkpoint_total_errors = self.final_checkpoint.total_errors
+
+        if self.stats.failed or checkpoint_total_errors:
+            raise BulkIndexError(
+                "%d requests failed, %d errors reported by checkpoint" %
+                (self.stats.failed, checkpoint_total_errors),
+                errors=self.errors, total_errors=self.stats.failed,
+                checkpoint_errors=checkpoint_errors,
+                checkpoint_total_errors=checkpoint_total_errors)
+
+
+def _encode_chunk(codec, items, func=None, target_type=None):
+    """Build and encode a chunk of documents, in a worker process.
+
+    :returns: A list of (payload, doc_type, doc_id, key) tuples, where key is
+              the (type, ID) used to choose the worker to send the document.
+
+    """
+    codec = get_codec(codec)
+    dumps = codec.dumps
+    if func is not None:
+        items = six.moves.map(func, items)
+    result = []
+    for doc, doc_type, doc_id in items:
+        key_type = doc_type or target_type
+        if isinstance(doc, ENCODED_TYPES):
+            payload = doc
+            doc = {}
+            if doc_id is None or key_type is None:
+                doc = codec.loads(_as_bytes(payload))
+        else:
+            payload = dumps(doc)
+        result.append((payload, doc_type, doc_id,
+                       _route_key(doc, key_type, doc_id)))
+    return result
+
+
+class EncodingPool(object):
+    """Build and encode documents as JSON in a pool of worker processes.
+
+    """
+    def __init__(self, processes=None, chunk_size=200, max_chunks=None,
+                 codec=None):
+        """
+        :param processes: The number of worker processes.  Defaults to the
+               number of CPUs.
+
+        :param chunk_size: The number of items sent to a worker process at
+               once.
+
+        :param max_chunks: The number of chunks which may be in progress at
+               once.  Defaults to twice the number of processes.
+
+        :param codec: The name of the JSON codec to use.  If None, the
+               fastest available codec is used.
+
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = processes
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks or 2 * processes
+        if codec is not None and not isinstance(codec, six.string_types):
+            codec = codec.name
+        self.codec = codec
+        self._executor = ProcessPoolExecutor(processes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+
+    def imap(self, items, func=None):
+        """Build and encode documents.
+
+        :param items: An iterable of (doc, doc_type, doc_id) tuples, or of
+               items to pass to `func`.  Documents which are already encoded
+               are passed through.
+
+        :param func: A function to call in the worker processes to turn each
+               item into a (doc, doc_type, doc_id) tuple, or None if the
+               items are such tuples.  It must be picklable.
+
+        :returns: An iterator over (payload, doc_type, doc_id) tuples, in the
+                  same order as `items`.  Only `max_chunks` chunks are in
+                  progress at once, so `items` is consumed as the results are.
+
+        """
+        for payload, doc_type, doc_id, _ in self._imap(items, func):
+            yield payload, doc_type, doc_id
+
+    def _imap(self, items, func=None, target_type=None):
+        pending = collections.deque()
+        chunk = []
+        try:
+            for item in items:
+                chunk.append(item)
+                if len(chunk) < self.chunk_size:
+                    continue
+                if len(pending) >= self.max_chunks:
+                    for result in pending.popleft().result():
+                        yield result
+                pending.append(self._executor.submit(
+                    _encode_chunk, self.codec, chunk, func, target_type))
+                chunk = []
+            if chunk:
+                pending.append(self._executor.submit(
+                    _encode_chunk, self.codec, chunk, func, target_type))
+            while pending:
+                for result in pending.popleft().result():
+                    yield result
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def close(self):
+        """Shut down the worker processes.
+
+        """
+        self._executor.shutdown()
+
+
+class AdaptiveIndexer(BulkIndexer):
+    """A bulk indexer which adjusts its concurrency to the server's load.
+
+    The number of requests in progress is controlled by additive increase,
+    multiplicative decrease (AIMD): each accepted request raises the limit a
+    little (by `increase` for each `concurrency` requests accepted), and a
+    request refused because the server's queue is full cuts it by
+    `decrease_factor`.  The limit therefore settles just below the level at
+    which the server starts refusing work.
+
+    Refused updates are resent after a short delay, so they are not lost.
+    This works best with `wait='none'`, which makes the server refuse
+    updates immediately when its queue is full; the server should not be
+    given a :class:`restpose.retry.RetryPolicy` which retries refused
+    requests, since that hides the refusals from the indexer.
+
+    """
+    def __init__(self, target, initial_concurrency=4, min_concurrency=1,
+                 max_concurrency=32, increase=1.0, decrease_factor=0.5,
+                 busy_statuses=(503,), max_resends=20, resend_delay=0.05,
+                 rate_window=5.0, wait='none', batch_size=10, **kwargs):
+        """
+        :param target: The :class:`restpose.client.Collection` or
+               :class:`restpose.client.DocumentType` to send updates to.
+
+        :param initial_concurrency: The initial limit on the number of
+               requests in progress.
+
+        :param min_concurrency: The lowest the limit can fall to.
+
+        :param max_concurrency: The highest the limit can rise to.  This many
+               worker threads are started.
+
+        :param increase: The amount the limit rises for each `concurrency`
+               requests accepted.
+
+        :param decrease_factor: The factor the limit is multiplied by when a
+               request is refused.
+
+        :param busy_statuses: HTTP statuses which indicate that the server
+               refused a request because it is busy.
+
+        :param max_resends: The number of times a refused update is resent
+               before it is counted as failed.
+
+        :param resend_delay: The delay before the first resend of a refused
+               update, in seconds; this doubles for each further resend.
+
+        :param rate_window: The period, in seconds, over which `throughput`
+               is measured.
+
+        :param wait: The type of waiting to use for each request.
+
+        Other parameters are as for :class:`BulkIndexer`.
+
+        """
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.busy_statuses = tuple(busy_statuses)
+        self.max_resends = max_resends
+        self.resend_delay = resend_delay
+        self.rate_window = rate_window
+
+        #: The number of times the server has refused an update.
+        self.refused = 0
+
+        self._limit = float(max(min_concurrency,
+                                min(initial_concurrency, max_concurrency)))
+        self._in_flight = 0
+        self._gate = threading.Condition(threading.Lock())
+        self._last_decrease = 0.0
+        self._rate_start = time.time()
+        self._rate_count = 0
+        self._last_rate = None
+        super(AdaptiveIndexer, self).__init__(target,
+                                              workers=max_concurrency,
+                                              wait=wait,
+                                              batch_size=batch_size,
+                                              **kwargs)
+
+    @property
+    def concurrency(self):
+        """The current limit on the number of requests in progress."""
+        return max(1, int(self._limit))
+
+    @property
+    def in_flight(self):
+        """The number of requests currently in progress."""
+        return self._in_flight
+
+    @property
+    def throughput(self):
+        """The number of updates accepted per second, over the last complete
+        period of `rate_window` seconds (or since the indexer started, if no
+        period has completed yet).
+
+        """
+        with self._gate:
+            now = time.time()
+            self._roll_rate(now)
+            if self._last_rate is not None:
+                return self._last_rate
+            elapsed = now - self._rate_start
+            if elapsed <= 0:
+                return 0.0
+            return self._rate_count / elapsed
+
+    def _roll_rate(self, now):
+        elapsed = now - self._rate_start
+        if elapsed >= self.rate_window:
+            self._last_rate = self._rate_count / elapsed
+            self._rate_start = now
+            self._rate_count = 0
+
+    def _acquire(self):
+        with self._gate:
+            while self._in_flight >= self.concurrency:
+                self._gate.wait()
+            self._in_flight += 1
+            return time.time()
+
+    def _release(self, started, outcome):
+        with self._gate:
+            self._in_flight -= 1
+            if outcome == 'refused':
+                self.refused += 1
+                # Only cut back once for a burst of refusals: requests which
+                # were started before the last cut were sent at the old
+                # concurrency.
+                if started >= self._last_decrease:
+                    self._limit = max(self.min_concurrency,
+                                      self._limit * self.decrease_factor)
+                    self._last_decrease = time.time()
+            elif outcome == 'accepted':
+                self._rate_count += 1
+                self._roll_rate(time.time())
+                self._limit = min(self.max_concurrency,
+                                  self._limit + self.increase / self._limit)
+            self._gate.notify_all()
+
+    def _perform(self, method, path, payload):
+        delay = self.resend_delay
+        resends = 0
+        while True:
+            started = self._acquire()
+            try:
+                super(AdaptiveIndexer, self)._perform(method, path, payload)
+            except ResourceError:
+                e = sys.exc_info()[1] # Python 2/3 compatibility
+                refused = e.status_int in self.busy_statuses
+                self._release(started, refused and 'refused' or 'failed')
+                if not refused or resends >= self.max_resends or \
+                   self._aborted:
+                    raise
+            except Exception:
+                self._release(started, 'failed')
+                raise
+            else:
+                self._release(started, 'accepted')
+                return
+            resends += 1
+            time.sleep(random.uniform(delay / 2, delay))
+            delay = min(delay * 2, 1.0)
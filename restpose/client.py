@@ -14,11 +14,35 @@ Python objects.
 
 """
 
+import copy
+import functools
 import six
+import threading
+import time
+from restkit import ResourceNotFound
+from six.moves.urllib.parse import urlsplit, unquote
 from .resource import RestPoseResource
-from .query import Query, QueryAll, QueryNone, QueryField, QueryMeta, \
-                   SearchResults
-from .errors import RestPoseError, CheckPointExpiredError
+from .bulk import BulkIndexer, CopyStats, ENCODED_TYPES
+from .codec import get_codec
+from .coalesce import SingleFlight, CheckPointCoalescer, search_key
+from .ratelimit import TokenBucket
+from .query import SearchResults
+from .target import QueryBuilder, FieldQueryFactory, FieldQuerySource, \
+                    Field, AnyField, _first
+from .errors import RestPoseError, CheckPointExpiredError, \
+                    CheckPointTimeoutError, CopyVerificationError
+
+def _header(resp, name):
+    """Get the value of a response header, or None if it isn't present.
+
+    :param name: The name of the header, in lower case.
+
+    """
+    headers = getattr(resp, 'headers', None) or {}
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
 
 class Server(object):
     """Representation of a RestPose server.
@@ -47,12 +71,53 @@ class Server(object):
     #:    accessed using checkpoints.
     wait = "process"
 
+    #: The :class:`restpose.coalesce.SingleFlight` used to coalesce
+    #: identical concurrent searches, or None if searches aren't coalesced.
+    search_flight = None
+
+    #: The :class:`restpose.coalesce.CheckPointCoalescer` used to merge
+    #: checkpoints requested concurrently on the same collection, or None if
+    #: checkpoints aren't coalesced.
+    checkpoint_coalescer = None
+
+    #: The :class:`restpose.hedge.HedgePolicy` used to hedge searches and
+    #: document fetches, or None if requests aren't hedged.
+    hedge = None
+
+    #: The longest time, in seconds, for which the server is asked to hold
+    #: a request for the state of a checkpoint open until the checkpoint is
+    #: reached (see :meth:`CheckPoint.wait`).  If 0, checkpoints are polled.
+    checkpoint_long_poll = 0
+
+    #: The :class:`restpose.ratelimit.WriteLimiter` limiting document
+    #: additions and deletions to all collections, or None for no limit.
+    #: This may be replaced at any time.
+    write_limit = None
+
     def __init__(self, uri='http://127.0.0.1:7777',
                  resource_class=None,
                  resource_instance=None,
+                 max_idle=None,
+                 max_per_host=None,
+                 idle_timeout=None,
+                 max_lifetime=None,
+                 prewarm=0,
+                 coalesce_searches=False,
+                 coalesce_checkpoints=False,
+                 hedge=None,
+                 write_limit=None,
+                 checkpoint_long_poll=None,
                  **client_opts):
         """
-        :param uri: Full URI to the top path of the server.
+        :param uri: Full URI to the top path of the server.  This may also be
+               a list of URIs of servers holding replicas of the same data, in
+               which case searches and other reads are balanced across them,
+               and writes are sent to the first URI in the list.  See
+               :mod:`restpose.balancer` for the options which may be passed in
+               `client_opts` to control this.  For a server on the same host,
+               this may be a `unix://` URI holding the path of the server's
+               Unix domain socket; for example,
+               `unix:///var/run/restpose.sock`.
 
         :param resource_class: If specified, defines a resource class to use
                instead of the default class.  This should usually be a subclass
@@ -62,24 +127,162 @@ class Server(object):
                use instead of making one with the default class (or the class
                specified by `resource_class`.
 
+        :param max_idle: The maximum number of idle connections to the
+               server (to each server, if several URIs are given) to keep
+               open for reuse.  This doesn't limit the number of requests
+               made at once (see `max_per_host`); connections opened beyond
+               it are closed after use.  Setting this, or any of
+               `max_per_host`, `idle_timeout`, `max_lifetime` or `prewarm`,
+               gives the server its own
+               :class:`restpose.pool.RestPosePool` instead of using
+               restkit's shared pool; statistics for the pool are then
+               available from `pool_stats`.  Servers with a `unix://` URI
+               always have their own pool.  Defaults to 10.
+
+        :param max_per_host: The maximum number of connections to each
+               server which may be in use at once.  Requests beyond this wait
+               for a connection to be released.  Defaults to no limit.
+
+        :param idle_timeout: The number of seconds that an unused connection
+               may be kept open for.  Defaults to no limit.
+
+        :param max_lifetime: The maximum age, in seconds, of a connection
+               before it is closed rather than reused.  Defaults to 600.
+               This doesn't limit how long a request may take; restkit's
+               `timeout` option sets the socket timeout for that.
+
+        :param prewarm: The number of connections to open to each server URI
+               when the server object is created, rather than waiting for the
+               first requests.
+
+        :param coalesce_searches: If True, identical searches made
+               concurrently from several threads share a single request to
+               the server (see :mod:`restpose.coalesce`).  A
+               :class:`restpose.coalesce.SingleFlight` object may also be
+               supplied, to share coalescing between several servers.
+
+        :param coalesce_checkpoints: If not False, checkpoints requested on
+               the same collection while one is being set, or within this
+               many seconds of each other, are merged into a single
+               checkpoint (see :mod:`restpose.coalesce`).  True merges
+               checkpoints without waiting for others.  A
+               :class:`restpose.coalesce.CheckPointCoalescer` object may also
+               be supplied.
+
+        :param hedge: A :class:`restpose.hedge.HedgePolicy` object, to send a
+               duplicate request when a search or document fetch is slow.  If
+               None, requests are not hedged.
+
+        :param write_limit: A :class:`restpose.ratelimit.WriteLimiter`, to
+               limit the rate of document additions and deletions to all
+               collections.  If None, writes are not limited.
+
+        :param checkpoint_long_poll: The longest time, in seconds, for which
+               the server is asked to hold a request for the state of a
+               checkpoint open; 30 is a reasonable value.  Long-polling
+               isn't part of the standard RestPose API, so the first wait
+               sends a `long_poll` parameter as a probe, and falls back to
+               polling if the response shows the server doesn't support it.
+               Defaults to 0: checkpoints are always polled.
+
         :param client_opts: Parameters to use to update the existing
                client_opts in the resource (if `resource_instance` is
                specified), or to use when creating the resource (if
-               `resource_class` is specified).
+               `resource_class` is specified).  For example, `codec` may be
+               used to select the JSON codec used for requests and responses
+               (see :mod:`restpose.codec`), and `retry` to retry requests
+               refused because the server is busy (see :mod:`restpose.retry`).
 
         """
-        self.uri = uri = uri.rstrip('/')
+        if isinstance(uri, six.string_types):
+            uris = [uri.rstrip('/')]
+        else:
+            uris = [u.rstrip('/') for u in uri]
+        self.uri = uris[0]
+
+        socket_path = None
+        if uris[0].startswith('unix://'):
+            if len(uris) > 1:
+                raise ValueError("A unix:// URI can only be used for a "
+                                 "single server")
+            socket_path = unquote(uris[0][len('unix://'):])
+            # Requests are sent as normal HTTP requests, over connections
+            # made to the socket by the pool.
+            uris = ['http://localhost']
+        uri = uris[0]
 
         if resource_class is not None:
             self._resource_class = resource_class
 
+        pool = None
+        if max_idle is not None or max_per_host is not None or \
+           idle_timeout is not None or max_lifetime is not None or \
+           prewarm or socket_path is not None:
+            from .pool import RestPosePool, UnixConnection
+            pool_opts = dict(
+                max_idle=(max_idle or 10) * len(uris),
+                max_per_host=max_per_host,
+                idle_timeout=idle_timeout)
+            if max_lifetime is not None:
+                pool_opts['max_lifetime'] = max_lifetime
+            if socket_path is not None:
+                pool_opts['factory'] = functools.partial(
+                    UnixConnection, socket_path=socket_path)
+            pool = client_opts['pool'] = RestPosePool(**pool_opts)
+
         if resource_instance:
             self._resource = resource_instance.clone()
             self._resource.initial['uri'] = uri
             self._resource.client_opts.update(client_opts)
+        elif len(uris) > 1:
+            from .balancer import BalancedResource
+            self._resource = BalancedResource(
+                uris, resource_class=self._resource_class, **client_opts)
         else:
             self._resource = self._resource_class(uri, **client_opts)
 
+        if coalesce_searches:
+            if coalesce_searches is True:
+                coalesce_searches = SingleFlight()
+            self.search_flight = coalesce_searches
+        if coalesce_checkpoints is not False and \
+           coalesce_checkpoints is not None:
+            if coalesce_checkpoints is True:
+                coalesce_checkpoints = CheckPointCoalescer()
+            elif not isinstance(coalesce_checkpoints, CheckPointCoalescer):
+                coalesce_checkpoints = CheckPointCoalescer(
+                    coalesce_checkpoints)
+            self.checkpoint_coalescer = coalesce_checkpoints
+        self.hedge = hedge
+        self.write_limit = write_limit
+        if checkpoint_long_poll is not None:
+            self.checkpoint_long_poll = checkpoint_long_poll
+        # Whether the server holds checkpoint requests open: None until
+        # known.
+        self._long_poll_supported = None
+
+        if pool is not None and prewarm:
+            for u in uris:
+                parts = urlsplit(u)
+                is_ssl = (parts.scheme == 'https')
+                pool.prewarm(parts.hostname,
+                             parts.port or (is_ssl and 443 or 80),
+                             prewarm, is_ssl=is_ssl)
+
+    @property
+    def pool_stats(self):
+        """Statistics for the connection pool used by this server.
+
+        Returns a :class:`restpose.pool.PoolStats` object, or None if the
+        server is using restkit's shared connection pool (which doesn't keep
+        statistics).
+
+        """
+        pool = self._resource.client_opts.get('pool')
+        if pool is None or not hasattr(pool, 'stats'):
+            return None
+        return pool.stats
+
     @property
     def status(self):
         """Get server status.
@@ -99,11 +302,15 @@ class Server(object):
         """
         return list(self._resource.get('/coll').expect_status(200).json.keys())
 
-    def collection(self, coll_name):
+    def collection(self, coll_name, write_limit=None):
         """Access to a collection.
 
         :param coll_name: The name of the collection to access.
 
+        :param write_limit: A :class:`restpose.ratelimit.WriteLimiter`, to
+               limit the rate of document additions and deletions made
+               through the returned object, instead of the server's limit.
+
         :returns: a Collection object which can be used to search and modify the
                   contents of the Collection.
 
@@ -114,423 +321,118 @@ class Server(object):
                   collection name containing invalid characters is used.
 
         """
-        return Collection(self, coll_name)
-
-
-class FieldQueryFactory(object):
-    """Object for creating searches on a field.
-
-    """
-
-    def __init__(self, target=None):
-        """
-        :param target: The target to pass to the Query objects created.
-
-        """
-        #: The target that will be used when creating Query objects.  Defaults
-        #: to None.
-        self.target = target
-
-    def __call__(self, fieldname):
-        """Create a FieldQuerySource for the given fieldname.
+        return Collection(self, coll_name, write_limit)
 
-        This is mainly intended for use for fieldnames which are stored in a
-        parameter, or which are reserved or invalid Python identifiers.
 
-        """
-        return FieldQuerySource(fieldname, self.target)
-
-    def __getattr__(self, fieldname):
-        """Get a FieldQuerySource for the given fieldname.
-
-        The FieldQuerySource has various operators used to build queries.
-
-        """
-        return FieldQuerySource(fieldname, self.target)
-
-
-class FieldQuerySource(object):
-    """An object which generates queries for a specific field.
+class QueryTarget(QueryBuilder):
+    """An object which can be used to make and run queries.
 
     """
-    def __init__(self, fieldname, target=None):
-        """
-        :param fieldname: The name of the field to generate queries for.  If
-               set to None, will generate queries across all fields.
-        :param target: The target to generate queries pointing to.
-
-        """
-        self.fieldname = fieldname
-        self.target = target
-
-    def is_in(self, values):
-        """Create a query for fields which exactly match the given values.
-
-        A document will match if at least one of the stored values for the
-        field exactly matches at least one of the given values.
-
-        This query type is currently available only for "exact", "id" and "cat"
-        field types.
-
-        :param value: A container holding the values to search for.  As a
-               special case, if a string is supplied, this is equivalent to
-               supplying a container holding that string.
-
-        :example:
-
-            Search for documents in which the "tag" field has a value of
-            "edam", "cheddar" or "leicester".
-
-            >>> query = coll.field.tag.is_in(['edam', 'cheddar', 'leicester'])
-
-            Search for documents in which the "tag" field has a value of
-            "edam".
-
-            >>> query = coll.field.tag.is_in('edam')
-
-        """
-        return QueryField(self.fieldname, 'is', values, target=self.target)
-
-    def is_descendant(self, categories):
-        """Create a query for field values which are categories which are
-        descendants of one of the given categories.
-
-        A document will match if at least one of the stored values for the
-        field exactly matches a descendant of the given categories.
-
-        This query type is available only for "cat" field types.
-
-        :param categories: A container holding the categories to search for.
-               As a special case, if a string is supplied, this is equivalent
-               to supplying a container holding that string.
-
-        :example:
-
-            Search for documents in which the "tag" field is a descendant of
-            a value of "cheese"
-
-            >>> query = coll.field.tag.is_descendant('cheese')
-
-            or, equivalently:
-
-            >>> query = coll.field.tag.is_descendant(['cheese'])
-
-        """
-        return QueryField(self.fieldname, 'is_descendant', categories,
-                          target=self.target)
-
-    def is_or_is_descendant(self, categories):
-        """Create a query for field values which are categories which are
-        descendants of one of the given categories.
-
-        A document will match if at least one of the stored values for the
-        field exactly matches a descendant of the given categories.
-
-        This query type is available only for "cat" field types.
-
-        :param categories: A container holding the categories to search for.
-               As a special case, if a string is supplied, this is equivalent
-               to supplying a container holding that string.
-
-        :example:
-
-            Search for documents in which the "tag" field has a value of
-            "cheese", or has a value which is a descendant of "cheese".
-
-            >>> query = coll.field.tag.is_or_is_descendant('cheese')
-
-            or, equivalently:
-
-            >>> query = coll.field.tag.is_or_is_descendant(['cheese'])
-
-        """
-        return QueryField(self.fieldname, 'is_or_is_descendant', categories,
-                          target=self.target)
-
-    def __eq__(self, value):
-        """Create a query for fields which exactly match the given value.
-
-        Matches documents in which the supplied value exactly matches the
-        stored value.
-
-        This query type is currently available only for "exact", "id" and "cat"
-        field types.
-
-        This query type may be constructed using the == operator, or the
-        ``equals`` method.
-
-        :param value: The value to search for.
-
-        :example:
-
-            Search for documents in which the "tag" field has a value of
-            "edam".
-
-            >>> query = coll.field.tag.equals('edam')
-
-            Or, equivalently (but less conveniently for chained calls)
-
-            >>> query = (coll.field.tag == 'edam')
-
-        """
-        return QueryField(self.fieldname, 'is', (value,), target=self.target)
-    equals = __eq__
-
-    def range(self, begin, end):
-        """Create a query for field values in a given range.
-
-        Matches documents in which one of the stored values in the field are in
-        the specified range, including both the begin and end values.
-
-        This type is currently available only for "double", "date" and
-        "timestamp" field types.
-
-        :param begin: The start of the range.
-        :param end: The end of the range.
-
-        :example:
-
-            Search for documents in which the "num" field has a value in the
-            range 0 to 10 (including the endpoints).
-
-            >>> query = coll.field.num.range(0, 10)
-
-        """
-        return QueryField(self.fieldname, 'range', (begin, end),
-                          target=self.target)
-
-    def distscore(self, center, max_range=None):
-        """Create a query for geospatial field values based on distance.
-
-        Matches documents in which one of the stored values in the field is
-        within the specified range of the center point (in meters on the
-        surface of the earth).
-
-        This type is currently available only for "lonlat" field types.
-
-        :param center: The center for the query.  Either a (lon, lat) tuple, or
-                       an object with "lon" and "lat" properties; in either
-                       case, the longitude and latitude must be stored as
-                       numbers.
-        :param max_range: The maximum range (in meters) of documents to return;
-                       if None, returns documents with no maximum range.  
-
-        :example:
-
-            Search for documents in which the "num" field has a value in the
-            range 0 to 10 (including the endpoints).
-
-            >>> query = coll.field.latlon.distscore([0.0, 0.0], 1609.344)
-
-        """
-        params = dict(center = center)
-        if max_range is not None:
-            params['max_range'] = max_range
-        return QueryField(self.fieldname, 'distscore', params,
-                          target=self.target)
-
-
-    def text(self, text, op="phrase", window=None):
-        """Create a query for a piece of text in the field.
-
-        This is a simple search for a matching sequences of words (subject to
-        whatever processing has been performed on the field to conflate variant
-        forms of words, such as stemming or word splitting for CJK text).
-
-        :param text: The text to search for.  If empty, this query will
-               match no results.
-        :param op: The operator to use when searching.  One of "or", "and",
-               "phrase" (ordered proximity), "near" (unordered proximity).
-               Default="phrase".
-        :param window: Only relevant if op is "phrase" or "near". Window size
-               in words within which the words in the text need to occur for a
-               document to match; None=length of text. Integer or None.
-               Default=None
-
-        :example:
-
-            Search for documents in which the "text" field contains text
-            matching the phrase "Hello world".
-
-            >>> query = coll.field.text.text("Hello world")
-
-        """
-        value = dict(text=text)
-        if op is not None:
-            value['op'] = op
-        if window is not None:
-            value['window'] = window
-        return QueryField(self.fieldname, 'text', value, target=self.target)
-
-    def parse(self, text, op="and"):
-        """Parse a structured query, searching the field.
-
-        Unlike text, this allows various operators to be used in the query; for
-        example, parentheses may be used, and operators such as "AND" may be
-        used 
-
-        .. todo:: Document the operators permitted.
-
-        Beware that the parser is unable to make sense of some query strings
-        (eg, those with mismatched parentheses).  If such a query string is
-        used, an error will be returned by the server when the search is
-        performed.
-
-        :param fieldname: The field to search within.
-        :param text: Text to search for.  If empty, this query will match no
-               results.
-        :param op: The default operator to use when searching.  One of "or",
-               "and".  Default="and".
-
-        :example:
-
-            Search for documents in which the "text" field contains both
-            "Hello" and "world", but not "big".
-
-            >>> query = coll.field.text.text("Hello world -big")
-
-        """
-        value = dict(text=text)
-        if op is not None:
-            value['op'] = op
-        return QueryField(self.fieldname, 'parse', value, target=self.target)
-
-    def exists(self):
-        """Search for documents in which the field exists.
-
-        This type may be used to search across all fields.
-
-        :example:
-
-            Search for documents in which the "text" field exists.
-
-            >>> query = coll.field.text.exists()
-
-            Search for documents in which any field exists.
-
-            >>> query = coll.any_field.exists()
-
-        """
-        return QueryMeta('exists', (self.fieldname,), target=self.target)
-
-    def nonempty(self):
-        """Search for documents in which the field has a non-empty value.
-
-        This type may be used to search across all fields.
-
-        :example:
-
-            Search for documents in which the "text" field has a non-empty
-            value.
-
-            >>> query = coll.field.text.nonempty()
-
-            Search for documents in which any field has a non-empty value.
-
-            >>> query = coll.any_field.nonempty()
-
-        """
-        return QueryMeta('nonempty', (self.fieldname,), target=self.target)
-
-    def empty(self):
-        """Search for documents in which the field has an empty value.
-
-        This type may be used to search across all fields.
-
-        :example:
-
-            Search for documents in which the "text" field has an empty
-            value.
-
-            >>> query = coll.field.text.empty()
-
-            Search for documents in which any field has an empty value.
+    def search(self, search):
+        """Perform a search.
 
-            >>> query = coll.any_field.empty()
+        :param search: is a search structure to be sent to the server, or a
+                       Search or Query object.
 
         """
-        return QueryMeta('empty', (self.fieldname,), target=self.target)
-
-    def has_error(self):
-        """Search for documents in which the field produced errors when
-        parsing.
-
-        This type may be used to search across all fields.
+        if hasattr(search, '_build_search'):
+            body = search._build_search()
+            realiser = search._realiser
+        else:
+            body = search
+            realiser = None
+        path = self._basepath + "/search"
+        perform = lambda: self._resource.post(path, payload=body) \
+            .expect_status(200).json
+        hedge = self._server.hedge
+        if hedge is not None:
+            perform = lambda perform=perform: hedge.call(perform)
+        flight = self._server.search_flight
+        if flight is None:
+            result = perform()
+        else:
+            result, shared = flight.do(
+                search_key(self._server.uri, self._basepath, body,
+                           getattr(self._resource, 'codec', None)), perform)
+            if shared:
+                # Other callers have the same result.
+                result = copy.deepcopy(result)
+        return SearchResults(result, realiser or self._realiser)
 
-        :example:
+    def matching_ids(self, query, page_size=1000):
+        """Get the types and IDs of all documents matching a query.
 
-            Search for documents in which the "text" field had an error when
-            parsing.
+        The results are fetched a page at a time, so documents added or
+        removed while this runs may be missed or repeated.
 
-            >>> query = coll.field.text.has_error()
+        :param query: A Query (or other Searchable) to match documents with.
 
-            Search for documents in which any field had an error when parsing.
+        :param page_size: The number of results to get in each request.
 
-            >>> query = coll.any_field.has_error()
+        :returns: A list of (doc_type, doc_id) tuples.  Documents are
+                  identified by their "type" and "id" fields.
 
         """
-        return QueryMeta('error', (self.fieldname,), target=self.target)
-
-
-Field = FieldQueryFactory()
-AnyField = FieldQuerySource(fieldname=None)
-
-class QueryTarget(object):
-    """An object which can be used to make and run queries.
+        query = query.set_target(self)
+        result = []
+        offset = 0
+        while True:
+            results = self.search(query._build_search(offset=offset,
+                                                      size=page_size))
+            for item in results:
+                result.append((_first(item.data.get('type')),
+                               _first(item.data.get('id'))))
+            offset += len(results)
+            if len(results) < page_size or \
+               offset >= results.matches_upper_bound:
+                return result
 
-    """
-    def __init__(self):
-        #: Factory for field-specific queries.
-        self.field = FieldQueryFactory(target=self)
+    def delete_matching(self, query, rate=None, workers=8, page_size=1000,
+                        checkpoint=True, commit=True):
+        """Delete all documents matching a query.
 
-        #: Pseudo field for making queries across all fields.
-        self.any_field = FieldQuerySource(fieldname=None, target=self)
+        The IDs of the matching documents are fetched first, so that
+        deleting documents doesn't change the results being paged through,
+        and are then deleted in parallel.
 
-        self._realiser = None
+        :param query: A Query (or other Searchable) to match documents with.
 
-    def all(self):
-        """Create a query which matches all documents."""
-        return QueryAll(target=self)
+        :param rate: The most deletions to send per second, or a
+               :class:`restpose.ratelimit.TokenBucket` to limit deletions
+               with (which may be shared with other writers).  If None,
+               deletions are not limited.
 
-    def none(self):
-        """Create a query which matches no documents."""
-        return QueryNone(target=self)
+        :param workers: The number of threads sending deletions.
 
-    def find(self, q):
-        """Apply a Query to this QueryTarget.
+        :param page_size: The number of results to get in each search
+               request.
 
-        :param q: A Query object which will have the target applied to it.
+        :param checkpoint: If True, set a checkpoint once the deletions have
+               been sent, and wait for it to be reached.
 
-        """
-        return q.set_target(self)
+        :param commit: If True, the checkpoint causes a commit.
 
-    def set_realiser(self, realiser):
-        """Set the function to get objects associated with results.
+        :returns: The number of documents deleted.
 
-        This may be overridden for a particular search by setting a realiser on
-        a Searchable.
+        :raises: :exc:`restpose.errors.BulkIndexError` if any deletions
+                 failed.
 
         """
-        self._realiser = realiser
-        return self
-
-    def search(self, search):
-        """Perform a search.
-
-        :param search: is a search structure to be sent to the server, or a
-                       Search or Query object.
-
-        """
-        if hasattr(search, '_build_search'):
-            body = search._build_search()
-            realiser = search._realiser
-        else:
-            body = search
-            realiser = None
-        result = self._resource \
-            .post(self._basepath + "/search", payload=body) \
-            .expect_status(200).json
-        return SearchResults(result, realiser or self._realiser)
+        if rate is not None and not hasattr(rate, 'acquire'):
+            rate = TokenBucket(rate)
+        doc_ids = self.matching_ids(query, page_size)
+        indexer = BulkIndexer(self, workers=workers, checkpoint=checkpoint,
+                              commit=commit, rate_limit=rate)
+        try:
+            for doc_type, doc_id in doc_ids:
+                if doc_type is None or doc_id is None:
+                    continue
+                indexer.delete(doc_id, doc_type=doc_type)
+        except BaseException:
+            indexer.abort()
+            raise
+        indexer.close()
+        return indexer.stats.deleted
 
 
 class Document(object):
@@ -538,10 +440,12 @@ class Document(object):
         if collection is None:
             # doc_type should be a DocumentType object.
             self._resource = doc_type._resource
+            self._hedge = doc_type._server.hedge
             self._path = doc_type._basepath + '/id/' + doc_id
         else:
             # doc_type should be a string.
             self._resource = collection._resource
+            self._hedge = collection._server.hedge
             self._path = collection._basepath + '/type/' + doc_type + \
                          '/id/' + doc_id
         self._data = None
@@ -550,7 +454,12 @@ class Document(object):
         self._raw = None
 
     def _fetch(self):
-        self._raw = self._resource.get(self._path).expect_status(200).json
+        perform = lambda: self._resource.get(self._path) \
+            .expect_status(200).json
+        if self._hedge is not None:
+            self._raw = self._hedge.call(perform)
+        else:
+            self._raw = perform()
         self._data = self._raw.get('data', {})
         self._terms = self._raw.get('terms', {})
         self._values = self._raw.get('values', {})
@@ -582,6 +491,7 @@ class DocumentType(QueryTarget):
         self.name = doc_type
 
         self._basepath = collection._basepath + '/type/' + doc_type
+        self._collection = collection
         self._server = collection._server
         self._resource = collection._resource
         self._realiser = collection._realiser
@@ -608,32 +518,35 @@ class DocumentType(QueryTarget):
 
         wait = wait or self._server.wait
         if use_put:
-            resp = self._resource.put(path, payload=doc, wait=wait)
+            meth = self._resource.put
         else:
-            resp = self._resource.post(path, payload=doc, wait=wait)
-
-        return resp.expect_status(202).json
+            meth = self._resource.post
+        return self._collection._write(meth, path, doc, wait)
 
     def delete_doc(self, doc_id, wait=None):
         """Delete a document with this type from the collection.
 
         """
         path = '%s/id/%s' % (self._basepath, doc_id)
-        return self._resource \
-            .delete(path, wait=wait or self._server.wait) \
-            .expect_status(202).json
+        return self._collection._write(self._resource.delete, path, None,
+                                       wait or self._server.wait)
 
     def get_doc(self, doc_id):
         return Document(None, self, doc_id)
 
 
 class Collection(QueryTarget):
-    def __init__(self, server, coll_name):
+    def __init__(self, server, coll_name, write_limit=None):
         super(Collection, self).__init__()
 
         #: The name of the collection
         self.name = coll_name
 
+        #: The :class:`restpose.ratelimit.WriteLimiter` limiting document
+        #: additions and deletions made through this object (and its
+        #: document types), or None to use the server's limit.
+        self.write_limit = write_limit
+
         self._basepath = '/coll/' + coll_name
         self._resource = server._resource
         self._server = server
@@ -688,7 +601,7 @@ class Collection(QueryTarget):
             meth = self._resource.post
 
         wait = wait or self._server.wait
-        return meth(path, payload=doc, wait=wait).expect_status(202).json
+        return self._write(meth, path, doc, wait)
 
     def delete_doc(self, doc_type, doc_id, wait=None):
         """Delete a document from the collection.
@@ -699,7 +612,35 @@ class Collection(QueryTarget):
         """
         path = '%s/type/%s/id/%s' % (self._basepath, doc_type, doc_id)
         wait = wait or self._server.wait
-        return self._resource.delete(path, wait=wait).expect_status(202).json
+        return self._write(self._resource.delete, path, None, wait)
+
+    def _active_write_limit(self):
+        if self.write_limit is not None:
+            return self.write_limit
+        return self._server.write_limit
+
+    def _write(self, meth, path, doc, wait):
+        """Send a document addition or deletion, within the write limit.
+
+        When there is a limit, documents are encoded here, so that the size
+        of the request body can be counted.
+
+        """
+        limit = self._active_write_limit()
+        if limit is None:
+            if doc is None:
+                return meth(path, wait=wait).expect_status(202).json
+            return meth(path, payload=doc, wait=wait).expect_status(202).json
+        if doc is None:
+            limit.acquire(0)
+            return meth(path, wait=wait).expect_status(202).json
+        if not isinstance(doc, ENCODED_TYPES):
+            codec = getattr(self._resource, 'codec', None) or get_codec()
+            doc = codec.dumps(doc)
+        limit.acquire(len(doc))
+        return meth(path, payload=doc,
+                    headers={'Content-Type': 'application/json'},
+                    wait=wait).expect_status(202).json
 
     def get_doc(self, doc_type, doc_id):
         """Get a document from the collection.
@@ -721,9 +662,21 @@ class Collection(QueryTarget):
         :param wait: The type of waiting to use.  Defaults to that specified by
                server.wait.
 
+        If the server coalesces checkpoints, the checkpoint returned may be
+        shared with other callers.
+
         """
+        wait = wait or self._server.wait
+        coalescer = self._server.checkpoint_coalescer
+        if coalescer is not None:
+            return coalescer.checkpoint(
+                (self._server.uri, self._basepath, wait),
+                functools.partial(self._checkpoint, wait=wait), commit)
+        return self._checkpoint(commit, wait)
+
+    def _checkpoint(self, commit, wait):
         path = self._basepath + "/checkpoint"
-        params_dict = {'wait': wait or self._server.wait}
+        params_dict = {'wait': wait}
         if commit:
             params_dict['commit'] = '1'
         else:
@@ -733,6 +686,136 @@ class Collection(QueryTarget):
                           .expect_status(201)
                           .json)
 
+    def _doc_count(self):
+        """Get the number of documents in the collection, or 0 if the
+        collection doesn't exist.
+
+        The count is read from the primary server, as for checkpoints, so
+        that it includes every update before a checkpoint once the
+        checkpoint has been reached; a replica may lag behind.
+
+        """
+        resource = self._resource
+        from .balancer import BalancedResource
+        if isinstance(resource, BalancedResource):
+            resource = resource.primary.resource
+        try:
+            return resource.get(self._basepath).expect_status(200) \
+                .json.get('doc_count', 0)
+        except ResourceNotFound:
+            return 0
+
+    def copy_to(self, other, transform=None, partitions=4, page_size=500,
+                workers=8, rate=None, verify=True):
+        """Copy every document in this collection to another collection.
+
+        The documents are read in `partitions` ranges in parallel, by paging
+        through a search for all documents, and are written with a
+        :class:`restpose.bulk.BulkIndexer`.  The stored fields of each
+        document are copied; fields which aren't stored can't be copied.  The
+        collection shouldn't be modified while it is being copied.
+
+        :param other: The :class:`Collection` to copy to.  This may be on
+               another server, and will usually have a different config.
+
+        :param transform: A function to call with each document (a
+               dictionary of field values) before it is written.  It should
+               return the document to write, or None to skip the document.
+               It is called from several threads at once.
+
+        :param partitions: The number of ranges of documents to read in
+               parallel.
+
+        :param page_size: The number of documents to get in each search
+               request.
+
+        :param workers: The number of threads writing documents.
+
+        :param rate: The most documents to write per second, or a
+               :class:`restpose.ratelimit.TokenBucket` to limit writes with.
+
+        :param verify: If True, and the target collection was empty, check
+               that it holds the number of documents written once the final
+               checkpoint has been reached.  The counts are read from the
+               primary server, if there are replicas.
+
+        :returns: A :class:`restpose.bulk.CopyStats` object.
+
+        :raises: :exc:`restpose.errors.BulkIndexError` if any writes failed,
+                 or :exc:`restpose.errors.CopyVerificationError` if the
+                 number of documents in the target is wrong.  If reading a
+                 range of documents fails (or `transform` raises an
+                 exception), the other ranges stop after their current page,
+                 unsent documents are discarded, and the exception is
+                 raised.
+
+        """
+        from concurrent.futures import ThreadPoolExecutor, wait, \
+             FIRST_EXCEPTION
+        if rate is not None and not hasattr(rate, 'acquire'):
+            rate = TokenBucket(rate)
+        stats = CopyStats()
+        stats.source_count = self._doc_count()
+        target_was_empty = verify and other._doc_count() == 0
+        indexer = BulkIndexer(other, workers=workers, rate_limit=rate)
+        lock = threading.Lock()
+        stopping = threading.Event()
+
+        def copy_range(start, end):
+            query = self.all()
+            offset = start
+            while offset < end and not stopping.is_set():
+                size = min(page_size, end - offset)
+                results = self.search(query._build_search(offset=offset,
+                                                          size=size))
+                read = written = 0
+                for item in results:
+                    doc = item.data
+                    if transform is not None:
+                        doc = transform(doc)
+                    read += 1
+                    if doc is not None:
+                        indexer.add(doc, doc_type=_first(doc.get('type')),
+                                    doc_id=_first(doc.get('id')))
+                        written += 1
+                with lock:
+                    stats.read += read
+                    stats.written += written
+                    stats.skipped += read - written
+                if len(results) < size:
+                    return
+                offset += len(results)
+
+        total = stats.source_count
+        step = max(1, -(-total // max(1, partitions)))
+        executor = ThreadPoolExecutor(max(1, partitions))
+        try:
+            futures = [executor.submit(copy_range, start,
+                                       min(start + step, total))
+                       for start in range(0, total, step)]
+            # Stop as soon as any range fails, rather than waiting for the
+            # ranges before it to finish.
+            done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in futures:
+                if future in done:
+                    future.result()
+        except BaseException:
+            stopping.set()
+            executor.shutdown()
+            indexer.abort()
+            raise
+        executor.shutdown()
+        indexer.close()
+
+        if verify:
+            stats.target_count = other._doc_count()
+            if target_was_empty and stats.target_count != stats.written:
+                raise CopyVerificationError(
+                    "Expected %d documents in %s, found %d" %
+                    (stats.written, other.name, stats.target_count),
+                    expected=stats.written, actual=stats.target_count)
+        return stats
+
     def taxonomies(self):
         """Get a list of the taxonomy names.
 
@@ -757,6 +840,15 @@ class CheckPoint(object):
     """A checkpoint, used to check the progress of indexing.
 
     """
+
+    #: The initial interval between polls of the server in :meth:`wait`, in
+    #: seconds.
+    min_poll = 0.005
+
+    #: The maximum interval between polls of the server in :meth:`wait`, in
+    #: seconds.
+    max_poll = 1.0
+
     def __init__(self, collection, response):
         """Create a CheckPoint object.
 
@@ -769,12 +861,25 @@ class CheckPoint(object):
         self._check_id = response.get('checkid')
         self._basepath = collection._basepath + '/checkpoint/' + self._check_id
         self._resource = collection._resource
+        self._server = collection._server
 
         # The raw representation of the checkpoint, as returned from the
         # request, or None if the checkpoint hasn't been reached or expired, or
         # 'expired' if the checkpoint has expired.
         self._raw = None
 
+        # Guards the state below.  Only one thread polls the server at a
+        # time; any others wait for it, and share its result.
+        self._cond = threading.Condition()
+        self._polling = False
+
+        #: The number of times the server has been asked for the state of
+        #: the checkpoint.
+        self.polls = 0
+
+        #: The total time spent in :meth:`wait`, in seconds.
+        self.waited = 0.0
+
     @property
     def check_id(self):
         """The ID of the checkpoint.
@@ -784,21 +889,51 @@ class CheckPoint(object):
         """
         return self._check_id
 
-    def _refresh(self):
+    def _refresh(self, long_poll=None):
         """Contact the server, and get the status of the checkpoint.
 
         If the checkpoint referred to by this Checkpoint instance has
         previously been found to have been reached or expired, this doesn't
         contact the server, since the checkpoint should no longer change at
-        this point.
+        this point.  If another thread is already asking the server, this
+        waits for its answer instead of asking again.
+
+        :param long_poll: If not None, ask the server to hold the request
+               open for up to this many seconds until the checkpoint is
+               reached.  Servers which can do this say so in the
+               X-Restpose-Long-Poll response header; others ignore the
+               request, and answer immediately.
 
         """
-        if self._raw is None:
-            resp = self._resource.get(self._basepath).expect_status(200).json
-            if resp is None:
-                self._raw = 'expired'
-            elif resp.get('reached', False):
-                self._raw = resp
+        with self._cond:
+            poll = self._raw is None and not self._polling
+            if poll:
+                self._polling = True
+                self.polls += 1
+            else:
+                while self._polling:
+                    self._cond.wait()
+
+        if poll:
+            raw = None
+            try:
+                if long_poll is None:
+                    resp = self._resource.get(self._basepath)
+                else:
+                    resp = self._resource.get(self._basepath,
+                                              long_poll='%.3f' % long_poll)
+                    self._server._long_poll_supported = \
+                        _header(resp, 'x-restpose-long-poll') is not None
+                resp = resp.expect_status(200).json
+                if resp is None:
+                    raw = 'expired'
+                elif resp.get('reached', False):
+                    raw = resp
+            finally:
+                with self._cond:
+                    self._raw = raw
+                    self._polling = False
+                    self._cond.notify_all()
 
         if self._raw == 'expired':
             raise CheckPointExpiredError("Checkpoint %s expired" %
@@ -849,25 +984,67 @@ class CheckPoint(object):
         self._refresh()
         return self._raw.get('total_errors', 0)
 
-    def wait(self):
+    def wait(self, timeout=None, poll=None):
         """Wait for the checkpoint to be reached.
 
         This will contact the server, and wait until the checkpoint has been
-        reached.
+        reached.  If `Server.checkpoint_long_poll` is set, the server is
+        asked to hold the request open until the checkpoint is reached (for
+        up to that many seconds at a time).  Otherwise, or if the server
+        can't do this, which is detected from its first response, the server
+        is polled, starting quickly so that small batches aren't delayed,
+        and doubling the interval after each poll, up to `max_poll`.
 
         If the checkpoint expires (before or during the call), a
         CheckPointExpiredError will be raised.  Otherwise, this will return the
         checkpoint, so that further methods can be chained on it.
 
+        :param timeout: The longest time to wait, in seconds.  If None, wait
+               until the checkpoint is reached or expires.
+
+        :param poll: The initial interval between polls, in seconds.
+               Defaults to `min_poll`.
+
+        :raises: :exc:`restpose.errors.CheckPointTimeoutError` if the
+                 checkpoint isn't reached within `timeout` seconds.
+
         """
-        while True:
-            self._refresh()
-            if self._raw is not None:
-                return self
-            # FIXME - sleep a bit.  Currently the server doesn't long-poll for
-            # the checkpoint, so we need to sleep to avoid using lots of CPU.
-            import time
-            time.sleep(1)
+        started = time.time()
+        deadline = None
+        if timeout is not None:
+            deadline = started + timeout
+        interval = self.min_poll if poll is None else poll
+        server = self._server
+        try:
+            while True:
+                hold = None
+                if server.checkpoint_long_poll and \
+                   server._long_poll_supported is not False:
+                    hold = server.checkpoint_long_poll
+                    if deadline is not None:
+                        hold = min(hold, deadline - time.time())
+                        if hold <= 0:
+                            hold = None
+                self._refresh(hold)
+                if self._raw is not None:
+                    return self
+                delay = interval
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise CheckPointTimeoutError(
+                            "Checkpoint %s not reached after %.3gs" %
+                            (self.check_id, timeout), self.check_id,
+                            timeout)
+                    delay = min(delay, remaining)
+                if hold is not None and server._long_poll_supported:
+                    # The server held the request as long as it would.
+                    continue
+                time.sleep(delay)
+                interval = min(interval * 2, self.max_poll)
+        finally:
+            with self._cond:
+                self.waited += time.time() - started
 
 class Taxonomy(object):
     """A taxonomy; a hierarchy of category relationships.
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+"""
+Coalescing of identical concurrent requests.
+
+When many threads in one process send exactly the same search at the same
+time (for example, when a popular page is requested just after a deploy),
+only one of the searches needs to be sent to the server.  A
+:class:`SingleFlight` object ensures this: while a search is in progress, any
+identical search waits for it to complete, and uses its result.
+
+Search coalescing is enabled with the `coalesce_searches` option to
+:class:`restpose.Server`::
+
+    server = Server('http://127.0.0.1:7777', coalesce_searches=True)
+    ...
+    print(server.search_flight.stats)
+
+Searches are identical if they are made on the same collection (or document
+type) of the same server, with the same search body.  Each caller gets its own
+:class:`restpose.query.SearchResults` object, so setting realisers or the
+objects associated with results in one caller doesn't affect the others.
+
+Only searches which are in progress at the same time are coalesced; results
+are not cached once the search is complete.
+
+Checkpoints can be coalesced too, with the `coalesce_checkpoints` option,
+which takes a window in seconds (or True, for no window)::
+
+    server = Server('http://127.0.0.1:7777', coalesce_checkpoints=0.01)
+
+A :class:`CheckPointCoalescer` merges the checkpoints requested on a
+collection within the window, or while a checkpoint on the collection is
+being set, into a single checkpoint, shared by every caller; it commits if
+any caller asked for a commit.  The shared checkpoint is always set after
+each caller asked for it, so every update a caller made before asking is
+processed before the checkpoint is reached, just as with a checkpoint of its
+own.  A checkpoint being set when a caller asks can't be shared, since it
+may already have been processed; the caller's request is instead merged
+into the next one.
+
+"""
+
+import six
+import sys
+import threading
+import time
+from .codec import get_codec
+
+
+class SingleFlightStats(object):
+    """Counters for a :class:`SingleFlight` object.
+
+    """
+    def __init__(self):
+        #: The number of calls made.
+        self.calls = 0
+
+        #: The number of calls which were performed, rather than waiting for
+        #: an identical call.
+        self.executed = 0
+
+        #: The number of calls which shared the result of an identical call.
+        self.shared = 0
+
+        #: The number of performed calls which raised an exception.
+        self.errors = 0
+
+    def as_dict(self):
+        """Get the counters as a dictionary.
+
+        """
+        return dict(self.__dict__)
+
+    def __repr__(self):
+        return '<SingleFlightStats %s>' % ' '.join(
+            '%s=%d' % item for item in sorted(self.__dict__.items()))
+
+
+class _Call(object):
+    """A call in progress.
+
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+        self.waiters = 0
+
+
+class SingleFlight(object):
+    """Ensure that only one of a set of identical calls is in progress.
+
+    """
+    def __init__(self):
+        #: Counters of calls made and shared.
+        self.stats = SingleFlightStats()
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        """Call a function, unless a call with the same key is in progress.
+
+        If an identical call is in progress, this waits for it to complete,
+        and returns its result (or raises its exception).
+
+        :param key: A hashable key identifying the call.
+
+        :param func: A function of no arguments, to perform the call.
+
+        :returns: A (result, shared) tuple; shared is True if the result is
+                  shared with other callers, either because it came from a
+                  call made by another thread, or because other threads
+                  waited for this call.  Shared results must be treated as
+                  read-only, and copied by a caller which needs to change
+                  them.
+
+        """
+        with self._lock:
+            self.stats.calls += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.stats.executed += 1
+            else:
+                call.waiters += 1
+                self.stats.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.exc_info is not None:
+                six.reraise(*call.exc_info)
+            return call.result, True
+
+        try:
+            call.result = func()
+        except BaseException:
+            call.exc_info = sys.exc_info()
+            with self._lock:
+                self.stats.errors += 1
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                # No more callers can wait for the call once it's removed.
+                shared = call.waiters > 0
+            call.done.set()
+        return call.result, shared
+
+
+def search_key(uri, path, body, codec=None):
+    """Get the key used to coalesce a search.
+
+    :param uri: The URI of the server searched.
+
+    :param path: The path of the collection or document type searched.
+
+    :param body: The search body.
+
+    :param codec: The codec used to encode the body in the key (see
+           :func:`restpose.codec.get_codec`).  If it has no `dumps_sorted`
+           method, searches only share a key if their bodies' keys are in
+           the same order.
+
+    """
+    codec = get_codec(codec)
+    dumps = getattr(codec, 'dumps_sorted', codec.dumps)
+    return uri, path, dumps(body)
+
+
+class CheckPointCoalescerStats(object):
+    """Counters for a :class:`CheckPointCoalescer`.
+
+    """
+    def __init__(self):
+        #: The number of checkpoints requested.
+        self.requested = 0
+
+        #: The number of checkpoints set on the server.
+        self.sent = 0
+
+        #: The number of checkpoints set on the server which committed.
+        self.commits = 0
+
+        #: The number of checkpoints set which raised an exception.
+        self.errors = 0
+
+    def as_dict(self):
+        """Get the counters as a dictionary.
+
+        """
+        return dict(self.__dict__)
+
+    def __repr__(self):
+        return '<CheckPointCoalescerStats %s>' % ' '.join(
+            '%s=%d' % item for item in sorted(self.__dict__.items()))
+
+
+class _CheckPointGroup(object):
+    """Requests for a checkpoint which will share a single checkpoint.
+
+    """
+    def __init__(self):
+        self.commit = False
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+
+class _CheckPointKey(object):
+    """The state of checkpoints for a collection.
+
+    """
+    def __init__(self):
+        # The group which new requests join, or None.
+        self.next = None
+        # True while a checkpoint is being set.
+        self.sending = False
+
+
+class CheckPointCoalescer(object):
+    """Merge checkpoints requested on the same collection.
+
+    """
+    def __init__(self, window=0.0):
+        """
+        :param window: The time, in seconds, for which the first request for
+               a checkpoint waits for others to merge with it.
+
+        """
+        self.window = window
+
+        #: Counters of checkpoints requested and set.
+        self.stats = CheckPointCoalescerStats()
+        self._cond = threading.Condition()
+        self._keys = {}
+
+    def checkpoint(self, key, func, commit=True):
+        """Set a checkpoint, shared with other requests for the same key.
+
+        :param key: A hashable key identifying the collection (and type of
+               waiting).
+
+        :param func: A function taking a `commit` argument, which sets a
+               checkpoint and returns it.
+
+        :param commit: True if the checkpoint should cause a commit.
+
+        :returns: The checkpoint returned by `func`, which must be treated
+                  as shared with other callers.
+
+        """
+        with self._cond:
+            self.stats.requested += 1
+            state = self._keys.get(key)
+            if state is None:
+                state = self._keys[key] = _CheckPointKey()
+            group = state.next
+            leader = group is None
+            if leader:
+                group = state.next = _CheckPointGroup()
+            group.commit = group.commit or commit
+
+        if not leader:
+            group.done.wait()
+            if group.exc_info is not None:
+                six.reraise(*group.exc_info)
+            return group.result
+
+        if self.window:
+            time.sleep(self.window)
+        with self._cond:
+            while state.sending:
+                self._cond.wait()
+            # Requests made from now on join the next group.
+            state.next = None
+            state.sending = True
+            self.stats.sent += 1
+            if group.commit:
+                self.stats.commits += 1
+        try:
+            group.result = func(group.commit)
+        except BaseException:
+            group.exc_info = sys.exc_info()
+            with self._cond:
+                self.stats.errors += 1
+            raise
+        finally:
+            with self._cond:
+                state.sending = False
+                if state.next is None:
+                    del self._keys[key]
+                self._cond.notify_all()
+            group.done.set()
+        return group.result
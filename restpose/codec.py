@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+"""
+JSON codecs for RestPose.
+
+All requests sent to the RestPose server, and almost all responses received
+from it, are JSON encoded.  A codec converts between Python structures and the
+UTF-8 encoded JSON bytes which travel over the wire.
+
+Several JSON implementations are supported; the fastest one which is installed
+is used by default, in the following order of preference:
+
+ - `orjson`: encodes directly to bytes.
+ - `ujson`
+ - `simplejson`
+ - `json`: the standard library module, which is always available.
+
+A specific codec may be selected by passing its name (or a codec instance) as
+the `codec` option to :class:`restpose.Server` or
+:class:`restpose.resource.RestPoseResource`.
+
+Codecs may also have a `dumps_sorted` method, which encodes with the keys of
+each object in sorted order, so that equal structures are always encoded
+identically.
+
+"""
+
+import six
+
+
+class JsonCodec(object):
+    """Codec using the standard library json module.
+
+    """
+
+    #: The name of the codec.
+    name = 'json'
+
+    def __init__(self):
+        import json
+        self._encode = json.JSONEncoder(separators=(',', ':')).encode
+        self._encode_sorted = json.JSONEncoder(separators=(',', ':'),
+                                               sort_keys=True).encode
+        self._decoder = json.JSONDecoder()
+
+    def dumps(self, obj):
+        """Encode a structure as UTF-8 encoded JSON.
+
+        :returns: The encoded JSON, as a byte string.
+
+        """
+        # The encoder escapes all non-ASCII characters, so the result can be
+        # converted to bytes without a full UTF-8 encoding pass.
+        return self._encode(obj).encode('ascii')
+
+    def dumps_sorted(self, obj):
+        """Encode a structure as UTF-8 encoded JSON, with sorted keys.
+
+        :returns: The encoded JSON, as a byte string.
+
+        """
+        return self._encode_sorted(obj).encode('ascii')
+
+    def loads(self, data):
+        """Decode some JSON.
+
+        :param data: The JSON to decode, as UTF-8 encoded bytes or as text.
+
+        """
+        if isinstance(data, six.binary_type):
+            data = data.decode('utf-8')
+        return self._decoder.decode(data)
+
+
+class SimpleJsonCodec(JsonCodec):
+    """Codec using the simplejson module.
+
+    """
+    name = 'simplejson'
+
+    def __init__(self):
+        import simplejson
+        self._encode = simplejson.JSONEncoder(separators=(',', ':')).encode
+        self._encode_sorted = simplejson.JSONEncoder(separators=(',', ':'),
+                                                     sort_keys=True).encode
+        self._decoder = simplejson.JSONDecoder()
+
+
+class UJsonCodec(object):
+    """Codec using the ujson module.
+
+    """
+    name = 'ujson'
+
+    def __init__(self):
+        import ujson
+        self._ujson = ujson
+
+    def dumps(self, obj):
+        return self._ujson.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+    def dumps_sorted(self, obj):
+        return self._ujson.dumps(obj, ensure_ascii=False,
+                                 sort_keys=True).encode('utf-8')
+
+    def loads(self, data):
+        return self._ujson.loads(data)
+
+
+class OrJsonCodec(object):
+    """Codec using the orjson module.
+
+    orjson produces bytes directly, so no intermediate string is built when
+    encoding.
+
+    """
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self._dumps = orjson.dumps
+        self._loads = orjson.loads
+        # Allow non-string keys (eg, integers), as the json module does.
+        self._option = orjson.OPT_NON_STR_KEYS
+        self._sorted_option = self._option | orjson.OPT_SORT_KEYS
+
+    def dumps(self, obj):
+        return self._dumps(obj, option=self._option)
+
+    def dumps_sorted(self, obj):
+        return self._dumps(obj, option=self._sorted_option)
+
+    def loads(self, data):
+        return self._loads(data)
+
+
+#: Codec classes, in order of preference.
+codec_classes = (OrJsonCodec, UJsonCodec, SimpleJsonCodec, JsonCodec)
+
+_default_codec = None
+
+def available_codecs():
+    """Get the names of the codecs which can be used.
+
+    :returns: A list of codec names, in order of preference.
+
+    """
+    result = []
+    for cls in codec_classes:
+        try:
+            cls()
+        except ImportError:
+            continue
+        result.append(cls.name)
+    return result
+
+def get_codec(codec=None):
+    """Get a codec.
+
+    :param codec: The codec to get.  If None, the fastest available codec is
+           returned.  If a string, the codec with that name is returned.
+           Otherwise, this should be a codec object (ie, an object with
+           `dumps` and `loads` methods), and is returned unchanged.
+
+    :raises: ValueError if no codec of the given name is known.
+
+    :raises: ImportError if the module needed by the named codec is not
+             installed.
+
+    """
+    global _default_codec
+    if codec is None:
+        if _default_codec is None:
+            for cls in codec_classes:
+                try:
+                    _default_codec = cls()
+                except ImportError:
+                    continue
+                break
+        return _default_codec
+    if isinstance(codec, six.string_types):
+        for cls in codec_classes:
+            if cls.name == codec:
+                return cls()
+        raise ValueError("Unknown JSON codec: %r" % codec)
+    return codec
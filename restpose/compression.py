@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+"""
+Compression of request and response bodies.
+
+Bulk indexing requests, and search responses containing many items, are
+usually highly compressible.  Passing a :class:`Compression` object as the
+`compression` option to :class:`restpose.Server` (or
+:class:`restpose.resource.RestPoseResource`) makes the client:
+
+ - compress request bodies larger than a threshold, sending them with a
+   `Content-Encoding` header.  The server (or a proxy in front of it) must be
+   able to accept compressed request bodies.
+ - advertise support for compressed responses with an `Accept-Encoding`
+   header, and transparently decompress any compressed responses.
+
+Counts of the bytes before and after compression are kept in the `stats`
+attribute of the Compression object::
+
+    compression = Compression(threshold=4096)
+    server = Server('http://127.0.0.1:7777', compression=compression)
+    ...
+    print(compression.stats)
+
+"""
+
+import threading
+import zlib
+
+
+class CompressionStats(object):
+    """Counters for a :class:`Compression` object.
+
+    """
+    def __init__(self):
+        #: The number of request bodies sent.
+        self.requests = 0
+
+        #: The number of request bodies which were compressed.
+        self.requests_compressed = 0
+
+        #: The total size of request bodies, before compression.
+        self.request_bytes_raw = 0
+
+        #: The total size of request bodies, as sent.
+        self.request_bytes_sent = 0
+
+        #: The number of response bodies received.
+        self.responses = 0
+
+        #: The number of response bodies which were compressed.
+        self.responses_compressed = 0
+
+        #: The total size of response bodies, as received.
+        self.response_bytes_received = 0
+
+        #: The total size of response bodies, after decompression.
+        self.response_bytes_raw = 0
+
+    def as_dict(self):
+        """Get the counters as a dictionary.
+
+        """
+        return dict(self.__dict__)
+
+    def __repr__(self):
+        return '<CompressionStats %s>' % ' '.join(
+            '%s=%d' % item for item in sorted(self.__dict__.items()))
+
+
+class Compression(object):
+    """Settings for compressing requests and decompressing responses.
+
+    """
+
+    #: The encodings which can be decompressed.
+    supported_encodings = ('gzip', 'deflate')
+
+    def __init__(self, threshold=1024, method='gzip', level=6,
+                 compress_requests=True, accept_compressed=True):
+        """
+        :param threshold: Request bodies of this many bytes or more are
+               compressed.  Smaller bodies are sent uncompressed, since the
+               saving is small.
+
+        :param method: The encoding to use for request bodies; either 'gzip'
+               or 'deflate'.
+
+        :param level: The compression level (1 to 9).
+
+        :param compress_requests: If False, request bodies are never
+               compressed.
+
+        :param accept_compressed: If False, compressed responses are not
+               requested.
+
+        """
+        if method not in self.supported_encodings:
+            raise ValueError("Unsupported compression method: %r" % method)
+        self.threshold = threshold
+        self.method = method
+        self.level = level
+        self.compress_requests = compress_requests
+        self.accept_compressed = accept_compressed
+
+        #: Counters of the bytes compressed and decompressed.
+        self.stats = CompressionStats()
+        self._lock = threading.Lock()
+
+    @property
+    def accept_encoding(self):
+        """The value to send in Accept-Encoding headers, or None.
+
+        """
+        if not self.accept_compressed:
+            return None
+        return ', '.join(self.supported_encodings)
+
+    def compress(self, body):
+        """Compress a request body, if it is large enough to be worthwhile.
+
+        :param body: The request body, as bytes.
+
+        :returns: A (body, encoding) tuple.  encoding is None if the body was
+                  not compressed.
+
+        """
+        encoding = None
+        size = len(body)
+        if self.compress_requests and size >= self.threshold:
+            if self.method == 'gzip':
+                # wbits of 16 + MAX_WBITS produces a gzip header and trailer.
+                compressor = zlib.compressobj(self.level, zlib.DEFLATED,
+                                              16 + zlib.MAX_WBITS)
+            else:
+                compressor = zlib.compressobj(self.level)
+            body = compressor.compress(body) + compressor.flush()
+            encoding = self.method
+        with self._lock:
+            stats = self.stats
+            stats.requests += 1
+            stats.request_bytes_raw += size
+            stats.request_bytes_sent += len(body)
+            if encoding is not None:
+                stats.requests_compressed += 1
+        return body, encoding
+
+    def decompress(self, body, encoding):
+        """Decompress a response body.
+
+        :param body: The response body, as received.
+
+        :param encoding: The value of the Content-Encoding header of the
+               response, or None.
+
+        :returns: The decompressed body.
+
+        """
+        received = len(body)
+        encoding = (encoding or '').strip().lower()
+        if encoding == 'gzip' or encoding == 'x-gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            try:
+                body = zlib.decompress(body)
+            except zlib.error:
+                # Some servers send raw deflate data, with no zlib header.
+                body = zlib.decompress(body, -zlib.MAX_WBITS)
+        elif encoding not in ('', 'identity'):
+            raise ValueError("Unsupported content encoding: %r" % encoding)
+        with self._lock:
+            stats = self.stats
+            stats.responses += 1
+            stats.response_bytes_received += received
+            stats.response_bytes_raw += len(body)
+            if encoding not in ('', 'identity'):
+                stats.responses_compressed += 1
+        return body
@@ -0,0 +1,420 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+"""
+Skipping documents which haven't changed since they were last sent.
+
+A :class:`DigestStore` keeps a local SQLite database mapping the type and ID
+of each document sent to a digest of its contents.  A :class:`ChangeFilter`
+uses a store to send only documents which are new or have changed, through a
+:class:`restpose.bulk.BulkIndexer`::
+
+    store = DigestStore('/var/lib/myapp/digests.db')
+    with ChangeFilter(coll, store, delete_missing=True) as changes:
+        for row in rows:
+            changes.add(make_doc(row), doc_type='blurb', doc_id=row[0])
+    print(changes.stats)
+
+Documents are encoded canonically (as JSON with sorted keys), so the digest
+of a document doesn't depend on the order of its fields.  The standard
+library json codec is always used for this, rather than the server's codec,
+since the digests are kept between runs: other codecs may encode the same
+document differently (for example, in how they escape non-ASCII text or
+format floats), so a change of codec, or installing a faster JSON module,
+would otherwise make every document look changed.  Documents are compared in
+batches, so millions of documents can be checked per minute.
+
+With `delete_missing`, the filter treats each run as a full reload: when it
+is closed, documents which were sent by an earlier run but not seen in this
+one are deleted from the server.
+
+Digests of new and changed documents are only recorded once the run has
+finished and its final checkpoint has been reached without errors; if the
+run fails, the next run sends the same documents again.
+
+"""
+
+from .bulk import BulkIndexer
+from .codec import JsonCodec
+from .errors import BulkIndexError
+import hashlib
+import sqlite3
+import sys
+
+# The codec used for canonical encoding.  This must not depend on which JSON
+# modules are installed, or stored digests would stop matching.
+_canonical_codec = JsonCodec()
+
+def canonical_encode(doc):
+    """Encode a document canonically, as JSON with sorted keys.
+
+    The standard library json codec is always used, so that the encoding is
+    stable between runs.
+
+    :returns: The encoded document, as a byte string.
+
+    """
+    return _canonical_codec.dumps_sorted(doc)
+
+def digest(data):
+    """Get the digest of some encoded data.
+
+    """
+    return hashlib.sha1(data).digest()
+
+
+class DigestStore(object):
+    """A local store of the digests of documents sent to a server.
+
+    The store is not thread safe; it should only be used by one thread at a
+    time.
+
+    """
+    def __init__(self, path, table='digests'):
+        """
+        :param path: The path of the SQLite database.  It is created if it
+               doesn't exist.
+
+        :param table: The name of the table to keep digests in, so that one
+               database can hold digests for several collections.
+
+        """
+        self.path = path
+        self.table = table
+        self._conn = sqlite3.connect(path)
+        self._run = None
+        cursor = self._conn.cursor()
+        if path != ':memory:':
+            cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute('CREATE TABLE IF NOT EXISTS "%s" ('
+                       'doc_type TEXT NOT NULL, doc_id TEXT NOT NULL, '
+                       'digest BLOB NOT NULL, run INTEGER NOT NULL, '
+                       'PRIMARY KEY (doc_type, doc_id))' % table)
+        cursor.execute('CREATE TABLE IF NOT EXISTS "%s_runs" ('
+                       'run INTEGER PRIMARY KEY)' % table)
+        cursor.execute('CREATE TEMP TABLE IF NOT EXISTS pending ('
+                       'doc_type TEXT NOT NULL, doc_id TEXT NOT NULL, '
+                       'digest BLOB NOT NULL, '
+                       'PRIMARY KEY (doc_type, doc_id))')
+        cursor.execute('CREATE TEMP TABLE IF NOT EXISTS batch ('
+                       'seq INTEGER PRIMARY KEY, doc_type TEXT, '
+                       'doc_id TEXT)')
+        self._conn.commit()
+
+    def __len__(self):
+        return self._conn.execute('SELECT COUNT(*) FROM "%s"' %
+                                  self.table).fetchone()[0]
+
+    def get(self, doc_type, doc_id):
+        """Get the recorded digest of a document.
+
+        :returns: The digest, or None if no digest is recorded.
+
+        """
+        row = self._conn.execute('SELECT digest FROM "%s" '
+                                 'WHERE doc_type = ? AND doc_id = ?' %
+                                 self.table, (doc_type, doc_id)).fetchone()
+        if row is None:
+            return None
+        return bytes(row[0])
+
+    @property
+    def run(self):
+        """The number of the current run, or None if no run is in progress.
+
+        """
+        return self._run
+
+    def begin_run(self):
+        """Start a run.
+
+        """
+        if self._run is not None:
+            raise ValueError("A run is already in progress")
+        cursor = self._conn.cursor()
+        cursor.execute('INSERT INTO "%s_runs" (run) SELECT '
+                       'COALESCE(MAX(run), 0) + 1 FROM "%s_runs"' %
+                       (self.table, self.table))
+        self._run = cursor.lastrowid
+        cursor.execute('DELETE FROM pending')
+        self._conn.commit()
+
+    def compare(self, items):
+        """Compare the digests of a batch of documents with those recorded.
+
+        Every document in the batch is marked as seen in the current run.
+        The digests of new and changed documents are held until the run is
+        committed.
+
+        :param items: A sequence of (doc_type, doc_id, digest) tuples.
+
+        :returns: A list holding, for each item, True if the document is new
+                  or has changed, and False otherwise.
+
+        """
+        if self._run is None:
+            raise ValueError("No run is in progress")
+        cursor = self._conn.cursor()
+        cursor.execute('DELETE FROM batch')
+        cursor.executemany('INSERT INTO batch (seq, doc_type, doc_id) '
+                           'VALUES (?, ?, ?)',
+                           ((seq, item[0], item[1])
+                            for (seq, item) in enumerate(items)))
+        stored = dict(cursor.execute(
+            'SELECT batch.seq, d.digest FROM batch JOIN "%s" AS d '
+            'ON d.doc_type = batch.doc_type AND d.doc_id = batch.doc_id' %
+            self.table))
+        result = []
+        unchanged = []
+        changed = []
+        for seq, (doc_type, doc_id, doc_digest) in enumerate(items):
+            old = stored.get(seq)
+            if old is not None and bytes(old) == doc_digest:
+                result.append(False)
+                unchanged.append((self._run, doc_type, doc_id))
+            else:
+                result.append(True)
+                changed.append((doc_type, doc_id,
+                                sqlite3.Binary(doc_digest)))
+        cursor.executemany('UPDATE "%s" SET run = ? '
+                           'WHERE doc_type = ? AND doc_id = ?' % self.table,
+                           unchanged)
+        cursor.executemany('INSERT OR REPLACE INTO pending '
+                           '(doc_type, doc_id, digest) VALUES (?, ?, ?)',
+                           changed)
+        self._conn.commit()
+        return result
+
+    def _stale_where(self, doc_type):
+        where = 'run < ?'
+        params = [self._run]
+        if doc_type is not None:
+            where += ' AND doc_type = ?'
+            params.append(doc_type)
+        return where, params
+
+    def stale(self, doc_type=None):
+        """Get the documents recorded, but not seen in the current run.
+
+        :param doc_type: If not None, only get documents of this type.
+
+        :returns: An iterator over (doc_type, doc_id) tuples.
+
+        """
+        if self._run is None:
+            raise ValueError("No run is in progress")
+        where, params = self._stale_where(doc_type)
+        return self._conn.execute(
+            'SELECT doc_type, doc_id FROM "%s" AS d WHERE %s AND '
+            'NOT EXISTS (SELECT 1 FROM pending AS p WHERE '
+            'p.doc_type = d.doc_type AND p.doc_id = d.doc_id)' %
+            (self.table, where), params)
+
+    def commit_run(self, remove_stale=False, doc_type=None):
+        """Finish the current run, recording the digests of the new and
+        changed documents.
+
+        :param remove_stale: If True, forget documents not seen in this run.
+
+        :param doc_type: If not None, only forget documents of this type.
+
+        """
+        if self._run is None:
+            raise ValueError("No run is in progress")
+        cursor = self._conn.cursor()
+        cursor.execute('INSERT OR REPLACE INTO "%s" '
+                       '(doc_type, doc_id, digest, run) '
+                       'SELECT doc_type, doc_id, digest, ? FROM pending' %
+                       self.table, (self._run,))
+        if remove_stale:
+            where, params = self._stale_where(doc_type)
+            cursor.execute('DELETE FROM "%s" WHERE %s' % (self.table, where),
+                           params)
+        cursor.execute('DELETE FROM pending')
+        self._conn.commit()
+        self._run = None
+
+    def abort_run(self):
+        """Finish the current run without recording any new digests.
+
+        """
+        self._conn.execute('DELETE FROM pending')
+        self._conn.commit()
+        self._run = None
+
+    def close(self):
+        """Close the database.
+
+        """
+        if self._run is not None:
+            self.abort_run()
+        self._conn.close()
+
+
+class ChangeStats(object):
+    """Counters for a :class:`ChangeFilter`.
+
+    """
+    def __init__(self):
+        #: The number of documents given to the filter.
+        self.seen = 0
+
+        #: The number of documents which were new or had changed, and so
+        #: were sent.
+        self.changed = 0
+
+        #: The number of documents which were unchanged, and so were skipped.
+        self.unchanged = 0
+
+        #: The number of documents deleted because they weren't seen.
+        self.deleted = 0
+
+    def as_dict(self):
+        """Get the counters as a dictionary.
+
+        """
+        return dict(self.__dict__)
+
+    def __repr__(self):
+        return '<ChangeStats %s>' % ' '.join(
+            '%s=%d' % item for item in sorted(self.__dict__.items()))
+
+
+class ChangeFilter(object):
+    """Send only new and changed documents to a collection or document type.
+
+    """
+    def __init__(self, target, store, delete_missing=False,
+                 compare_batch=1000, **indexer_opts):
+        """
+        :param target: The :class:`restpose.client.Collection` or
+               :class:`restpose.client.DocumentType` to send updates to.
+
+        :param store: The :class:`DigestStore` to use.  A run is started on
+               the store, and finished when the filter is closed.
+
+        :param delete_missing: If True, delete documents which were sent in
+               earlier runs but not seen in this one, when the filter is
+               closed.
+
+        :param compare_batch: The number of documents compared with the
+               store at once.
+
+        :param indexer_opts: Options for the
+               :class:`restpose.bulk.BulkIndexer` used to send updates.
+
+        """
+        self.store = store
+        self.delete_missing = delete_missing
+        self.compare_batch = compare_batch
+
+        #: The indexer used to send updates.
+        self.indexer = BulkIndexer(target, **indexer_opts)
+
+        #: Counters of documents.
+        self.stats = ChangeStats()
+
+        self._doc_type = self.indexer._doc_type
+        self._pending = []
+        self._closed = False
+        store.begin_run()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def add(self, doc, doc_type=None, doc_id=None):
+        """Add a document, if it is new or has changed.
+
+        :param doc: The document to add (as a dictionary of fields).
+
+        :param doc_type: The type of the document.  If omitted, the type of
+               the target, or the "type" field of the document, is used.
+
+        :param doc_id: The ID of the document.  If omitted, the "id" field of
+               the document is used.
+
+        """
+        if self._closed:
+            raise ValueError("ChangeFilter has been closed")
+        if doc_type is None:
+            doc_type = self._doc_type or doc.get('type')
+        if doc_id is None:
+            doc_id = doc.get('id')
+        if doc_type is None or doc_id is None:
+            raise ValueError("Documents must have a type and an ID")
+        payload = canonical_encode(doc)
+        self._pending.append((doc_type, doc_id, payload))
+        if len(self._pending) >= self.compare_batch:
+            self._compare()
+
+    def _compare(self):
+        pending = self._pending
+        self._pending = []
+        changed = self.store.compare([(doc_type, doc_id, digest(payload))
+                                      for (doc_type, doc_id, payload)
+                                      in pending])
+        stats = self.stats
+        stats.seen += len(pending)
+        for (doc_type, doc_id, payload), is_changed in zip(pending, changed):
+            if is_changed:
+                stats.changed += 1
+                if self._doc_type is not None:
+                    doc_type = None
+                self.indexer.add_encoded(payload, doc_type, doc_id)
+            else:
+                stats.unchanged += 1
+
+    def close(self):
+        """Send the remaining changes, and wait for them to be indexed.
+
+        If `delete_missing` was set, documents not seen in this run are
+        deleted first.  If every update succeeds, the digests of the
+        documents sent are recorded in the store.
+
+        :raises: :exc:`restpose.errors.BulkIndexError` if any requests failed,
+                 or if the final checkpoint reported errors.
+
+        """
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            if self._pending:
+                self._compare()
+            if self.delete_missing:
+                for doc_type, doc_id in self.store.stale(self._doc_type):
+                    if self._doc_type is not None:
+                        doc_type = None
+                    self.indexer.delete(doc_id, doc_type=doc_type)
+                    self.stats.deleted += 1
+            self.indexer.close()
+        except BaseException:
+            e = sys.exc_info()[1] # Python 2/3 compatibility
+            if not isinstance(e, BulkIndexError):
+                self.indexer.abort()
+            self.store.abort_run()
+            raise
+        self.store.commit_run(remove_stale=self.delete_missing,
+                              doc_type=self._doc_type)
+
+    def abort(self):
+        """Stop, discarding any updates not yet sent, and without recording
+        any digests.
+
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._pending = []
+        self.indexer.abort()
+        self.store.abort_run()
@@ -17,3 +17,69 @@ class CheckPointExpiredError(RestPoseError):
 
     """
     pass
+
+
+class CheckPointTimeoutError(RestPoseError):
+    """An error raised when a checkpoint isn't reached within the time
+    allowed.
+
+    """
+    def __init__(self, msg, check_id=None, timeout=None):
+        super(CheckPointTimeoutError, self).__init__(msg)
+
+        #: The ID of the checkpoint.
+        self.check_id = check_id
+
+        #: The time waited, in seconds.
+        self.timeout = timeout
+
+
+class BulkIndexError(RestPoseError):
+    """An error raised when some operations sent by a bulk indexer failed.
+
+    """
+    def __init__(self, msg, errors=(), total_errors=0,
+                 checkpoint_errors=(), checkpoint_total_errors=0):
+        super(BulkIndexError, self).__init__(msg)
+
+        #: A list of (method, path, exception) tuples for requests which
+        #: failed.  Only the first few failures are kept.
+        self.errors = list(errors)
+
+        #: The number of requests which failed.
+        self.total_errors = total_errors
+
+        #: The errors reported by the final checkpoint; that is, errors which
+        #: occurred while processing or indexing documents.  Only the first
+        #: few are reported by the server.
+        self.checkpoint_errors = list(checkpoint_errors)
+
+        #: The total number of errors reported by the final checkpoint.
+        self.checkpoint_total_errors = checkpoint_total_errors
+
+
+class CopyVerificationError(RestPoseError):
+    """An error raised when a copied collection doesn't hold the expected
+    number of documents.
+
+    """
+    def __init__(self, msg, expected, actual):
+        super(CopyVerificationError, self).__init__(msg)
+
+        #: The number of documents expected in the target collection.
+        self.expected = expected
+
+        #: The number of documents found in the target collection.
+        self.actual = actual
+
+
+class RateLimitExceeded(RestPoseError):
+    """An error raised when a write would exceed the limit set by a
+    non-blocking :class:`restpose.ratelimit.WriteLimiter`.
+
+    """
+    def __init__(self, msg, retry_after=0.0):
+        super(RateLimitExceeded, self).__init__(msg)
+
+        #: The time until the write would be allowed, in seconds.
+        self.retry_after = retry_after
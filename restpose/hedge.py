@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+"""
+Hedging of read requests, to reduce tail latency.
+
+Occasionally a request is much slower than usual; for example, because it
+was sent to a replica which is busy, or over a connection which has stalled.
+A :class:`HedgePolicy` reduces the effect of this on searches and document
+fetches: if no response has arrived after a delay, a duplicate request is
+sent, and whichever response arrives first is used.  The other request is
+left to complete in the background, and its response discarded.
+
+Requests and their duplicates are performed by a bounded pool of threads, so
+that the caller can return the duplicate's response without waiting for the
+original request to finish.  Requests never wait for a thread: a request made
+while every thread is busy is performed by the calling thread, and a
+duplicate is only sent if a thread is free.  Neither is hedged, so the pool
+size caps the threads used, but not the number of requests made at once.
+
+The delay is normally a high percentile of recently observed response times,
+so that only the slowest few requests are hedged.  The number of hedged
+requests is also limited to a fraction of all requests, so that hedging
+cannot overload a server which is slow for everyone.
+
+Hedging is enabled with the `hedge` option to :class:`restpose.Server`::
+
+    hedge = HedgePolicy(percentile=95, budget=0.05)
+    server = Server(['http://replica1:7777', 'http://replica2:7777'],
+                    hedge=hedge)
+    ...
+    print(hedge.stats)
+
+With a single server, the duplicate request is sent on a different
+connection to the same server.  With several servers (see
+:mod:`restpose.balancer`), it will usually be sent to a different server,
+since the balancer prefers servers with fewer requests in progress.
+
+"""
+
+from concurrent import futures
+import collections
+import threading
+import time
+
+
+class HedgeStats(object):
+    """Counters for a :class:`HedgePolicy`.
+
+    """
+    def __init__(self):
+        #: The number of requests made.
+        self.requests = 0
+
+        #: The number of requests for which a duplicate request was sent.
+        self.hedged = 0
+
+        #: The number of hedged requests where the duplicate responded first.
+        self.hedge_wins = 0
+
+        #: The number of requests which would have been hedged, but were not
+        #: because the budget was exhausted.
+        self.budget_exhausted = 0
+
+        #: The number of requests which couldn't be hedged because every
+        #: thread was busy.  A steadily increasing value means that
+        #: `max_workers` is too small for the number of concurrent requests.
+        self.overflowed = 0
+
+    @property
+    def hedge_rate(self):
+        """The fraction of requests which were hedged."""
+        if not self.requests:
+            return 0.0
+        return float(self.hedged) / self.requests
+
+    @property
+    def win_rate(self):
+        """The fraction of hedges whose response was used."""
+        if not self.hedged:
+            return 0.0
+        return float(self.hedge_wins) / self.hedged
+
+    def as_dict(self):
+        """Get the counters as a dictionary.
+
+        """
+        return dict(self.__dict__)
+
+    def __repr__(self):
+        return '<HedgeStats %s>' % ' '.join(
+            '%s=%d' % item for item in sorted(self.__dict__.items()))
+
+
+class HedgePolicy(object):
+    """Settings for hedging read requests.
+
+    """
+    def __init__(self, delay=None, percentile=95, min_delay=0.005,
+                 max_delay=1.0, budget=0.05, window=1000, min_samples=20,
+                 max_workers=32):
+        """
+        :param delay: A fixed delay, in seconds, after which to send a
+               duplicate request.  If None, the delay is the `percentile`
+               percentile of recent response times.
+
+        :param percentile: The percentile of recent response times to use as
+               the delay.
+
+        :param min_delay: The shortest delay to use.
+
+        :param max_delay: The longest delay to use.  This is also used until
+               `min_samples` response times have been observed.
+
+        :param budget: The largest fraction of requests which may be hedged.
+
+        :param window: The number of recent response times to keep.
+
+        :param min_samples: The number of response times needed before the
+               percentile is used.
+
+        :param max_workers: The number of threads used to perform requests
+               and their duplicates.  Requests made while every thread is
+               busy are performed by the calling thread, without hedging.
+
+        """
+        if not 0 < percentile < 100:
+            raise ValueError("percentile must be between 0 and 100")
+        self.delay = delay
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.min_samples = min_samples
+        self.max_workers = max_workers
+
+        #: Counters of requests made and hedged.
+        self.stats = HedgeStats()
+        self._lock = threading.Lock()
+        self._samples = collections.deque(maxlen=window)
+        self._new_samples = 0
+        self._delay = max_delay
+        # Counts the threads which are free, so that calls are only given
+        # to the executor when they can start at once.
+        self._free = threading.Semaphore(max_workers)
+        self._executor = None
+
+    def close(self):
+        """Stop the threads used to perform requests.
+
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def record(self, elapsed):
+        """Record the response time of a request.
+
+        """
+        with self._lock:
+            self._samples.append(elapsed)
+            self._new_samples += 1
+            # Sorting the samples on every request would be wasteful; the
+            # percentile only needs to follow gradual changes.
+            if self._new_samples >= 50 or \
+               len(self._samples) == self.min_samples:
+                self._new_samples = 0
+                samples = sorted(self._samples)
+                index = int(len(samples) * self.percentile / 100.0)
+                self._delay = samples[min(index, len(samples) - 1)]
+
+    def current_delay(self):
+        """Get the delay after which a duplicate request will be sent.
+
+        """
+        if self.delay is not None:
+            return self.delay
+        if len(self._samples) < self.min_samples:
+            return self.max_delay
+        return min(self.max_delay, max(self.min_delay, self._delay))
+
+    def _timed(self, func):
+        start = time.time()
+        result = func()
+        self.record(time.time() - start)
+        return result
+
+    def _run(self, func):
+        try:
+            return self._timed(func)
+        finally:
+            self._free.release()
+
+    def _submit(self, func):
+        """Start performing a request on a free thread.
+
+        A thread must have been reserved by acquiring `_free`.
+
+        :returns: a Future for the result of the request.
+
+        """
+        try:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = futures.ThreadPoolExecutor(
+                        self.max_workers)
+                executor = self._executor
+            return executor.submit(self._run, func)
+        except BaseException:
+            self._free.release()
+            raise
+
+    def _allow_hedge(self):
+        with self._lock:
+            if self.stats.hedged + 1 > self.budget * self.stats.requests:
+                self.stats.budget_exhausted += 1
+                return False
+            if not self._free.acquire(False):
+                self.stats.overflowed += 1
+                return False
+            self.stats.hedged += 1
+            return True
+
+    def call(self, func):
+        """Call a function performing a request, hedging it if it is slow.
+
+        :param func: A function of no arguments, which performs the request
+               and returns its result.  This may be called twice, from
+               different threads, so must be safe to repeat.
+
+        :returns: The result of the first call of `func` to complete
+                  successfully.
+
+        """
+        with self._lock:
+            self.stats.requests += 1
+            reserved = self._free.acquire(False)
+            if not reserved:
+                self.stats.overflowed += 1
+        if not reserved:
+            # Every thread is busy; rather than waiting for one, perform the
+            # request here.
+            return self._timed(func)
+        first = self._submit(func)
+        futures.wait((first,), timeout=self.current_delay())
+        if first.done() or not self._allow_hedge():
+            return first.result()
+
+        second = self._submit(func)
+        pending = set((first, second))
+        while True:
+            done, pending = futures.wait(pending,
+                                         return_when=futures.FIRST_COMPLETED)
+            for future in (first, second):
+                if future in done and future.exception() is None:
+                    if future is second:
+                        with self._lock:
+                            self.stats.hedge_wins += 1
+                    return future.result()
+            if not pending:
+                # Both failed; report the error from the original request.
+                return first.result()
@@ -0,0 +1,1170 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+"""
+Importing documents from JSON lines and CSV files.
+
+The `restpose-import` command loads one or more files into a collection::
+
+    restpose-import --collection places --type place --id-column ID \\
+        places.csv.gz
+
+Files may be in JSON lines format (one JSON object per line; `.jsonl`,
+`.ndjson` or `.json`) or CSV (`.csv`, or `.tsv` for tab separated values),
+and may be gzip compressed (`.gz`).  The first row of a CSV file holds the
+column names, unless they are given with `--columns`.
+
+Records are read in chunks, which are parsed, converted to documents and
+encoded as JSON in a pool of worker processes, and the results are sent to
+the server with a :class:`restpose.bulk.BulkIndexer`.  Only a few chunks are
+held at once, so files of any size are imported in constant memory.
+
+By default, each CSV column (or each member of a JSON object) becomes a field
+of the same name.  A spec file, given with `--spec`, maps columns to fields
+instead; it is a JSON object such as::
+
+    {
+        "type": "place",
+        "id": "ID",
+        "fields": {
+            "name_text": "name",
+            "lat": {"column": "latitude", "convert": "float"},
+            "label_tag": {"column": "labels", "split": ","}
+        }
+    }
+
+With `--journal`, progress is recorded as the import runs, so that an
+interrupted import can be resumed by running the same command again (see
+:mod:`restpose.journal`).
+
+Checkpoints are set every `--checkpoint-every` documents, at chunk
+boundaries, so that indexing errors reported by the server can be traced to
+the input records which caused them.  The ranges of the input holding failed
+records are reported, and can be imported again on their own with `--range`.
+
+See :class:`RecordMapper` for the meaning of each member.  The same import
+can be run from Python with an :class:`Importer`::
+
+    importer = Importer(Server().collection('places'),
+                        mapper=RecordMapper(id_column='ID',
+                                            doc_type='place'))
+    importer.import_file('places.csv.gz')
+    importer.close()
+
+"""
+
+from .bulk import BulkIndexer
+from .codec import get_codec
+from .errors import BulkIndexError, CheckPointExpiredError
+import array
+import collections
+import csv
+import gzip
+import io
+import json
+import multiprocessing
+import os
+import six
+import sys
+import time
+
+
+#: Formats recognised from file extensions.
+_EXTENSION_FORMATS = {
+    '.jsonl': ('jsonl', None),
+    '.ndjson': ('jsonl', None),
+    '.json': ('jsonl', None),
+    '.csv': ('csv', ','),
+    '.tsv': ('csv', '\t'),
+}
+
+def _convert_bool(value):
+    if isinstance(value, six.string_types):
+        return value.strip().lower() in ('1', 'true', 't', 'yes', 'y')
+    return bool(value)
+
+def _convert_json(value):
+    if isinstance(value, six.string_types):
+        return json.loads(value)
+    return value
+
+#: Conversions which can be applied to column values.
+CONVERSIONS = {
+    'str': six.text_type,
+    'int': int,
+    'float': float,
+    'bool': _convert_bool,
+    'json': _convert_json,
+}
+
+
+class RecordMapper(object):
+    """Convert records read from a file into documents.
+
+    A record is a dictionary, mapping CSV column names (or JSON object
+    members) to values.
+
+    """
+    def __init__(self, fields=None, id_column=None, doc_type=None,
+                 type_column=None, skip_empty=True, keep_unmapped=False):
+        """
+        :param fields: A dictionary mapping field names to the column to take
+               the value from.  Each column may be given as a column name, or
+               as a dictionary with the members:
+
+                - `column`: the column name (defaults to the field name).
+                - `convert`: the name of a conversion to apply to the value;
+                  one of 'str', 'int', 'float', 'bool' or 'json'.
+                - `split`: a separator to split the value on, to make a list
+                  of values (each of which is then converted).
+
+               If None, every column becomes a field of the same name.
+
+        :param id_column: The column holding the document ID.  If None, the
+               ID must be present in the document.
+
+        :param doc_type: The type of every document.
+
+        :param type_column: The column holding the document type, if not
+               given by `doc_type`.
+
+        :param skip_empty: If True, columns holding an empty string are
+               treated as missing.
+
+        :param keep_unmapped: If True, columns not mentioned in `fields` are
+               kept as fields of the same name.
+
+        """
+        self.fields = []
+        if fields is not None:
+            for field, column in sorted(fields.items()):
+                if isinstance(column, six.string_types):
+                    column = {'column': column}
+                convert = column.get('convert')
+                if convert is not None:
+                    if convert not in CONVERSIONS:
+                        raise ValueError("Unknown conversion %r for field %r"
+                                         % (convert, field))
+                self.fields.append((field, column.get('column', field),
+                                    convert, column.get('split')))
+        self.mapped = fields is not None
+        self.id_column = id_column
+        self.doc_type = doc_type
+        self.type_column = type_column
+        self.skip_empty = skip_empty
+        self.keep_unmapped = keep_unmapped
+
+    @classmethod
+    def from_spec(cls, spec, **kwargs):
+        """Make a mapper from a spec, as read from a spec file.
+
+        :param spec: A dictionary, with optional members `fields`, `id`,
+               `type`, `type_column`, `skip_empty` and `keep_unmapped`,
+               corresponding to the parameters of :class:`RecordMapper`.
+
+        :param kwargs: Parameters which override those in the spec, if not
+               None.
+
+        """
+        unknown = set(spec) - set(('fields', 'id', 'type', 'type_column',
+                                   'skip_empty', 'keep_unmapped'))
+        if unknown:
+            raise ValueError("Unknown members in spec: %s" %
+                             ', '.join(sorted(unknown)))
+        params = dict(fields=spec.get('fields'),
+                      id_column=spec.get('id'),
+                      doc_type=spec.get('type'),
+                      type_column=spec.get('type_column'),
+                      skip_empty=spec.get('skip_empty', True),
+                      keep_unmapped=spec.get('keep_unmapped', False))
+        for key, value in kwargs.items():
+            if value is not None:
+                params[key] = value
+        return cls(**params)
+
+    def _empty(self, value):
+        return value is None or (self.skip_empty and value == '')
+
+    def __call__(self, record):
+        """Convert a record.
+
+        :returns: A (doc_type, doc_id, doc) tuple; `doc_type` and `doc_id`
+                  may be None.
+
+        :raises: ValueError if the record can't be converted.
+
+        """
+        if not isinstance(record, dict):
+            raise ValueError("Record is not an object")
+
+        doc_id = None
+        if self.id_column is not None:
+            doc_id = record.get(self.id_column)
+            if self._empty(doc_id):
+                raise ValueError("Missing ID column %r" % self.id_column)
+            doc_id = six.text_type(doc_id)
+
+        doc_type = self.doc_type
+        if self.type_column is not None:
+            doc_type = record.get(self.type_column)
+            if self._empty(doc_type):
+                raise ValueError("Missing type column %r" % self.type_column)
+            doc_type = six.text_type(doc_type)
+
+        if self.mapped and not self.keep_unmapped:
+            doc = {}
+        else:
+            doc = dict((key, value) for (key, value) in record.items()
+                       if not self._empty(value))
+            for field, column, convert, split in self.fields:
+                doc.pop(column, None)
+        for field, column, convert, split in self.fields:
+            value = record.get(column)
+            if self._empty(value):
+                continue
+            try:
+                if split is not None:
+                    value = [item.strip() for item in value.split(split)]
+                    value = [item for item in value if not self._empty(item)]
+                    if convert is not None:
+                        value = [CONVERSIONS[convert](item) for item in value]
+                elif convert is not None:
+                    value = CONVERSIONS[convert](value)
+            except (ValueError, TypeError, AttributeError):
+                e = sys.exc_info()[1] # Python 2/3 compatibility
+                raise ValueError("Bad value for field %r: %s" % (field, e))
+            doc[field] = value
+        return doc_type, doc_id, doc
+
+
+class ChunkParser(object):
+    """Parse, convert and encode a chunk of records.
+
+    This is called in the worker processes, so must be picklable.
+
+    """
+    def __init__(self, fmt, mapper, columns=None, delimiter=',',
+                 encoding='utf-8', codec=None):
+        self.fmt = fmt
+        self.mapper = mapper
+        self.columns = columns
+        self.delimiter = delimiter
+        self.encoding = encoding
+        self.codec = codec
+
+    def _records(self, lines):
+        if self.fmt == 'jsonl':
+            for line in lines:
+                yield json.loads(line.decode(self.encoding))
+            return
+        if six.PY2:
+            rows = csv.reader(b''.join(lines).splitlines(True),
+                              delimiter=str(self.delimiter))
+        else:
+            rows = csv.reader(io.StringIO(
+                b''.join(lines).decode(self.encoding), newline=''),
+                delimiter=self.delimiter)
+        for row in rows:
+            if six.PY2:
+                row = [cell.decode(self.encoding) for cell in row]
+            if len(row) != len(self.columns):
+                raise ValueError("Expected %d columns, got %d" %
+                                 (len(self.columns), len(row)))
+            yield dict(zip(self.columns, row))
+
+    def __call__(self, line_numbers, lines):
+        """Process a chunk.
+
+        :param line_numbers: The line number at which each record starts.
+
+        :param lines: The raw bytes of each record.
+
+        :returns: A (docs, errors) tuple.  `docs` is a list of (line_number,
+                  doc_type, doc_id, payload) tuples, and `errors` a list of
+                  (line_number, message) tuples for records which couldn't
+                  be converted.
+
+        """
+        codec = get_codec(self.codec)
+        docs = []
+        errors = []
+        for line_number, line in zip(line_numbers, lines):
+            try:
+                # Records are parsed one at a time, so that a bad record
+                # can't affect its neighbours.
+                for record in self._records([line]):
+                    doc_type, doc_id, doc = self.mapper(record)
+                    docs.append((line_number, doc_type, doc_id,
+                                 codec.dumps(doc)))
+            except (ValueError, csv.Error):
+                e = sys.exc_info()[1] # Python 2/3 compatibility
+                errors.append((line_number, str(e)))
+        return docs, errors
+
+
+def open_input(path):
+    """Open a file for reading, decompressing it if it is gzipped.
+
+    :param path: The path of the file, or '-' for standard input.
+
+    :returns: A binary file object.
+
+    """
+    if path == '-':
+        stream = getattr(sys.stdin, 'buffer', sys.stdin)
+        if hasattr(stream, 'peek') and stream.peek(2)[:2] == b'\x1f\x8b':
+            return gzip.GzipFile(fileobj=stream, mode='rb')
+        return stream
+    stream = open(path, 'rb')
+    magic = stream.read(2)
+    if magic == b'\x1f\x8b' or path.endswith('.gz'):
+        stream.close()
+        return gzip.open(path, 'rb')
+    stream.seek(0)
+    return stream
+
+def guess_format(path):
+    """Guess the format of a file from its name.
+
+    :returns: A (format, delimiter) tuple, or (None, None) if the format
+              can't be guessed.
+
+    """
+    if path.endswith('.gz'):
+        path = path[:-3]
+    for ext, result in _EXTENSION_FORMATS.items():
+        if path.endswith(ext):
+            return result
+    return None, None
+
+def read_chunks(stream, fmt, chunk_size, first_line=1, first_offset=0,
+                last_offset=None):
+    """Split a stream into chunks of records.
+
+    Records in CSV files may span several lines, if they contain quoted
+    newlines; a record is complete when it contains an even number of quote
+    characters.  Blank lines are skipped.
+
+    :param first_line: The line number of the first line in the stream.
+
+    :param first_offset: The byte offset of the start of the stream.
+
+    :param last_offset: If not None, stop before the first record starting
+           at or after this byte offset.
+
+    :returns: An iterator over (line_numbers, lines, end) tuples, holding
+              the line number at which each record starts, its raw bytes,
+              and the (line_number, offset) position just after the chunk.
+
+    """
+    line_numbers = []
+    lines = []
+    pending = []
+    pending_start = None
+    quotes = 0
+    offset = first_offset
+    line_number = first_line - 1
+    for line_number, line in enumerate(stream, first_line):
+        if last_offset is not None and offset >= last_offset and \
+           not pending:
+            line_number -= 1
+            break
+        offset += len(line)
+        if fmt == 'csv':
+            if not pending:
+                if not line.strip():
+                    continue
+                pending_start = line_number
+            pending.append(line)
+            quotes += line.count(b'"')
+            if quotes % 2:
+                continue
+            line = b''.join(pending)
+            start = pending_start
+            pending = []
+            quotes = 0
+        elif not line.strip():
+            continue
+        else:
+            start = line_number
+        line_numbers.append(start)
+        lines.append(line)
+        if len(lines) >= chunk_size:
+            yield line_numbers, lines, (line_number + 1, offset)
+            line_numbers = []
+            lines = []
+    if pending:
+        line_numbers.append(pending_start)
+        lines.append(b''.join(pending))
+    if lines:
+        yield line_numbers, lines, (line_number + 1, offset)
+
+
+class _ChunkIndex(object):
+    """The source records of the documents from a chunk.
+
+    The documents were given to the indexer consecutively, so the update with
+    sequence number `first_seq + i` came from the record starting at
+    `lines[i]`, and was for the document with (type, ID) `keys[i]`.
+
+    """
+    __slots__ = ('path', 'start', 'end', 'first_seq', 'lines', 'keys')
+
+    def __init__(self, path, start, end, first_seq, lines, keys):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.first_seq = first_seq
+        self.lines = array.array('l', lines)
+        self.keys = keys
+
+    @property
+    def last_seq(self):
+        return self.first_seq + len(self.keys) - 1
+
+
+class ImportStats(object):
+    """Counters for an :class:`Importer`.
+
+    """
+    def __init__(self):
+        #: The number of files read.
+        self.files = 0
+
+        #: The number of records read.
+        self.records = 0
+
+        #: The number of records which couldn't be converted to documents.
+        self.skipped = 0
+
+        #: The number of files skipped or resumed using the journal.
+        self.resumed = 0
+
+    def as_dict(self):
+        """Get the counters as a dictionary.
+
+        """
+        return dict(self.__dict__)
+
+    def __repr__(self):
+        return '<ImportStats %s>' % ' '.join(
+            '%s=%d' % item for item in sorted(self.__dict__.items()))
+
+
+class Importer(object):
+    """Import files of records into a collection or document type.
+
+    """
+
+    #: The maximum number of records which couldn't be converted to keep
+    #: details of.
+    max_errors_kept = 100
+
+    def __init__(self, target, mapper=None, processes=None, chunk_size=1000,
+                 max_chunks=None, encoding='utf-8', columns=None,
+                 report=None, report_interval=5.0, codec=None, journal=None,
+                 checkpoint_every=100000, poll_interval=1.0,
+                 **indexer_opts):
+        """
+        :param target: The :class:`restpose.client.Collection` or
+               :class:`restpose.client.DocumentType` to import into.
+
+        :param mapper: The :class:`RecordMapper` used to convert records to
+               documents.  By default, each column becomes a field.
+
+        :param processes: The number of worker processes used to parse and
+               encode records.  Defaults to the number of CPUs.  If 0, this
+               is done in the calling thread.
+
+        :param chunk_size: The number of records sent to a worker process
+               at once.
+
+        :param max_chunks: The number of chunks which may be in progress at
+               once.  Defaults to twice the number of processes.
+
+        :param encoding: The character encoding of the files.
+
+        :param columns: The column names of CSV files.  If None, the first
+               row of each file holds the column names.
+
+        :param report: A function to call with the importer every
+               `report_interval` seconds while importing, to report
+               progress.
+
+        :param report_interval: The time between calls to `report`.
+
+        :param codec: The JSON codec to use, or the name of one.  Must be
+               picklable if `processes` is not 0.  Defaults to the codec used
+               by the target.
+
+        :param journal: An :class:`restpose.journal.ImportJournal` to record
+               progress in, and resume from.
+
+        :param checkpoint_every: The number of documents sent between
+               checkpoints.  Checkpoints are set at chunk boundaries, and
+               are used to record progress in the journal, and to trace the
+               errors they report back to input records.  If 0, only the
+               final checkpoint is set, so progress is only journaled once
+               it has been reached, and errors can't be traced.
+
+        :param poll_interval: The shortest time between checks of whether
+               checkpoints have been reached.
+
+        :param indexer_opts: Options for the
+               :class:`restpose.bulk.BulkIndexer` used to send documents.
+
+        """
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.mapper = mapper or RecordMapper()
+        self.processes = processes
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks or max(2, 2 * processes)
+        self.encoding = encoding
+        self.columns = columns
+        self.report = report
+        self.report_interval = report_interval
+        if codec is None:
+            codec = getattr(target._resource, 'codec', None)
+            if codec is not None:
+                codec = codec.name
+        self.codec = codec
+        self.journal = journal
+        self.checkpoint_every = checkpoint_every
+        self.poll_interval = poll_interval
+
+        #: The indexer used to send documents.
+        self.indexer = BulkIndexer(target, **indexer_opts)
+
+        #: Counters of files and records.
+        self.stats = ImportStats()
+
+        #: A list of (path, line_number, message) tuples for records which
+        #: couldn't be converted.  Only the first `max_errors_kept` are kept.
+        self.errors = []
+
+        #: Errors reported by the checkpoints set while importing.  Only the
+        #: first `max_errors_kept` are kept.
+        self.checkpoint_errors = []
+
+        #: The total number of errors reported by the checkpoints set while
+        #: importing.
+        self.checkpoint_total_errors = 0
+
+        #: A list of (path, line_number, message) tuples for records whose
+        #: documents couldn't be indexed: those whose requests failed, and
+        #: those named by errors reported by checkpoints.  If an error
+        #: doesn't name a document which was sent (in the span covered by
+        #: its checkpoint), `path` and `line_number` are None.  Only the
+        #: first `max_errors_kept` are kept.
+        self.record_errors = []
+
+        self._started = time.time()
+        self._last_report = self._started
+        self._last_poll = self._started
+        # Positions in the input, as (submitted, entry) tuples, where
+        # `submitted` is the number of updates given to the indexer before
+        # the position was reached, and `entry` holds the arguments for
+        # ImportJournal.record().
+        self._marks = collections.deque()
+        self._safe_mark = None
+        self._last_checkpointed = 0
+        # Checkpoints set while importing, as (checkpoint, entry, after,
+        # mark, submitted) tuples.  Every update up to `mark` was
+        # acknowledged before the checkpoint was set, and `submitted`
+        # updates had been given to the indexer, so the checkpoint's errors
+        # are for updates in the span (after, submitted], where `after` is
+        # the mark of the previous checkpoint.
+        self._checkpoints = collections.deque()
+        self._span_start = 0
+        # Indexes of the chunks sent since the oldest pending checkpoint's
+        # span started, and the positions of failed updates which have been
+        # traced to records.
+        self._chunks = collections.deque()
+        self._traced_failures = set()
+        self._failed_ranges = []
+        self._position = None
+        self._executor = None
+        if processes:
+            from concurrent.futures import ProcessPoolExecutor
+            self._executor = ProcessPoolExecutor(processes)
+
+    @property
+    def elapsed(self):
+        """The time since the importer was created, in seconds."""
+        return time.time() - self._started
+
+    @property
+    def docs_per_sec(self):
+        """The average rate at which documents have been sent."""
+        elapsed = self.elapsed
+        if elapsed <= 0:
+            return 0.0
+        return self.indexer.stats.sent / elapsed
+
+    @property
+    def failed_ranges(self):
+        """The parts of the input holding records which couldn't be indexed.
+
+        These cover the records in :attr:`record_errors`, and the records
+        sent in the span of any checkpoint which reported errors, so
+        re-importing just these ranges (with the `start` and `end`
+        arguments of :meth:`import_file`) retries every failed record.
+
+        :returns: A list of (path, start, end) tuples, where `start` and `end`
+                  are (line_number, offset) positions, sorted by path and
+                  with overlapping ranges merged.
+
+        """
+        merged = []
+        for path, start, end in sorted(self._failed_ranges):
+            if merged and merged[-1][0] == path and start <= merged[-1][2]:
+                if end > merged[-1][2]:
+                    merged[-1] = (path, merged[-1][1], end)
+            else:
+                merged.append((path, start, end))
+        return merged
+
+    def _read_columns(self, stream, delimiter):
+        """Read the column names from the first row of a CSV file.
+
+        :returns: The column names, and the (line_number, offset) position
+                  just after the header.
+
+        """
+        for line_numbers, lines, end in read_chunks(stream, 'csv', 1):
+            line = lines[0]
+            if six.PY2:
+                row = next(csv.reader(line.splitlines(True),
+                                      delimiter=str(delimiter)))
+                row = [cell.decode(self.encoding) for cell in row]
+            else:
+                row = next(csv.reader(io.StringIO(line.decode(self.encoding),
+                                                  newline=''),
+                                      delimiter=delimiter))
+            return row, end
+        return None, None
+
+    def import_file(self, path, fmt=None, delimiter=None, start=None,
+                    end=None):
+        """Import a file, or part of one.
+
+        If the importer has a journal, a file which the journal records as
+        finished is skipped, and a file with a recorded position is resumed
+        from that position.  The journal isn't used when importing part of
+        a file.
+
+        :param path: The path of the file, or '-' for standard input.
+
+        :param fmt: The format of the file: 'jsonl' or 'csv'.  If None, this
+               is guessed from the file name.
+
+        :param delimiter: The delimiter for CSV files.  If None, this is
+               guessed from the file name, defaulting to ','.
+
+        :param start: The (line_number, offset) position to start reading
+               from, such as the start of one of the :attr:`failed_ranges`.
+               The file must be seekable.
+
+        :param end: The (line_number, offset) position to stop reading at.
+
+        :raises: ValueError if the format of the file can't be guessed, or
+                 if the journal has an entry for the file, but the file has
+                 changed since it was recorded.  Once reading the file has
+                 started, any exception aborts the import (see `abort()`).
+
+        """
+        guessed_fmt, guessed_delimiter = guess_format(path)
+        fmt = fmt or guessed_fmt
+        if fmt not in ('jsonl', 'csv'):
+            raise ValueError("Can't tell the format of %r" % path)
+        delimiter = delimiter or guessed_delimiter or ','
+        try:
+            self._import_file(path, fmt, delimiter, start, end)
+        except BaseException:
+            self.abort()
+            raise
+
+    def _import_file(self, path, fmt, delimiter, start, end):
+        size = mtime = resume = None
+        ranged = start is not None or end is not None
+        if self.journal is not None and path != '-' and not ranged:
+            info = os.stat(path)
+            size, mtime = info.st_size, info.st_mtime
+            resume = self.journal.position(path)
+            if resume is not None:
+                if (resume['size'], resume['mtime']) != (size, mtime):
+                    raise ValueError("%r has changed since it was recorded "
+                                     "in the journal" % path)
+                if resume['done']:
+                    self.stats.resumed += 1
+                    return
+
+        stream = open_input(path)
+        try:
+            columns = self.columns
+            position = (1, 0)
+            if fmt == 'csv' and columns is None:
+                columns, position = self._read_columns(stream, delimiter)
+                if columns is None:
+                    return
+            if resume is not None:
+                start = (resume['line'], resume['offset'])
+                self.stats.resumed += 1
+            if start is not None:
+                stream.seek(start[1])
+                position = start
+            parser = ChunkParser(fmt, self.mapper, columns, delimiter,
+                                 self.encoding, self.codec)
+            self.stats.files += 1
+            self._position = position
+            chunks = read_chunks(stream, fmt, self.chunk_size, position[0],
+                                 position[1], end and end[1])
+            entry = None
+            for position in self._run(path, parser, chunks):
+                if not ranged:
+                    entry = dict(source=path, line=position[0],
+                                 offset=position[1], size=size, mtime=mtime)
+                self._mark(entry)
+            if not ranged:
+                entry = dict(source=path, line=position[0],
+                             offset=position[1], size=size, mtime=mtime,
+                             done=True)
+            self._mark(entry)
+        finally:
+            if path != '-':
+                stream.close()
+
+    def _run(self, path, parser, chunks):
+        """Process chunks, yielding the end position of each chunk once its
+        documents have been given to the indexer.
+
+        """
+        if self._executor is None:
+            for line_numbers, lines, end in chunks:
+                self._handle(path, parser(line_numbers, lines), end)
+                yield end
+            return
+
+        # Chunks are handled in the order they were read, and only
+        # max_chunks are in progress at once, so memory use is bounded.
+        pending = collections.deque()
+        try:
+            for line_numbers, lines, end in chunks:
+                if len(pending) >= self.max_chunks:
+                    future, done_end = pending.popleft()
+                    self._handle(path, future.result(), done_end)
+                    yield done_end
+                pending.append((self._executor.submit(parser, line_numbers,
+                                                      lines), end))
+            while pending:
+                future, done_end = pending.popleft()
+                self._handle(path, future.result(), done_end)
+                yield done_end
+        finally:
+            for future, _ in pending:
+                future.cancel()
+
+    def _handle(self, path, result, end):
+        docs, errors = result
+        start, self._position = self._position, end
+        self.stats.records += len(docs) + len(errors)
+        self.stats.skipped += len(errors)
+        for line_number, message in errors:
+            if len(self.errors) < self.max_errors_kept:
+                self.errors.append((path, line_number, message))
+        add_encoded = self.indexer.add_encoded
+        first_seq = self.indexer.submitted + 1
+        for line_number, doc_type, doc_id, payload in docs:
+            add_encoded(payload, doc_type, doc_id)
+        if docs and self.checkpoint_every:
+            self._chunks.append(_ChunkIndex(
+                path, start, end, first_seq, [doc[0] for doc in docs],
+                [(doc[1], doc[2]) for doc in docs]))
+        if self.report is not None:
+            now = time.time()
+            if now - self._last_report >= self.report_interval:
+                self._last_report = now
+                self.report(self)
+
+    def _mark(self, entry):
+        """Note that a chunk boundary in the input has been reached, and set
+        and check checkpoints.
+
+        :param entry: The arguments for ImportJournal.record() to confirm
+               the position, or None if it isn't to be journaled.
+
+        """
+        indexer = self.indexer
+        if not self.checkpoint_every:
+            # Only the final checkpoint is set, so the last position reached
+            # in each file is journaled once it has been reached.
+            if entry is not None and self.journal is not None:
+                if self._marks and \
+                   self._marks[-1][1]['source'] == entry['source']:
+                    self._marks.pop()
+                self._marks.append((indexer.submitted, entry))
+            return
+        self._marks.append((indexer.submitted, entry))
+
+        # Once every update before a position has been acknowledged, a
+        # checkpoint set now confirms that position.
+        acknowledged = indexer.acknowledged
+        while self._marks and self._marks[0][0] <= acknowledged:
+            self._safe_mark = self._marks.popleft()
+        if self._safe_mark is not None and \
+           self._safe_mark[0] - self._last_checkpointed >= \
+           self.checkpoint_every:
+            mark, entry = self._safe_mark
+            checkpoint = indexer._collection.checkpoint(
+                commit=self.journal is not None)
+            self._checkpoints.append((checkpoint, entry, self._span_start,
+                                      mark, indexer.submitted))
+            self._span_start = mark
+            self._last_checkpointed = mark
+            self._safe_mark = None
+
+        now = time.time()
+        if now - self._last_poll >= self.poll_interval:
+            self._last_poll = now
+            self._poll_checkpoints()
+
+    def _poll_checkpoints(self, wait=False):
+        """Handle the errors of checkpoints which have been reached, and
+        record their positions in the journal.
+
+        """
+        while self._checkpoints:
+            checkpoint, entry, after, mark, submitted = self._checkpoints[0]
+            try:
+                if wait:
+                    checkpoint.wait()
+                elif not checkpoint.reached:
+                    return
+            except CheckPointExpiredError:
+                # The position will be confirmed by a later checkpoint, but
+                # any errors reported by this one are lost.
+                self._checkpoints.popleft()
+                self._release(mark)
+                continue
+            self._checkpoints.popleft()
+            self._checkpoint_reached(checkpoint, after, submitted)
+            if self.journal is not None and entry is not None and \
+               not self.indexer.stats.failed:
+                self.journal.record(checkid=checkpoint.check_id, **entry)
+            self._release(mark)
+
+    def _checkpoint_reached(self, checkpoint, after, submitted):
+        """Trace the errors reported by a checkpoint to input records.
+
+        The checkpoint's errors are for updates in the span (after,
+        submitted].
+
+        """
+        total_errors = checkpoint.total_errors
+        errors = checkpoint.errors
+        self.checkpoint_total_errors += total_errors
+        for error in errors:
+            if len(self.checkpoint_errors) < self.max_errors_kept:
+                self.checkpoint_errors.append(error)
+        if not total_errors:
+            return
+        chunks = [chunk for chunk in self._chunks
+                  if chunk.last_seq > after and chunk.first_seq <= submitted]
+        for error in errors:
+            records = self._find_records(chunks, after, submitted,
+                                         error.get('doc_type'),
+                                         error.get('doc_id'))
+            if not records:
+                records = [(None, None)]
+            for path, line_number in records:
+                self._record_error(path, line_number, error.get('msg'))
+        self._add_failed_ranges(chunks)
+
+    def _find_records(self, chunks, after, submitted, doc_type, doc_id):
+        """Find the records sent in a span for a document.
+
+        A document may be given more than once in a span, in which case
+        each of its records is returned.
+
+        :returns: A list of (path, line_number) tuples.
+
+        """
+        records = []
+        if doc_id is None:
+            return records
+        for chunk in chunks:
+            seq = chunk.first_seq
+            for index, (key_type, key_id) in enumerate(chunk.keys):
+                if after < seq + index <= submitted and \
+                   (key_id == doc_id or (key_id is not None and
+                                         six.text_type(key_id) == doc_id)) \
+                   and (doc_type is None or key_type is None or
+                        key_type == doc_type):
+                    records.append((chunk.path, chunk.lines[index]))
+        return records
+
+    def _release(self, mark):
+        """Trace failed updates up to `mark` to input records, and then
+        forget the records sent up to `mark`.
+
+        """
+        released = []
+        while self._chunks and self._chunks[0].last_seq <= mark:
+            released.append(self._chunks.popleft())
+        self._trace_failures(released)
+
+    def _trace_failures(self, chunks):
+        indexer = self.indexer
+        failed_seqs = indexer.failed_seqs
+        for index in range(len(failed_seqs)):
+            if index in self._traced_failures:
+                continue
+            seq = failed_seqs[index]
+            for chunk in chunks:
+                if chunk.first_seq <= seq <= chunk.last_seq:
+                    self._traced_failures.add(index)
+                    self._record_error(chunk.path,
+                                       chunk.lines[seq - chunk.first_seq],
+                                       str(indexer.errors[index][2]))
+                    self._add_failed_ranges([chunk])
+                    break
+
+    def _record_error(self, path, line_number, message):
+        if len(self.record_errors) < self.max_errors_kept:
+            self.record_errors.append((path, line_number, message))
+
+    def _add_failed_ranges(self, chunks):
+        ranges = {}
+        for chunk in chunks:
+            start, end = ranges.get(chunk.path, (chunk.start, chunk.end))
+            ranges[chunk.path] = (min(start, chunk.start),
+                                  max(end, chunk.end))
+        for path, (start, end) in ranges.items():
+            self._failed_ranges.append((path, start, end))
+
+    def close(self):
+        """Finish sending documents, and wait for them to be indexed.
+
+        If the importer has a journal, the final position in each file is
+        recorded once the final checkpoint has been reached, unless any
+        requests failed.  Failures are traced back to input records in
+        :attr:`record_errors` and :attr:`failed_ranges`.
+
+        :raises: :exc:`restpose.errors.BulkIndexError` if any requests failed,
+                 or if any checkpoint reported errors.
+
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        error = None
+        try:
+            self.indexer.close()
+        except BulkIndexError:
+            error = sys.exc_info()[1] # Python 2/3 compatibility
+        self._poll_checkpoints(wait=True)
+        final = self.indexer.final_checkpoint
+        if final is not None:
+            self._checkpoint_reached(final, self._span_start,
+                                     self.indexer.submitted)
+            if self.journal is not None and not self.indexer.stats.failed:
+                if self._safe_mark is not None:
+                    self._marks.appendleft(self._safe_mark)
+                for _, entry in self._marks:
+                    if entry is not None:
+                        self.journal.record(checkid=final.check_id, **entry)
+        self._marks.clear()
+        self._trace_failures(self._chunks)
+        self._chunks.clear()
+
+        if error is not None or self.checkpoint_total_errors:
+            raise BulkIndexError(
+                "%d requests failed, %d errors reported by checkpoints" %
+                (self.indexer.stats.failed, self.checkpoint_total_errors),
+                errors=self.indexer.errors,
+                total_errors=self.indexer.stats.failed,
+                checkpoint_errors=list(self.checkpoint_errors),
+                checkpoint_total_errors=self.checkpoint_total_errors)
+
+    def abort(self):
+        """Stop importing, discarding any documents not yet sent, and close
+        the journal.
+
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self.indexer.abort()
+        if self.journal is not None:
+            self.journal.close()
+
+
+def _report_progress(importer):
+    sys.stderr.write("%d documents sent, %.0f docs/sec\n" %
+                     (importer.indexer.stats.sent, importer.docs_per_sec))
+
+def _parse_args(argv):
+    import argparse
+
+    def position_range(text):
+        try:
+            start, end = text.split('-')
+            return (tuple(int(part) for part in start.split(':')),
+                    tuple(int(part) for part in end.split(':')))
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                "expected LINE:OFFSET-LINE:OFFSET, got %r" % text)
+
+    parser = argparse.ArgumentParser(
+        prog='restpose-import',
+        description="Import documents from JSON lines or CSV files into a "
+        "RestPose collection.")
+    parser.add_argument('files', nargs='+', metavar='FILE',
+                        help="files to import ('-' for standard input)")
+    parser.add_argument('--server', default='http://127.0.0.1:7777',
+                        help="URI of the server (default: %(default)s)")
+    parser.add_argument('--collection', required=True,
+                        help="collection to import into")
+    parser.add_argument('--type', dest='doc_type',
+                        help="type of the documents")
+    parser.add_argument('--type-column',
+                        help="column holding the document type")
+    parser.add_argument('--id-column',
+                        help="column holding the document ID")
+    parser.add_argument('--spec',
+                        help="JSON file mapping columns to fields")
+    parser.add_argument('--format', choices=('jsonl', 'csv'),
+                        help="format of the files (default: guessed from "
+                        "the file names)")
+    parser.add_argument('--delimiter', help="CSV delimiter")
+    parser.add_argument('--columns',
+                        help="comma separated CSV column names, if the "
+                        "files have no header row")
+    parser.add_argument('--encoding', default='utf-8',
+                        help="character encoding (default: %(default)s)")
+    parser.add_argument('--processes', type=int,
+                        help="number of parsing processes (default: number "
+                        "of CPUs)")
+    parser.add_argument('--chunk-size', type=int, default=1000,
+                        help="records per parsing chunk (default: "
+                        "%(default)s)")
+    parser.add_argument('--workers', type=int, default=8,
+                        help="number of concurrent requests (default: "
+                        "%(default)s)")
+    parser.add_argument('--batch-size', type=int, default=100,
+                        help="updates per batch (default: %(default)s)")
+    parser.add_argument('--journal',
+                        help="journal file to record progress in, so that "
+                        "an interrupted import can be resumed by running "
+                        "the same command again")
+    parser.add_argument('--checkpoint-every', type=int, default=100000,
+                        help="documents between checkpoints, which record "
+                        "progress in the journal and trace indexing errors "
+                        "to input records (default: %(default)s)")
+    parser.add_argument('--range', type=position_range,
+                        metavar='LINE:OFFSET-LINE:OFFSET',
+                        help="import only this part of the files, as "
+                        "reported for failed records by an earlier import")
+    parser.add_argument('--no-commit', action='store_true',
+                        help="don't commit at the end of the import")
+    parser.add_argument('--quiet', action='store_true',
+                        help="don't report progress")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """Entry point for the `restpose-import` command.
+
+    :returns: The exit status: 0 if every record was imported, 1 otherwise.
+
+    """
+    from .client import Server
+    from .journal import ImportJournal
+    args = _parse_args(argv)
+
+    spec = {}
+    if args.spec:
+        with open(args.spec) as fd:
+            spec = json.load(fd)
+    mapper = RecordMapper.from_spec(spec, id_column=args.id_column,
+                                    doc_type=args.doc_type,
+                                    type_column=args.type_column)
+    columns = None
+    if args.columns:
+        columns = [column.strip() for column in args.columns.split(',')]
+
+    report = None
+    if not args.quiet:
+        report = _report_progress
+    journal = None
+    if args.journal:
+        journal = ImportJournal(args.journal)
+    target = Server(args.server).collection(args.collection)
+    importer = Importer(target, mapper=mapper, processes=args.processes,
+                        chunk_size=args.chunk_size, encoding=args.encoding,
+                        columns=columns, report=report, journal=journal,
+                        checkpoint_every=args.checkpoint_every,
+                        workers=args.workers, batch_size=args.batch_size,
+                        commit=not args.no_commit)
+
+    status = 0
+    indexing_errors = 0
+    try:
+        for path in args.files:
+            if args.range is None:
+                importer.import_file(path, args.format, args.delimiter)
+            else:
+                importer.import_file(path, args.format, args.delimiter,
+                                     *args.range)
+    except BaseException:
+        importer.abort()
+        raise
+    try:
+        importer.close()
+    except BulkIndexError:
+        e = sys.exc_info()[1] # Python 2/3 compatibility
+        status = 1
+        indexing_errors = e.checkpoint_total_errors
+        if importer.record_errors:
+            for path, line_number, message in importer.record_errors[:10]:
+                if line_number is None:
+                    sys.stderr.write("Indexing error: %s\n" % (message,))
+                else:
+                    sys.stderr.write("%s:%d: indexing error: %s\n" %
+                                     (path, line_number, message))
+            for path, start, end in importer.failed_ranges:
+                sys.stderr.write("To retry the failed records in %s, use "
+                                 "--range %d:%d-%d:%d\n" %
+                                 ((path,) + start + end))
+        else:
+            for method, path, error in e.errors[:10]:
+                sys.stderr.write("%s %s failed: %s\n" %
+                                 (method, path, error))
+            for error in e.checkpoint_errors[:10]:
+                sys.stderr.write("Indexing error: %s\n" % (error,))
+    finally:
+        if journal is not None:
+            journal.close()
+
+    stats = importer.stats
+    sys.stderr.write("Imported %d documents from %d records in %.1fs "
+                     "(%.0f docs/sec)\n" %
+                     (importer.indexer.stats.sent, stats.records,
+                      importer.elapsed, importer.docs_per_sec))
+    if stats.skipped:
+        status = 1
+        for path, line_number, message in importer.errors[:10]:
+            sys.stderr.write("%s:%d: %s\n" % (path, line_number, message))
+    if stats.resumed:
+        sys.stderr.write("%d files skipped or resumed using the journal\n" %
+                         stats.resumed)
+    sys.stderr.write("%d records skipped, %d requests failed, "
+                     "%d indexing errors\n" %
+                     (stats.skipped, importer.indexer.stats.failed,
+                      indexing_errors))
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+"""
+Timing of requests made to a RestPose server.
+
+Passing an :class:`Instrumentation` object as the `instrument` option to
+:class:`restpose.Server` (or :class:`restpose.resource.RestPoseResource`)
+makes the client time each stage of every request, and pass the timings to
+any hooks which have been registered::
+
+    def log_timing(timing):
+        logging.info("%s %s: %d, %.1fms to first byte", timing.method,
+                     timing.path_template, timing.status, timing.ttfb * 1000)
+
+    instrument = Instrumentation()
+    instrument.add_hook(log_timing)
+    server = Server('http://127.0.0.1:7777', instrument=instrument)
+
+Each hook is called with a :class:`RequestTiming` object, once the body of
+the response has been read (and decoded, if it is accessed as JSON), or when
+the request fails.  Hooks are called in the thread which made the request,
+so should be quick; exceptions raised by hooks are not caught.
+
+When no hooks are registered, the only work done for each request is checking
+whether any hooks have been added since, so instrumentation can be left
+enabled in production.
+
+"""
+
+from restkit.client import Client
+import sys
+import threading
+import time
+
+
+#: Path segments which are followed by a variable part of the path, and the
+#: placeholder used for that part in path templates.
+_VARIABLE_SEGMENTS = {
+    'coll': '{coll}',
+    'type': '{type}',
+    'id': '{id}',
+    'checkpoint': '{checkid}',
+    'taxonomy': '{taxonomy}',
+    'parent': '{parent}',
+}
+
+def path_template(path):
+    """Get a template for a path, with the variable parts replaced.
+
+    For example, `/coll/test/type/blurb/id/1` becomes
+    `/coll/{coll}/type/{type}/id/{id}`, so that timings for requests of the
+    same kind can be grouped together.
+
+    """
+    segments = path.split('?', 1)[0].split('/')
+    for i in range(1, len(segments)):
+        placeholder = _VARIABLE_SEGMENTS.get(segments[i - 1])
+        if placeholder is not None and segments[i] and \
+           not segments[i - 1].startswith('{'):
+            segments[i] = placeholder
+    return '/'.join(segments)
+
+
+class RequestTiming(object):
+    """The timings of a single request.
+
+    All times are in seconds; a time is None if the stage was not reached.
+
+    """
+    def __init__(self, instrument, method, path, request_bytes):
+        #: The HTTP method of the request.
+        self.method = method
+
+        #: The path requested, without any query string.
+        self.path = path
+
+        #: The size of the request body, or None if there was no body (or it
+        #: was sent with chunked encoding).
+        self.request_bytes = request_bytes
+
+        #: The HTTP status of the response.
+        self.status = None
+
+        #: The size of the response body, as received.
+        self.response_bytes = None
+
+        #: The time taken to get a connection, including any time taken to
+        #: open one.
+        self.connect_time = None
+
+        #: The time from getting a connection to receiving the headers of the
+        #: response; this includes sending the request, and the time taken by
+        #: the server to handle it.
+        self.ttfb = None
+
+        #: The time taken to read the response body.
+        self.read_time = None
+
+        #: The time taken to decode the response body from JSON.
+        self.decode_time = None
+
+        #: The exception raised if the request failed without a response.
+        self.error = None
+
+        self._instrument = instrument
+        self._connected_at = None
+        self._finished = False
+
+    @property
+    def path_template(self):
+        """The path, with the variable parts replaced by placeholders.
+
+        See :func:`path_template`.
+
+        """
+        return path_template(self.path)
+
+    @property
+    def total_time(self):
+        """The sum of the times for each stage."""
+        return sum(t for t in (self.connect_time, self.ttfb, self.read_time,
+                               self.decode_time) if t is not None)
+
+    def finish(self):
+        """Pass the timings to the hooks, if this hasn't been done already.
+
+        """
+        if not self._finished:
+            self._finished = True
+            self._instrument.emit(self)
+
+    def __repr__(self):
+        return '<RequestTiming %s %s status=%s total_time=%.6f>' % (
+            self.method, self.path, self.status, self.total_time)
+
+
+class Instrumentation(object):
+    """A set of hooks to be called with the timings of each request.
+
+    """
+    def __init__(self, hooks=()):
+        """
+        :param hooks: Hooks to register initially.
+
+        """
+        self._lock = threading.Lock()
+        self._hooks = tuple(hooks)
+
+    @property
+    def hooks(self):
+        """The registered hooks."""
+        return self._hooks
+
+    def add_hook(self, hook):
+        """Register a hook.
+
+        :param hook: A function which will be called with a
+               :class:`RequestTiming` object for each request.
+
+        """
+        with self._lock:
+            self._hooks = self._hooks + (hook,)
+
+    def remove_hook(self, hook):
+        """Unregister a hook.
+
+        """
+        with self._lock:
+            hooks = list(self._hooks)
+            hooks.remove(hook)
+            self._hooks = tuple(hooks)
+
+    def emit(self, timing):
+        """Pass a timing to each registered hook.
+
+        """
+        for hook in self._hooks:
+            hook(timing)
+
+
+class TimingClient(Client):
+    """A restkit client which records the timings of requests.
+
+    Timings are only recorded if the client's `instrument` has hooks
+    registered.
+
+    """
+
+    #: The :class:`Instrumentation` object to report timings to.
+    instrument = None
+
+    def perform(self, request):
+        instrument = self.instrument
+        if instrument is None or not instrument.hooks:
+            return super(TimingClient, self).perform(request)
+
+        request_bytes = request.headers.iget('content-length')
+        if request_bytes is not None:
+            request_bytes = int(request_bytes)
+        timing = request.restpose_timing = RequestTiming(
+            instrument, request.method, request.parsed_url.path,
+            request_bytes)
+        try:
+            return super(TimingClient, self).perform(request)
+        except Exception:
+            timing.error = sys.exc_info()[1] # Python 2/3 compatibility
+            timing.finish()
+            raise
+
+    def get_connection(self, request):
+        timing = getattr(request, 'restpose_timing', None)
+        if timing is None:
+            return super(TimingClient, self).get_connection(request)
+        start = time.time()
+        conn = super(TimingClient, self).get_connection(request)
+        timing.connect_time = time.time() - start
+        timing._connected_at = start + timing.connect_time
+        return conn
+
+    def get_response(self, request, connection):
+        resp = super(TimingClient, self).get_response(request, connection)
+        timing = getattr(request, 'restpose_timing', None)
+        if timing is not None:
+            timing.ttfb = time.time() - timing._connected_at
+            timing.status = resp.status_int
+        return resp
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+"""
+A durable record of the progress of imports, so that they can be resumed.
+
+An :class:`ImportJournal` is an append-only file, recording for each input
+file the position up to which every record is known to have been indexed,
+and the ID of the checkpoint which confirmed it.  An
+:class:`restpose.importer.Importer` given a journal sets checkpoints as it
+goes, records their positions once they are reached, and when run again
+skips input files which were finished, and resumes the others from their
+recorded positions::
+
+    journal = ImportJournal('/var/lib/myapp/import.journal')
+    importer = Importer(coll, journal=journal, checkpoint_every=100000)
+    for path in paths:
+        importer.import_file(path)
+    importer.close()
+
+Records after the recorded position may already have been sent when the
+import stopped; they are sent again, which is harmless when documents are
+added with an ID.
+
+"""
+
+import json
+import os
+import time
+
+
+class ImportJournal(object):
+    """A journal of the positions reached in input files.
+
+    Each entry is written as a line of JSON, and flushed to disk before
+    :meth:`record` returns, so the journal survives the process (or host)
+    dying.  A partially written final line is ignored when the journal is
+    read.
+
+    """
+    def __init__(self, path, sync=True):
+        """
+        :param path: The path of the journal file.  It is created if it
+               doesn't exist.
+
+        :param sync: If True, call fsync after each entry is written.
+
+        """
+        self.path = path
+        self.sync = sync
+        self._entries = {}
+        lines = 0
+        if os.path.exists(path):
+            with open(path, 'rb') as fd:
+                for line in fd:
+                    try:
+                        entry = json.loads(line.decode('utf-8'))
+                    except ValueError:
+                        continue
+                    self._entries[entry['source']] = entry
+                    lines += 1
+        if lines > 2 * len(self._entries) + 100:
+            self.compact()
+        self._fd = open(path, 'ab')
+
+    def position(self, source):
+        """Get the last recorded entry for an input file.
+
+        :returns: A dictionary with members `source`, `line` (the line number
+                  to resume from), `offset` (the byte offset to resume from,
+                  in the decompressed input), `checkid`, `done` (True if the
+                  whole file was imported), `size` and `mtime` (of the input
+                  file when it was read), and `time`.  Returns None if there
+                  is no entry for the file.
+
+        """
+        return self._entries.get(source)
+
+    def sources(self):
+        """Get the input files with entries in the journal."""
+        return sorted(self._entries)
+
+    def record(self, source, line, offset, checkid=None, done=False,
+               size=None, mtime=None):
+        """Record the position reached in an input file.
+
+        :param source: The path of the input file.
+
+        :param line: The line number of the first line not yet indexed.
+
+        :param offset: The byte offset of the first line not yet indexed.
+
+        :param checkid: The ID of the checkpoint which confirmed that the
+               records before this position were indexed.
+
+        :param done: True if every record in the file has been indexed.
+
+        :param size: The size of the input file.
+
+        :param mtime: The modification time of the input file.
+
+        """
+        entry = dict(source=source, line=line, offset=offset,
+                     checkid=checkid, done=done, size=size, mtime=mtime,
+                     time=time.time())
+        self._write(self._fd, entry)
+        self._entries[source] = entry
+
+    def _write(self, fd, entry):
+        fd.write(json.dumps(entry, sort_keys=True).encode('utf-8') + b'\n')
+        fd.flush()
+        if self.sync:
+            os.fsync(fd.fileno())
+
+    def reset(self, source=None):
+        """Forget the progress of an input file, or of all files.
+
+        """
+        if source is None:
+            self._entries = {}
+        else:
+            self._entries.pop(source, None)
+        self.compact()
+
+    def compact(self):
+        """Rewrite the journal, keeping only the last entry for each file.
+
+        """
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as fd:
+            for source in sorted(self._entries):
+                self._write(fd, self._entries[source])
+        os.rename(tmp_path, self.path)
+        fd = getattr(self, '_fd', None)
+        if fd is not None:
+            fd.close()
+            self._fd = open(self.path, 'ab')
+
+    def close(self):
+        """Close the journal file.
+
+        """
+        self._fd.close()
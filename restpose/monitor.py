@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+"""
+Monitoring how far indexing lags behind writes.
+
+A :class:`LagMonitor` periodically sets a checkpoint which doesn't commit on
+each of a set of collections, and measures the time until the checkpoint is
+reached: since the checkpoint is processed after every update sent before it,
+this is the time an update sent then took to be indexed.  After each
+measurement, a callback is given a :class:`LagReport` holding the lag, and
+percentiles of the lags measured recently::
+
+    def report(lag):
+        stats.gauge('restpose.lag.p95.' + lag.collection,
+                    lag.percentiles[95])
+        if lag.alert_changed:
+            pager.notify("Indexing lag on %s: %s" % (lag.collection, lag))
+
+    monitor = LagMonitor([server.collection('places')], interval=10,
+                         callback=report, threshold=5.0)
+    monitor.start()
+
+A collection is alerting while the `alert_percentile` percentile of its
+recent lags is at least `threshold` seconds.  A checkpoint which isn't
+reached within `timeout` seconds is recorded with the time waited, as a
+lower bound on the lag, so that a stalled server raises an alert.
+
+Checkpoints are polled by a :class:`restpose.watcher.CheckPointWatcher`, so
+the lag is measured to within the watcher's polling interval, which is at
+most `max_poll` seconds.  A new checkpoint isn't set on a collection until
+the previous one has been reached, so a lagging server isn't given a pile of
+checkpoints to process.
+
+"""
+
+from .errors import CheckPointTimeoutError
+from .watcher import CheckPointWatcher
+from concurrent import futures
+import collections
+import functools
+import threading
+import time
+
+
+class MonitorStats(object):
+    """Counters for a :class:`LagMonitor`.
+
+    """
+    def __init__(self):
+        #: The number of lags measured.
+        self.samples = 0
+
+        #: The number of checkpoints which weren't reached in time.
+        self.timeouts = 0
+
+        #: The number of checkpoints which couldn't be set, or which
+        #: expired.
+        self.errors = 0
+
+        #: The number of times a collection started alerting.
+        self.alerts = 0
+
+    def as_dict(self):
+        """Get the counters as a dictionary.
+
+        """
+        return dict(self.__dict__)
+
+    def __repr__(self):
+        return '<MonitorStats %s>' % ' '.join(
+            '%s=%d' % item for item in sorted(self.__dict__.items()))
+
+
+class LagReport(object):
+    """A measurement of the indexing lag of a collection.
+
+    """
+    def __init__(self, collection, lag, timed_out, samples, percentiles,
+                 alerting, alert_changed):
+        #: The name of the collection.
+        self.collection = collection
+
+        #: The lag measured, in seconds.
+        self.lag = lag
+
+        #: True if the checkpoint wasn't reached in time, so that `lag` is
+        #: only a lower bound.
+        self.timed_out = timed_out
+
+        #: The number of recent lags the percentiles are calculated from.
+        self.samples = samples
+
+        #: A dictionary mapping each percentile monitored to the lag at that
+        #: percentile of the recent lags.
+        self.percentiles = percentiles
+
+        #: True if the collection's lag is over the alert threshold.
+        self.alerting = alerting
+
+        #: True if `alerting` changed with this measurement.
+        self.alert_changed = alert_changed
+
+    def __repr__(self):
+        return '<LagReport %s lag=%.3f %s%s>' % (
+            self.collection, self.lag,
+            ' '.join('p%s=%.3f' % item
+                     for item in sorted(self.percentiles.items())),
+            self.alerting and ' alerting' or '')
+
+
+class _Monitored(object):
+    """The state of a monitored collection.
+
+    """
+    def __init__(self, collection, window):
+        self.collection = collection
+        self.lags = collections.deque(maxlen=window)
+        self.pending = None
+        self.alerting = False
+
+
+class LagMonitor(object):
+    """Measures the indexing lag of collections in a background thread.
+
+    """
+    def __init__(self, collections, interval=10.0, callback=None, window=60,
+                 percentiles=(50, 95, 99), threshold=None,
+                 alert_percentile=95, timeout=300.0, watcher=None):
+        """
+        :param collections: The :class:`restpose.client.Collection` objects
+               to monitor.
+
+        :param interval: The time between measurements, in seconds.
+
+        :param callback: A function to call with a :class:`LagReport` after
+               each measurement.  It is called from a background thread, and
+               should return promptly.
+
+        :param window: The number of recent lags of each collection to
+               calculate percentiles from.
+
+        :param percentiles: The percentiles to report.
+
+        :param threshold: The lag, in seconds, at which a collection is
+               alerting, or None to never alert.
+
+        :param alert_percentile: The percentile of recent lags compared
+               with `threshold`.
+
+        :param timeout: The longest time to wait for a checkpoint, in
+               seconds.
+
+        :param watcher: The :class:`restpose.watcher.CheckPointWatcher` used
+               to wait for checkpoints.  By default, the monitor has its own.
+
+        """
+        self.interval = interval
+        self.callback = callback
+        self.percentiles = tuple(percentiles)
+        if alert_percentile not in self.percentiles:
+            self.percentiles += (alert_percentile,)
+        self.threshold = threshold
+        self.alert_percentile = alert_percentile
+        self.timeout = timeout
+
+        #: Counters of measurements and alerts.
+        self.stats = MonitorStats()
+
+        self._own_watcher = watcher is None
+        if watcher is None:
+            watcher = CheckPointWatcher()
+        self._watcher = watcher
+        self._monitored = [_Monitored(coll, window) for coll in collections]
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start measuring in a background thread.
+
+        """
+        if self._thread is not None:
+            raise ValueError("LagMonitor has already been started")
+        self._thread = threading.Thread(target=self._run, name='LagMonitor')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop measuring.
+
+        Measurements in progress are abandoned if the monitor has its own
+        watcher.
+
+        """
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._own_watcher:
+            self._watcher.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self.sample()
+            self._stopping.wait(self.interval)
+
+    def sample(self):
+        """Start measuring the lag of each collection.
+
+        Collections whose previous measurement hasn't finished are skipped.
+
+        :returns: A list of :class:`concurrent.futures.Future` objects, one
+                  for each measurement started, which complete once the
+                  measurement has been reported.  The result of each is the
+                  :class:`LagReport`, or None if the lag couldn't be
+                  measured.
+
+        """
+        started = []
+        for monitored in self._monitored:
+            with self._lock:
+                if monitored.pending is not None:
+                    continue
+            start = time.time()
+            try:
+                checkpoint = monitored.collection.checkpoint(commit=False)
+            except Exception:
+                with self._lock:
+                    self.stats.errors += 1
+                continue
+            done = futures.Future()
+            done.set_running_or_notify_cancel()
+            future = self._watcher.watch(checkpoint, timeout=self.timeout)
+            with self._lock:
+                monitored.pending = future
+            future.add_done_callback(functools.partial(self._reached,
+                                                       monitored, start,
+                                                       done))
+            started.append(done)
+        return started
+
+    def _reached(self, monitored, start, done, future):
+        lag = time.time() - start
+        report = None
+        try:
+            with self._lock:
+                monitored.pending = None
+                if future.cancelled():
+                    return
+                error = future.exception()
+                if isinstance(error, CheckPointTimeoutError):
+                    self.stats.timeouts += 1
+                elif error is not None:
+                    self.stats.errors += 1
+                    return
+                self.stats.samples += 1
+                monitored.lags.append(lag)
+                report = self._report(monitored, lag, error is not None)
+            if self.callback is not None:
+                self.callback(report)
+        finally:
+            done.set_result(report)
+
+    def _report(self, monitored, lag, timed_out):
+        lags = sorted(monitored.lags)
+        percentiles = {}
+        for percentile in self.percentiles:
+            index = int(len(lags) * percentile / 100.0)
+            percentiles[percentile] = lags[min(index, len(lags) - 1)]
+        alerting = self.threshold is not None and \
+            percentiles[self.alert_percentile] >= self.threshold
+        alert_changed = alerting != monitored.alerting
+        if alert_changed:
+            monitored.alerting = alerting
+            if alerting:
+                self.stats.alerts += 1
+        return LagReport(monitored.collection.name, lag, timed_out,
+                         len(lags), percentiles, alerting, alert_changed)
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+"""
+Connection pooling for RestPose.
+
+By default, restkit shares a single global pool of connections between all
+clients.  A :class:`RestPosePool` can be used instead to control how
+connections to a RestPose server are kept and reused, and to see how the pool
+is behaving.  The simplest way to use one is to pass pool settings to
+:class:`restpose.Server`::
+
+    server = Server('http://127.0.0.1:7777', max_idle=20, max_per_host=50,
+                    idle_timeout=30, prewarm=4)
+    ...
+    print(server.pool_stats)
+
+Connections to a server on the same host can be made over a Unix domain
+socket, avoiding the overhead of TCP, by giving a `unix://` URI containing the
+path of the socket::
+
+    server = Server('unix:///var/run/restpose.sock')
+
+"""
+
+from restkit.conn import Connection
+from socketpool import ConnectionPool
+import socket
+import threading
+import time
+
+
+class UnixConnection(Connection):
+    """A connection to a server listening on a Unix domain socket.
+
+    The host and port are only used to match connections in the pool, and to
+    fill in the Host header of requests; the connection is always made to
+    `socket_path`.
+
+    """
+    def __init__(self, host, port, backend_mod=None, pool=None,
+                 is_ssl=False, extra_headers=[], socket_path=None,
+                 **options):
+        if is_ssl:
+            raise ValueError("SSL is not supported over Unix domain sockets")
+        if socket_path is None:
+            raise ValueError("socket_path must be specified")
+        self._s = backend_mod.Socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._s.connect(socket_path)
+
+        self.extra_headers = extra_headers
+        self.is_ssl = False
+        self.backend_mod = backend_mod
+        self.host = host
+        self.port = port
+        self.socket_path = socket_path
+        self._connected = True
+        self._life = time.time()
+        self._pool = pool
+        self._released = False
+
+
+class PoolStats(object):
+    """A snapshot of the statistics for a connection pool.
+
+    """
+    def __init__(self, checked_out=0, peak_checked_out=0, idle=0, created=0,
+                 reused=0, discarded=0, overflowed=0):
+        #: The number of connections currently in use.
+        self.checked_out = checked_out
+
+        #: The largest number of connections which have been in use at once.
+        self.peak_checked_out = peak_checked_out
+
+        #: The number of connections currently idle in the pool.
+        self.idle = idle
+
+        #: The number of connections which have been opened.
+        self.created = created
+
+        #: The number of times an idle connection has been reused.
+        self.reused = reused
+
+        #: The number of connections which have been closed by the pool, for
+        #: being too old, idle for too long, broken, or not fitting in the
+        #: pool.
+        self.discarded = discarded
+
+        #: The number of connections which were closed after use because the
+        #: pool already held `max_idle` idle connections.  A steadily
+        #: increasing value means that the pool is too small for the number
+        #: of concurrent requests being made.
+        self.overflowed = overflowed
+
+    def as_dict(self):
+        """Get the statistics as a dictionary.
+
+        """
+        return dict(self.__dict__)
+
+    def __repr__(self):
+        return '<PoolStats %s>' % ' '.join('%s=%d' % item for item in
+                                           sorted(self.__dict__.items()))
+
+
+class RestPosePool(ConnectionPool):
+    """A pool of connections, with configurable limits and statistics.
+
+    """
+    def __init__(self, max_idle=10, idle_timeout=None,
+                 max_lifetime=600., max_per_host=None, factory=Connection,
+                 **pool_opts):
+        """
+        :param max_idle: The maximum number of idle connections to keep
+               open for reuse.  This doesn't limit the number of connections
+               in use (see `max_per_host`): a request made while none is idle
+               opens a new connection, but if the pool already holds this
+               many idle connections when it is released, it is closed (and
+               counted in `overflowed`).
+
+        :param idle_timeout: The number of seconds an unused connection may be
+               kept in the pool.  None means connections are kept until they
+               reach `max_lifetime`.
+
+        :param max_lifetime: The maximum age of a connection, in seconds,
+               after which it will not be reused.  This doesn't limit how
+               long a request may take.
+
+        :param max_per_host: The maximum number of connections to each host
+               (and port) which may be in use at once.  Requests beyond this
+               wait for a connection to the host to be released.  None means
+               no limit.
+
+        :param factory: The class used to create connections.
+
+        :param pool_opts: Any other options to pass to
+               :class:`socketpool.ConnectionPool`.
+
+        """
+        self.idle_timeout = idle_timeout
+        self.max_per_host = max_per_host
+        self._stats_lock = threading.Lock()
+        self._slot_free = threading.Condition(self._stats_lock)
+        self._checked_out = set()
+        # The number of connections in use to each (host, port).
+        self._in_use = {}
+        self._peak_checked_out = 0
+        self._created = 0
+        self._reused = 0
+        self._discarded = 0
+        self._overflowed = 0
+        super(RestPosePool, self).__init__(factory=self._create,
+                                           max_size=max_idle,
+                                           max_lifetime=max_lifetime,
+                                           **pool_opts)
+        self._factory = factory
+
+    @property
+    def max_idle(self):
+        return self.max_size
+
+    def _create(self, **options):
+        conn = self._factory(**options)
+        with self._stats_lock:
+            self._created += 1
+        conn._restpose_uses = 0
+        return conn
+
+    def too_old(self, conn):
+        now = time.time()
+        if now - conn.get_lifetime() > self.max_lifetime:
+            return True
+        idle_since = getattr(conn, '_restpose_idle_since', None)
+        return (idle_since is not None and self.idle_timeout is not None and
+                now - idle_since > self.idle_timeout)
+
+    def _reap_connection(self, conn):
+        if conn.is_connected():
+            with self._stats_lock:
+                self._discarded += 1
+        super(RestPosePool, self)._reap_connection(conn)
+
+    def _drop_closed(self):
+        """Forget checked out connections which are no longer open.
+
+        Connections which were closed after an error are not always
+        returned to the pool.  Must be called with the stats lock held.
+
+        """
+        for conn in list(self._checked_out):
+            try:
+                connected = conn.is_connected()
+            except Exception:
+                connected = False
+            if not connected:
+                self._forget(conn)
+
+    def _forget(self, conn):
+        """Stop counting a connection as checked out.
+
+        Must be called with the stats lock held.
+
+        """
+        if conn in self._checked_out:
+            self._checked_out.discard(conn)
+            self._release_slot(conn._restpose_key)
+
+    def _release_slot(self, key):
+        self._in_use[key] -= 1
+        if not self._in_use[key]:
+            del self._in_use[key]
+        self._slot_free.notify()
+
+    def get(self, **options):
+        key = (options.get('host'), options.get('port'))
+        with self._slot_free:
+            if self.max_per_host is not None:
+                while True:
+                    self._drop_closed()
+                    if self._in_use.get(key, 0) < self.max_per_host:
+                        break
+                    # Check for closed connections now and then, since they
+                    # may never be released.
+                    self._slot_free.wait(0.1)
+            self._in_use[key] = self._in_use.get(key, 0) + 1
+        try:
+            conn = super(RestPosePool, self).get(**options)
+        except BaseException:
+            with self._slot_free:
+                self._release_slot(key)
+            raise
+        conn._restpose_key = key
+        with self._stats_lock:
+            if conn._restpose_uses:
+                self._reused += 1
+            self._checked_out.add(conn)
+            self._peak_checked_out = max(self._peak_checked_out,
+                                         len(self._checked_out))
+        conn._restpose_uses += 1
+        conn._restpose_idle_since = None
+        return conn
+
+    def release_connection(self, conn):
+        with self._stats_lock:
+            self._forget(conn)
+            if self.pool.qsize() >= self.max_size:
+                self._overflowed += 1
+        conn._restpose_idle_since = time.time()
+        super(RestPosePool, self).release_connection(conn)
+
+    def prewarm(self, host, port, count, is_ssl=False, **options):
+        """Open connections in advance, and leave them idle in the pool.
+
+        :param host: The host to connect to.
+        :param port: The port to connect to.
+        :param count: The number of idle connections to the host to have in
+               the pool.  Connections to other hosts don't count towards
+               this, but no more are opened once the pool holds
+               `max_idle` connections.
+        :param is_ssl: True if the connections should use SSL.
+
+        """
+        opts = dict(options)
+        opts.update(self.options)
+        wanted = min(count, self.max_size) - self._idle_to(host, port)
+        for _ in range(min(wanted, self.max_size - self.size)):
+            self.release_connection(self._create(host=host, port=port,
+                                                 is_ssl=is_ssl,
+                                                 extra_headers=[], **opts))
+
+    def _idle_to(self, host, port):
+        """Count the idle connections to a host.
+
+        """
+        # Iterating over the queue takes the connections out of it, as in
+        # murder_connections(), so they are put back afterwards.
+        idle = []
+        for item in self.pool:
+            idle.append(item)
+            if len(idle) >= self.max_size:
+                break
+        for item in idle:
+            self.pool.put(item)
+        return sum(1 for _, conn in idle if conn.matches(host=host, port=port))
+
+    @property
+    def stats(self):
+        """A :class:`PoolStats` snapshot of the current pool statistics.
+
+        """
+        with self._stats_lock:
+            self._drop_closed()
+            return PoolStats(checked_out=len(self._checked_out),
+                             peak_checked_out=self._peak_checked_out,
+                             idle=self.size,
+                             created=self._created,
+                             reused=self._reused,
+                             discarded=self._discarded,
+                             overflowed=self._overflowed)
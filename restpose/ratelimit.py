@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+"""
+Limiting the rate at which requests are sent.
+
+A :class:`TokenBucket` allows `rate` operations per second on average, with
+bursts of up to `burst` operations.  It may be shared between threads::
+
+    bucket = TokenBucket(rate=500)
+    coll.delete_matching(query, rate=bucket)
+
+A :class:`WriteLimiter` limits document additions and deletions, by both
+requests and bytes per second.  It may be attached to a
+:class:`restpose.client.Server`, to limit writes to all of its collections,
+or to a single :class:`restpose.client.Collection`, and the rates may be
+changed while it is in use; for example, to throttle a background reindexer
+during busy hours::
+
+    limiter = WriteLimiter(rate=200, bytes_rate=2000000)
+    coll = server.collection('places', write_limit=limiter)
+    ...
+    limiter.rate = 50
+
+Writers wait for their turn by default; with `block=False`, a write which
+would exceed the limit raises :exc:`restpose.errors.RateLimitExceeded`
+instead.
+
+"""
+
+from .errors import RateLimitExceeded
+import threading
+import time
+
+
+class TokenBucket(object):
+    """A token bucket rate limiter.
+
+    Tokens are added to the bucket at `rate` per second, up to `burst`
+    tokens.  Each operation takes tokens from the bucket, waiting for them
+    to be added if there aren't enough.
+
+    """
+    def __init__(self, rate, burst=None, clock=time.time, sleep=time.sleep):
+        """
+        :param rate: The number of tokens added per second.
+
+        :param burst: The most tokens the bucket can hold.  Defaults to
+               `rate` (ie, one second's worth of tokens).  The bucket starts
+               full.
+
+        :param clock: The function used to get the current time.
+
+        :param sleep: The function used to wait.
+
+        """
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        if burst is None:
+            burst = max(1.0, self.rate)
+        self.burst = float(burst)
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated = clock()
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+        self._updated = now
+
+    @property
+    def tokens(self):
+        """The number of tokens currently in the bucket.
+
+        This is negative if callers are waiting for tokens.
+
+        """
+        with self._lock:
+            self._refill(self._clock())
+            return self._tokens
+
+    def set_rate(self, rate, burst=None):
+        """Change the rate (and burst size) of the bucket.
+
+        Callers already waiting for tokens are not affected.
+
+        :param burst: The new burst size.  Defaults to `rate`.
+
+        """
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        with self._lock:
+            self._refill(self._clock())
+            self.rate = float(rate)
+            if burst is None:
+                burst = max(1.0, self.rate)
+            self.burst = float(burst)
+            self._tokens = min(self._tokens, self.burst)
+
+    def reserve(self, tokens=1):
+        """Take tokens from the bucket without waiting, going into debt if
+        there aren't enough.
+
+        :returns: The time the caller should wait before proceeding, in
+                  seconds.
+
+        """
+        with self._lock:
+            self._refill(self._clock())
+            self._tokens -= tokens
+            if self._tokens < 0:
+                return -self._tokens / self.rate
+            return 0.0
+
+    def acquire(self, tokens=1):
+        """Take tokens from the bucket, waiting until they are available.
+
+        Callers are served in the order they call this method: tokens are
+        reserved immediately (the bucket may go into debt), and the caller
+        then waits for the debt to be repaid.
+
+        :returns: The time spent waiting, in seconds.
+
+        """
+        wait = self.reserve(tokens)
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+    def try_acquire(self, tokens=1):
+        """Take tokens from the bucket, if they are available now.
+
+        A request for more than `burst` tokens succeeds if the bucket is
+        full, leaving it in debt.
+
+        :returns: True if the tokens were taken, False otherwise.
+
+        """
+        with self._lock:
+            self._refill(self._clock())
+            if self._tokens < min(tokens, self.burst):
+                return False
+            self._tokens -= tokens
+            return True
+
+
+class WriteLimiter(object):
+    """A limit on the rate of writes, in requests and bytes per second.
+
+    Each write takes a token for the request from one bucket, and a token
+    per byte of its body from another.  Either limit may be None, for no
+    limit.  A limiter may be shared between threads, and between servers
+    and collections.
+
+    """
+    def __init__(self, rate=None, bytes_rate=None, burst=None,
+                 bytes_burst=None, block=True, clock=time.time,
+                 sleep=time.sleep):
+        """
+        :param rate: The number of requests allowed per second, or None.
+
+        :param bytes_rate: The number of bytes of request bodies allowed per
+               second, or None.
+
+        :param burst: The number of requests which may be made at once.
+               Defaults to `rate`.
+
+        :param bytes_burst: The number of bytes which may be sent at once.
+               Defaults to `bytes_rate`.
+
+        :param block: If True, writers wait until the limits allow them to
+               proceed.  If False, a write which would exceed a limit raises
+               :exc:`restpose.errors.RateLimitExceeded`.
+
+        :param clock: The function used to get the current time.
+
+        :param sleep: The function used to wait.
+
+        """
+        self.block = block
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._burst = burst
+        self._bytes_burst = bytes_burst
+        self._requests = self._bucket(rate, burst)
+        self._bytes = self._bucket(bytes_rate, bytes_burst)
+
+        #: The number of writes allowed.
+        self.allowed = 0
+
+        #: The number of writes refused, when not blocking.
+        self.refused = 0
+
+        #: The total time writers have been told to wait, in seconds.
+        self.waited = 0.0
+
+    def _bucket(self, rate, burst):
+        if rate is None:
+            return None
+        return TokenBucket(rate, burst, clock=self._clock, sleep=self._sleep)
+
+    @property
+    def rate(self):
+        """The number of requests allowed per second, or None.
+
+        This may be set to change the limit.
+
+        """
+        bucket = self._requests
+        return None if bucket is None else bucket.rate
+
+    @rate.setter
+    def rate(self, rate):
+        with self._lock:
+            self._requests = self._adjust(self._requests, rate, self._burst)
+
+    @property
+    def bytes_rate(self):
+        """The number of bytes allowed per second, or None.
+
+        This may be set to change the limit.
+
+        """
+        bucket = self._bytes
+        return None if bucket is None else bucket.rate
+
+    @bytes_rate.setter
+    def bytes_rate(self, bytes_rate):
+        with self._lock:
+            self._bytes = self._adjust(self._bytes, bytes_rate,
+                                       self._bytes_burst)
+
+    def set_rates(self, rate, bytes_rate, burst=None, bytes_burst=None):
+        """Change both limits at once.
+
+        Writers already waiting are not affected.  Arguments are as for the
+        constructor, except that burst sizes which aren't given keep any
+        value given previously.
+
+        """
+        with self._lock:
+            if burst is not None:
+                self._burst = burst
+            if bytes_burst is not None:
+                self._bytes_burst = bytes_burst
+            self._requests = self._adjust(self._requests, rate, self._burst)
+            self._bytes = self._adjust(self._bytes, bytes_rate,
+                                       self._bytes_burst)
+
+    def _adjust(self, bucket, rate, burst):
+        if rate is None or bucket is None:
+            return self._bucket(rate, burst)
+        bucket.set_rate(rate, burst)
+        return bucket
+
+    def acquire(self, size=0):
+        """Wait until a write with a body of `size` bytes may be made.
+
+        :returns: The time spent waiting, in seconds.
+
+        :raises: :exc:`restpose.errors.RateLimitExceeded` if the limiter
+                 doesn't block, and the write would exceed a limit.
+
+        """
+        with self._lock:
+            requests, nbytes = self._requests, self._bytes
+            if not self.block:
+                if (requests is not None and
+                    requests.tokens < min(1, requests.burst)) or \
+                   (nbytes is not None and size and
+                    nbytes.tokens < min(size, nbytes.burst)):
+                    self.refused += 1
+                    raise RateLimitExceeded(
+                        "Write rate limit exceeded", retry_after=max(
+                            self._shortfall(requests, 1),
+                            self._shortfall(nbytes, size)))
+            wait = 0.0
+            if requests is not None:
+                wait = requests.reserve(1)
+            if nbytes is not None and size:
+                wait = max(wait, nbytes.reserve(size))
+            if not self.block:
+                # Only a write larger than the burst size leaves debt here;
+                # it is repaid by later writes being refused.
+                wait = 0.0
+            self.allowed += 1
+            self.waited += wait
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+    @staticmethod
+    def _shortfall(bucket, tokens):
+        if bucket is None or not tokens:
+            return 0.0
+        return max(0.0, min(tokens, bucket.burst) - bucket.tokens) / \
+            bucket.rate
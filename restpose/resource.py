@@ -12,13 +12,15 @@ by the RestPose server.
 """
 
 from .version import __version__
-from .errors import RestPoseError
+from .codec import get_codec
+from .instrument import TimingClient
+from .response import BaseResponse
 import restkit
-import json
 import six
 import sys
+import time
 
-class RestPoseResponse(restkit.Response):
+class RestPoseResponse(BaseResponse, restkit.Response):
     """A response from the RestPose server.
 
     In addition to the properties exposed by :mod:`restkit:restkit.Response`, this
@@ -26,37 +28,47 @@ class RestPoseResponse(restkit.Response):
 
     """
 
-    @property
-    def json(self):
-        """Get the response body as JSON.
+    #: The :class:`restpose.compression.Compression` object used to decode
+    #: compressed responses, or None.  This is set by
+    #: :class:`RestPoseResource` for each response it returns.
+    compression = None
 
-        :returns: The response body as a python object, decoded from JSON, if
-                  the response Content-Type was application/json.
+    def body_string(self, charset=None, unicode_errors="strict"):
+        """Get the response body.
 
-        :raises: an exception if the Content-Type is not application/json, or
-                 the body is not valid JSON.
-
-        :raises: :exc:`RestPoseError` if the status code returned is not one of the supplied status codes.
+        Compressed bodies are decompressed if the resource which made the
+        request had compression enabled.
 
         """
-        ctype = self.headers.get('Content-Type')
-        if ctype == 'application/json':
-            return json.loads(self.body_string())
-        raise RestPoseError("Unexpected return content type: %s" % ctype)
-
-    def expect_status(self, *expected):
-        """Check that the status code is one of a set of expected codes.
-
-        :param expected: The expected status codes.
+        body = self._read_body(charset, unicode_errors)
+        timing = self.timing
+        if timing is not None:
+            timing.finish()
+        return body
+
+    def _read_body(self, charset=None, unicode_errors="strict"):
+        timing = self.timing
+        if timing is not None:
+            start = time.time()
+        body = super(RestPoseResponse, self).body_string()
+        if timing is not None:
+            timing.read_time = time.time() - start
+            timing.response_bytes = len(body)
+        if self.compression is not None:
+            body = self.compression.decompress(
+                body, self.headers.get('Content-Encoding'))
+        if charset is not None:
+            body = body.decode(charset, unicode_errors)
+        return body
+
+
+def _to_bytes(buf):
+    """Convert a bytearray or memoryview to bytes.
 
-        :raises: :exc:`RestPoseError` if the status code returned is not one of
-                 the supplied status codes.
-
-        """
-        if self.status_int not in expected:
-            raise RestPoseError("Unexpected return status: %d" %
-                                self.status_int)
-        return self
+    """
+    if isinstance(buf, memoryview):
+        return buf.tobytes()
+    return six.binary_type(buf)
 
 
 class RestPoseResource(restkit.Resource):
@@ -71,25 +83,69 @@ class RestPoseResource(restkit.Resource):
     #: The user agent to send when making requests.
     user_agent = 'restpose_python/%s' % __version__
 
-    def __init__(self, uri, **client_opts):
+    def __init__(self, uri, codec=None, compression=None, retry=None,
+                 instrument=None, **client_opts):
         """Initialise the resource.
 
         :param uri: The full URI for the resource.
 
+        :param codec: The JSON codec to use for encoding request bodies and
+               decoding responses.  May be the name of a codec, or a codec
+               object; if None, the fastest available codec is used.  See
+               :mod:`restpose.codec`.
+
+        :param compression: A :class:`restpose.compression.Compression`
+               object, to compress large request bodies and accept compressed
+               responses.  If None, no compression is used.
+
+        :param retry: A :class:`restpose.retry.RetryPolicy` object, to retry
+               requests which fail because the server is busy or a connection
+               failed.  If None, requests are not retried.
+
+        :param instrument: A :class:`restpose.instrument.Instrumentation`
+               object, to report the timings of each request to.  If None,
+               requests are not timed.
+
         :param client_opts: Any options to be passed to :class:`restkit.Resource`.
 
         """
         client_opts['response_class'] = RestPoseResponse
+        if compression is not None:
+            # Responses are decompressed by RestPoseResponse, so that the
+            # compressed sizes can be counted.
+            client_opts.setdefault('decompress', False)
         super(RestPoseResource, self).__init__(uri=uri, **client_opts)
 
+        # Keep resource-level options with the initial options, so that
+        # clone() creates an equivalent resource.
+        self.initial['client_opts'].update(codec=codec,
+                                           compression=compression,
+                                           retry=retry,
+                                           instrument=instrument)
+
+        #: The JSON codec in use.
+        self.codec = get_codec(codec)
+
+        #: The compression settings in use, or None.
+        self.compression = compression
+
+        #: The retry policy in use, or None.
+        self.retry = retry
+
+        #: The instrumentation in use, or None.
+        self.instrument = instrument
+        if instrument is not None:
+            self.client = TimingClient(**self.client_opts)
+            self.client.instrument = instrument
+
     def request(self, method, path=None, payload=None, headers=None, **params):
         """Perform a request.
 
         :param method: the HTTP method to use, as a string.
         :param path: The path to request.
         :param payload: A payload to send as the request body; may be a
-               file-like object, or a string, or a structure to send encoded as
-               a JSON object.
+               file-like object, or a string (or bytes, bytearray or
+               memoryview), or a structure to send encoded as a JSON object.
         :param headers: A dictionary of headers.  If not already set, Accept
                and User-Agent headers will be added to this, and if there is a
                JSON payload, the Content-Type will be set to application/json.
@@ -102,11 +158,41 @@ class RestPoseResource(restkit.Resource):
         headers.setdefault('User-Agent', self.user_agent)
 
         if payload is not None:
-            if not hasattr(payload, 'read') and \
-               not isinstance(payload, six.string_types):
-                payload = json.dumps(payload).encode('utf-8')
+            if isinstance(payload, (bytearray, memoryview)):
+                # Already encoded; restkit only sends bytes, so this is
+                # copied, but not encoded again.
+                payload = _to_bytes(payload)
+            elif not hasattr(payload, 'read') and \
+               not isinstance(payload, (six.text_type, six.binary_type)):
+                payload = self.codec.dumps(payload)
                 headers.setdefault('Content-Type', 'application/json')
 
+        compression = self.compression
+        if compression is not None:
+            if compression.accept_encoding:
+                headers.setdefault('Accept-Encoding',
+                                   compression.accept_encoding)
+            if isinstance(payload, six.binary_type) and \
+               'Content-Encoding' not in headers:
+                payload, encoding = compression.compress(payload)
+                if encoding is not None:
+                    headers['Content-Encoding'] = encoding
+
+        retry = self.retry
+        if retry is None or hasattr(payload, 'read'):
+            # File-like payloads can't be resent, so aren't retried.
+            return self._request(method, path, payload, headers, params)
+        return retry.call(
+            lambda: self._request(method, path, payload, headers, params),
+            method, path)
+
+    def _request(self, method, path, payload, headers, params):
+        """Perform a single attempt at a request.
+
+        The payload must already have been encoded.
+
+        """
+        compression = self.compression
         try:
             resp = super(RestPoseResource, self).request(
                 method, path=path,
@@ -117,13 +203,18 @@ class RestPoseResource(restkit.Resource):
             # Unpack any errors which are in JSON format.
             msg = getattr(e, 'msg', '')
             msgobj = None
+            if e.response and msg and compression is not None:
+                msg = e.msg = compression.decompress(
+                    msg, e.response.headers.get('Content-Encoding'))
             if e.response and msg:
                 ctype = e.response.headers.get('Content-Type')
                 if ctype == 'application/json':
-                    msgobj = json.loads(msg)
+                    msgobj = self.codec.loads(msg)
             if msgobj is not None:
                 e.msg = msgobj.get('err', '')
             e.msgobj = msgobj
             raise
 
+        resp.codec = self.codec
+        resp.compression = compression
         return resp
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+"""
+Responses from RestPose.
+
+The methods here are shared by the responses of the synchronous client (see
+:mod:`restpose.resource`) and the asyncio client (see :mod:`restpose.aio`), so
+this module mustn't import restkit.
+
+"""
+
+from .errors import RestPoseError
+from .codec import get_codec
+import time
+
+class BaseResponse(object):
+    """Methods for handling a response from the RestPose server.
+
+    Subclasses must provide `status_int` and `headers` attributes, a
+    `request` attribute (which may be None), and a `_read_body` method which
+    returns the body of the response.
+
+    """
+
+    #: The codec used to decode JSON responses.  This is set by the resource
+    #: which made the request; if None, the default codec is used.
+    codec = None
+
+    @property
+    def timing(self):
+        """The :class:`restpose.instrument.RequestTiming` for the request, or
+        None if the request is not being timed.
+
+        """
+        return getattr(self.request, 'restpose_timing', None)
+
+    @property
+    def json(self):
+        """Get the response body as JSON.
+
+        :returns: The response body as a python object, decoded from JSON, if
+                  the response Content-Type was application/json.
+
+        :raises: an exception if the Content-Type is not application/json, or
+                 the body is not valid JSON.
+
+        :raises: :exc:`RestPoseError` if the status code returned is not one of the supplied status codes.
+
+        """
+        ctype = self.headers.get('Content-Type')
+        if ctype == 'application/json':
+            body = self._read_body()
+            timing = self.timing
+            if timing is None:
+                return (self.codec or get_codec()).loads(body)
+            start = time.time()
+            try:
+                return (self.codec or get_codec()).loads(body)
+            finally:
+                timing.decode_time = time.time() - start
+                timing.finish()
+        raise RestPoseError("Unexpected return content type: %s" % ctype)
+
+    def expect_status(self, *expected):
+        """Check that the status code is one of a set of expected codes.
+
+        :param expected: The expected status codes.
+
+        :raises: :exc:`RestPoseError` if the status code returned is not one of
+                 the supplied status codes.
+
+        """
+        if self.status_int not in expected:
+            raise RestPoseError("Unexpected return status: %d" %
+                                self.status_int)
+        return self
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+"""
+Retrying of requests which fail for transient reasons.
+
+When :attr:`restpose.Server.wait` is `none`, a request which arrives while
+the server's processing queue is full is refused, with a 503 status.
+Requests may also fail because a connection was reset or refused.  Passing a
+:class:`RetryPolicy` as the `retry` option to :class:`restpose.Server` (or
+:class:`restpose.resource.RestPoseResource`) makes the client retry such
+requests, waiting for an exponentially increasing, randomised, period
+between attempts::
+
+    retry = RetryPolicy(max_attempts=10, max_elapsed=60)
+    server = Server('http://127.0.0.1:7777', retry=retry)
+    server.wait = 'none'
+    ...
+    print(retry.stats)
+
+Requests refused by the server are always safe to retry, since they were not
+acted on.  When a connection fails, however, the client cannot know whether
+the server acted on the request, so only idempotent requests are retried:
+GET, HEAD, PUT and DELETE requests, and searches.  POST requests which add a
+document without an ID, or create a checkpoint, are not retried after a
+connection failure.
+
+"""
+
+from restkit.errors import RequestError, RequestTimeout, ResourceError
+import random
+import socket
+import sys
+import threading
+import time
+
+
+class RetryStats(object):
+    """Counters for a :class:`RetryPolicy`.
+
+    """
+    def __init__(self):
+        #: The number of requests made (not counting retries).
+        self.requests = 0
+
+        #: The number of retries made.
+        self.retries = 0
+
+        #: The number of retries made because the server was busy.
+        self.retries_busy = 0
+
+        #: The number of retries made because of a connection failure.
+        self.retries_connection = 0
+
+        #: The number of requests which succeeded after being retried.
+        self.recovered = 0
+
+        #: The number of requests which failed after retrying was given up.
+        self.give_ups = 0
+
+        #: The total time spent waiting between attempts, in seconds.
+        self.backoff_time = 0.0
+
+    def as_dict(self):
+        """Get the counters as a dictionary.
+
+        """
+        return dict(self.__dict__)
+
+    def __repr__(self):
+        return '<RetryStats %s>' % ' '.join(
+            '%s=%s' % item for item in sorted(self.__dict__.items()))
+
+
+class RetryPolicy(object):
+    """Settings for retrying requests which fail for transient reasons.
+
+    """
+
+    #: Methods which may be repeated without changing the result.
+    idempotent_methods = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+    #: Exceptions which indicate that no response was received.
+    connection_errors = (RequestError, RequestTimeout, socket.error)
+
+    def __init__(self, max_attempts=5, initial_backoff=0.05, max_backoff=5.0,
+                 multiplier=2.0, jitter=True, max_elapsed=30.0,
+                 retry_statuses=(503,), retry_connection_errors=True,
+                 sleep=time.sleep):
+        """
+        :param max_attempts: The maximum number of attempts to make, including
+               the first.
+
+        :param initial_backoff: The longest time to wait, in seconds, before
+               the first retry.
+
+        :param max_backoff: The longest time to wait between any two attempts.
+
+        :param multiplier: The factor by which the wait grows after each
+               attempt.
+
+        :param jitter: If True, the wait before each retry is chosen uniformly
+               at random between 0 and the current backoff ("full jitter"), so
+               that clients retrying at the same time spread out.
+
+        :param max_elapsed: No retry is started if it would begin more than
+               this many seconds after the first attempt.  None for no limit.
+
+        :param retry_statuses: HTTP status codes for which a request is
+               retried.  These must indicate that the server did not act on
+               the request.
+
+        :param retry_connection_errors: If True, idempotent requests which
+               fail to get a response are retried.
+
+        :param sleep: The function used to wait.
+
+        """
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        self.max_attempts = max_attempts
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.max_elapsed = max_elapsed
+        self.retry_statuses = tuple(retry_statuses)
+        self.retry_connection_errors = retry_connection_errors
+        self.sleep = sleep
+
+        #: Counters of retries made.
+        self.stats = RetryStats()
+        self._lock = threading.Lock()
+
+    def is_idempotent(self, method, path):
+        """Return True if a request may safely be sent more than once.
+
+        """
+        if method in self.idempotent_methods:
+            return True
+        return method == 'POST' and path is not None and \
+               path.rstrip('/').endswith('/search')
+
+    def classify(self, exc, method, path):
+        """Decide whether a failed request should be retried.
+
+        :returns: 'busy' if the server refused the request, 'connection' if
+                  an idempotent request got no response, or None if the
+                  request should not be retried.
+
+        """
+        if isinstance(exc, ResourceError):
+            if exc.status_int in self.retry_statuses:
+                return 'busy'
+            return None
+        if self.retry_connection_errors and \
+           isinstance(exc, self.connection_errors) and \
+           self.is_idempotent(method, path):
+            return 'connection'
+        return None
+
+    def backoff(self, attempt):
+        """Get the time to wait before a retry.
+
+        :param attempt: The number of attempts made so far.
+
+        """
+        delay = min(self.max_backoff,
+                    self.initial_backoff * self.multiplier ** (attempt - 1))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+    def call(self, func, method, path):
+        """Call a function performing a request, retrying it if it fails.
+
+        :param func: A function of no arguments, which performs the request.
+
+        :param method: The HTTP method of the request.
+
+        :param path: The path of the request.
+
+        :returns: The return value of `func`.
+
+        """
+        stats = self.stats
+        with self._lock:
+            stats.requests += 1
+        start = time.time()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                result = func()
+            except Exception:
+                e = sys.exc_info()[1] # Python 2/3 compatibility
+                reason = self.classify(e, method, path)
+                if reason is None:
+                    raise
+                delay = self.backoff(attempt)
+                if attempt >= self.max_attempts or \
+                   (self.max_elapsed is not None and
+                    time.time() + delay - start > self.max_elapsed):
+                    with self._lock:
+                        stats.give_ups += 1
+                    raise
+                with self._lock:
+                    stats.retries += 1
+                    if reason == 'busy':
+                        stats.retries_busy += 1
+                    else:
+                        stats.retries_connection += 1
+                    stats.backoff_time += delay
+                self.sleep(delay)
+                continue
+            if attempt > 1:
+                with self._lock:
+                    stats.recovered += 1
+            return result
@@ -0,0 +1,429 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+"""
+Building queries against a query target.
+
+The classes here build queries for a collection or document type, but don't
+contact the server; they are shared by the synchronous client in
+:mod:`restpose.client` and the asyncio client in :mod:`restpose.aio`, so this
+module mustn't import restkit.
+
+"""
+
+from .query import QueryAll, QueryNone, QueryField, QueryMeta
+
+
+def _first(value):
+    """Get the first of a list of stored field values.
+
+    """
+    if isinstance(value, list):
+        if not value:
+            return None
+        return value[0]
+    return value
+
+
+class FieldQueryFactory(object):
+    """Object for creating searches on a field.
+
+    """
+
+    def __init__(self, target=None):
+        """
+        :param target: The target to pass to the Query objects created.
+
+        """
+        #: The target that will be used when creating Query objects.  Defaults
+        #: to None.
+        self.target = target
+
+    def __call__(self, fieldname):
+        """Create a FieldQuerySource for the given fieldname.
+
+        This is mainly intended for use for fieldnames which are stored in a
+        parameter, or which are reserved or invalid Python identifiers.
+
+        """
+        return FieldQuerySource(fieldname, self.target)
+
+    def __getattr__(self, fieldname):
+        """Get a FieldQuerySource for the given fieldname.
+
+        The FieldQuerySource has various operators used to build queries.
+
+        """
+        return FieldQuerySource(fieldname, self.target)
+
+
+class FieldQuerySource(object):
+    """An object which generates queries for a specific field.
+
+    """
+    def __init__(self, fieldname, target=None):
+        """
+        :param fieldname: The name of the field to generate queries for.  If
+               set to None, will generate queries across all fields.
+        :param target: The target to generate queries pointing to.
+
+        """
+        self.fieldname = fieldname
+        self.target = target
+
+    def is_in(self, values):
+        """Create a query for fields which exactly match the given values.
+
+        A document will match if at least one of the stored values for the
+        field exactly matches at least one of the given values.
+
+        This query type is currently available only for "exact", "id" and "cat"
+        field types.
+
+        :param value: A container holding the values to search for.  As a
+               special case, if a string is supplied, this is equivalent to
+               supplying a container holding that string.
+
+        :example:
+
+            Search for documents in which the "tag" field has a value of
+            "edam", "cheddar" or "leicester".
+
+            >>> query = coll.field.tag.is_in(['edam', 'cheddar', 'leicester'])
+
+            Search for documents in which the "tag" field has a value of
+            "edam".
+
+            >>> query = coll.field.tag.is_in('edam')
+
+        """
+        return QueryField(self.fieldname, 'is', values, target=self.target)
+
+    def is_descendant(self, categories):
+        """Create a query for field values which are categories which are
+        descendants of one of the given categories.
+
+        A document will match if at least one of the stored values for the
+        field exactly matches a descendant of the given categories.
+
+        This query type is available only for "cat" field types.
+
+        :param categories: A container holding the categories to search for.
+               As a special case, if a string is supplied, this is equivalent
+               to supplying a container holding that string.
+
+        :example:
+
+            Search for documents in which the "tag" field is a descendant of
+            a value of "cheese"
+
+            >>> query = coll.field.tag.is_descendant('cheese')
+
+            or, equivalently:
+
+            >>> query = coll.field.tag.is_descendant(['cheese'])
+
+        """
+        return QueryField(self.fieldname, 'is_descendant', categories,
+                          target=self.target)
+
+    def is_or_is_descendant(self, categories):
+        """Create a query for field values which are categories which are
+        descendants of one of the given categories.
+
+        A document will match if at least one of the stored values for the
+        field exactly matches a descendant of the given categories.
+
+        This query type is available only for "cat" field types.
+
+        :param categories: A container holding the categories to search for.
+               As a special case, if a string is supplied, this is equivalent
+               to supplying a container holding that string.
+
+        :example:
+
+            Search for documents in which the "tag" field has a value of
+            "cheese", or has a value which is a descendant of "cheese".
+
+            >>> query = coll.field.tag.is_or_is_descendant('cheese')
+
+            or, equivalently:
+
+            >>> query = coll.field.tag.is_or_is_descendant(['cheese'])
+
+        """
+        return QueryField(self.fieldname, 'is_or_is_descendant', categories,
+                          target=self.target)
+
+    def __eq__(self, value):
+        """Create a query for fields which exactly match the given value.
+
+        Matches documents in which the supplied value exactly matches the
+        stored value.
+
+        This query type is currently available only for "exact", "id" and "cat"
+        field types.
+
+        This query type may be constructed using the == operator, or the
+        ``equals`` method.
+
+        :param value: The value to search for.
+
+        :example:
+
+            Search for documents in which the "tag" field has a value of
+            "edam".
+
+            >>> query = coll.field.tag.equals('edam')
+
+            Or, equivalently (but less conveniently for chained calls)
+
+            >>> query = (coll.field.tag == 'edam')
+
+        """
+        return QueryField(self.fieldname, 'is', (value,), target=self.target)
+    equals = __eq__
+
+    def range(self, begin, end):
+        """Create a query for field values in a given range.
+
+        Matches documents in which one of the stored values in the field are in
+        the specified range, including both the begin and end values.
+
+        This type is currently available only for "double", "date" and
+        "timestamp" field types.
+
+        :param begin: The start of the range.
+        :param end: The end of the range.
+
+        :example:
+
+            Search for documents in which the "num" field has a value in the
+            range 0 to 10 (including the endpoints).
+
+            >>> query = coll.field.num.range(0, 10)
+
+        """
+        return QueryField(self.fieldname, 'range', (begin, end),
+                          target=self.target)
+
+    def distscore(self, center, max_range=None):
+        """Create a query for geospatial field values based on distance.
+
+        Matches documents in which one of the stored values in the field is
+        within the specified range of the center point (in meters on the
+        surface of the earth).
+
+        This type is currently available only for "lonlat" field types.
+
+        :param center: The center for the query.  Either a (lon, lat) tuple, or
+                       an object with "lon" and "lat" properties; in either
+                       case, the longitude and latitude must be stored as
+                       numbers.
+        :param max_range: The maximum range (in meters) of documents to return;
+                       if None, returns documents with no maximum range.  
+
+        :example:
+
+            Search for documents in which the "num" field has a value in the
+            range 0 to 10 (including the endpoints).
+
+            >>> query = coll.field.latlon.distscore([0.0, 0.0], 1609.344)
+
+        """
+        params = dict(center = center)
+        if max_range is not None:
+            params['max_range'] = max_range
+        return QueryField(self.fieldname, 'distscore', params,
+                          target=self.target)
+
+
+    def text(self, text, op="phrase", window=None):
+        """Create a query for a piece of text in the field.
+
+        This is a simple search for a matching sequences of words (subject to
+        whatever processing has been performed on the field to conflate variant
+        forms of words, such as stemming or word splitting for CJK text).
+
+        :param text: The text to search for.  If empty, this query will
+               match no results.
+        :param op: The operator to use when searching.  One of "or", "and",
+               "phrase" (ordered proximity), "near" (unordered proximity).
+               Default="phrase".
+        :param window: Only relevant if op is "phrase" or "near". Window size
+               in words within which the words in the text need to occur for a
+               document to match; None=length of text. Integer or None.
+               Default=None
+
+        :example:
+
+            Search for documents in which the "text" field contains text
+            matching the phrase "Hello world".
+
+            >>> query = coll.field.text.text("Hello world")
+
+        """
+        value = dict(text=text)
+        if op is not None:
+            value['op'] = op
+        if window is not None:
+            value['window'] = window
+        return QueryField(self.fieldname, 'text', value, target=self.target)
+
+    def parse(self, text, op="and"):
+        """Parse a structured query, searching the field.
+
+        Unlike text, this allows various operators to be used in the query; for
+        example, parentheses may be used, and operators such as "AND" may be
+        used 
+
+        .. todo:: Document the operators permitted.
+
+        Beware that the parser is unable to make sense of some query strings
+        (eg, those with mismatched parentheses).  If such a query string is
+        used, an error will be returned by the server when the search is
+        performed.
+
+        :param fieldname: The field to search within.
+        :param text: Text to search for.  If empty, this query will match no
+               results.
+        :param op: The default operator to use when searching.  One of "or",
+               "and".  Default="and".
+
+        :example:
+
+            Search for documents in which the "text" field contains both
+            "Hello" and "world", but not "big".
+
+            >>> query = coll.field.text.text("Hello world -big")
+
+        """
+        value = dict(text=text)
+        if op is not None:
+            value['op'] = op
+        return QueryField(self.fieldname, 'parse', value, target=self.target)
+
+    def exists(self):
+        """Search for documents in which the field exists.
+
+        This type may be used to search across all fields.
+
+        :example:
+
+            Search for documents in which the "text" field exists.
+
+            >>> query = coll.field.text.exists()
+
+            Search for documents in which any field exists.
+
+            >>> query = coll.any_field.exists()
+
+        """
+        return QueryMeta('exists', (self.fieldname,), target=self.target)
+
+    def nonempty(self):
+        """Search for documents in which the field has a non-empty value.
+
+        This type may be used to search across all fields.
+
+        :example:
+
+            Search for documents in which the "text" field has a non-empty
+            value.
+
+            >>> query = coll.field.text.nonempty()
+
+            Search for documents in which any field has a non-empty value.
+
+            >>> query = coll.any_field.nonempty()
+
+        """
+        return QueryMeta('nonempty', (self.fieldname,), target=self.target)
+
+    def empty(self):
+        """Search for documents in which the field has an empty value.
+
+        This type may be used to search across all fields.
+
+        :example:
+
+            Search for documents in which the "text" field has an empty
+            value.
+
+            >>> query = coll.field.text.empty()
+
+            Search for documents in which any field has an empty value.
+
+            >>> query = coll.any_field.empty()
+
+        """
+        return QueryMeta('empty', (self.fieldname,), target=self.target)
+
+    def has_error(self):
+        """Search for documents in which the field produced errors when
+        parsing.
+
+        This type may be used to search across all fields.
+
+        :example:
+
+            Search for documents in which the "text" field had an error when
+            parsing.
+
+            >>> query = coll.field.text.has_error()
+
+            Search for documents in which any field had an error when parsing.
+
+            >>> query = coll.any_field.has_error()
+
+        """
+        return QueryMeta('error', (self.fieldname,), target=self.target)
+
+
+Field = FieldQueryFactory()
+AnyField = FieldQuerySource(fieldname=None)
+
+
+class QueryBuilder(object):
+    """Methods for building queries against a query target.
+
+    Subclasses provide a `search` method (which may be a coroutine) to
+    run the queries.
+
+    """
+    def __init__(self):
+        #: Factory for field-specific queries.
+        self.field = FieldQueryFactory(target=self)
+
+        #: Pseudo field for making queries across all fields.
+        self.any_field = FieldQuerySource(fieldname=None, target=self)
+
+        self._realiser = None
+
+    def all(self):
+        """Create a query which matches all documents."""
+        return QueryAll(target=self)
+
+    def none(self):
+        """Create a query which matches no documents."""
+        return QueryNone(target=self)
+
+    def find(self, q):
+        """Apply a Query to this QueryTarget.
+
+        :param q: A Query object which will have the target applied to it.
+
+        """
+        return q.set_target(self)
+
+    def set_realiser(self, realiser):
+        """Set the function to get objects associated with results.
+
+        This may be overridden for a particular search by setting a realiser on
+        a Searchable.
+
+        """
+        self._realiser = realiser
+        return self
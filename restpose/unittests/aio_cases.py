@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+from unittest import TestCase
+from ..aio import AsyncServer, ResourceNotFound, ResourceGone, RequestError
+from ..query import SearchResults
+import asyncio
+import json
+import os
+import subprocess
+import sys
+
+
+class StandInServer(object):
+    """A minimal HTTP server, standing in for a RestPose server.
+
+    Responds to a handful of paths with canned JSON, and counts the
+    connections made to it.  If `drop_reused` is set, a connection is closed
+    without a response when a second request is made on it.
+
+    """
+    def __init__(self):
+        self.connections = 0
+        self.requests = []
+        self.checkpoint_polls = 0
+        self.drop_reused = False
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+        port = self.server.sockets[0].getsockname()[1]
+        return 'http://127.0.0.1:%d' % port
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    def respond(self, method, path, body):
+        if path.startswith(('/coll/c/search', '/coll/c/type/t/search')):
+            query = json.loads(body.decode('utf-8'))
+            return 200, {
+                'from': query.get('from', 0),
+                'size_requested': query.get('size', 10),
+                'check_at_least': query.get('check_at_least', 0),
+                'matches_lower_bound': 1,
+                'matches_estimated': 1,
+                'matches_upper_bound': 1,
+                'items': [{'id': ['1'], 'type': ['t']}],
+            }
+        if path.startswith('/coll/c/type/t/id/1') and method == 'PUT':
+            return 202, {'ok': 1}
+        if path == '/coll/c/type/t/id/gone':
+            return 410, {'err': 'Resource gone'}
+        if path == '/coll/c/type/t/id/1':
+            return 200, {'data': {'id': ['1']}, 'terms': {}, 'values': {}}
+        if path.startswith('/coll/c/checkpoint?'):
+            return 201, {'checkid': 'abc'}
+        if path == '/coll/c/checkpoint/abc':
+            self.checkpoint_polls += 1
+            return 200, {'reached': self.checkpoint_polls > 2,
+                         'errors': [], 'total_errors': 0}
+        return 404, {'err': 'Resource not found'}
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        handled = 0
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            method, path, version = line.decode('latin-1').split()
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line == b'\r\n':
+                    break
+                k, v = line.decode('latin-1').split(':', 1)
+                if k.lower() == 'content-length':
+                    length = int(v)
+            body = await reader.readexactly(length)
+            self.requests.append((method, path))
+            if handled and self.drop_reused:
+                break
+            handled += 1
+            if path == '/bad-header':
+                writer.write(b'HTTP/1.1 200 OK\r\nNo colon here\r\n\r\n')
+                await writer.drain()
+                break
+            status, obj = self.respond(method, path, body)
+            data = json.dumps(obj).encode('utf-8')
+            writer.write(('HTTP/1.1 %d X\r\nContent-Type: application/json'
+                          '\r\nContent-Length: %d\r\n\r\n' %
+                          (status, len(data))).encode('latin-1') + data)
+            await writer.drain()
+        writer.close()
+
+
+class AsyncClientTest(TestCase):
+
+    def run_with_server(self, test):
+        async def runner():
+            stand_in = StandInServer()
+            uri = await stand_in.start()
+            server = AsyncServer(uri, max_connections=4)
+            try:
+                await test(server, stand_in)
+            finally:
+                await server.close()
+                await stand_in.stop()
+        asyncio.run(runner())
+
+    def test_import_without_restkit(self):
+        # restkit doesn't work on Python 3, so the asyncio client mustn't
+        # need it.  Setting its entry in sys.modules to None makes any import
+        # of it fail.
+        code = ("import sys; sys.modules['restkit'] = None; "
+                "import restpose.aio")
+        topdir = os.path.dirname(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__))))
+        self.assertEqual(subprocess.call([sys.executable, '-c', code],
+                                         cwd=topdir), 0)
+
+    def test_search(self):
+        async def test(server, stand_in):
+            coll = server.collection('c')
+            results = await coll.search(coll.field.id.equals('1')[:5])
+            self.assertTrue(isinstance(results, SearchResults))
+            self.assertEqual(results.size_requested, 5)
+            self.assertEqual(results[0].data, {'id': ['1'], 'type': ['t']})
+        self.run_with_server(test)
+
+    def test_matching_ids(self):
+        async def test(server, stand_in):
+            for target in (server.collection('c'),
+                           server.collection('c').doc_type('t')):
+                self.assertEqual(await target.matching_ids(target.all()),
+                                 [('t', '1')])
+                # The threaded delete_matching() isn't inherited.
+                self.assertFalse(hasattr(target, 'delete_matching'))
+        self.run_with_server(test)
+
+    def test_concurrent_searches_share_connections(self):
+        async def test(server, stand_in):
+            coll = server.collection('c')
+            q = coll.all()[:10]
+            results = await asyncio.gather(*[coll.search(q)
+                                             for _ in range(50)])
+            self.assertEqual(len(results), 50)
+            self.assertEqual(len(stand_in.requests), 50)
+            self.assertTrue(stand_in.connections <= 4)
+        self.run_with_server(test)
+
+    def test_documents(self):
+        async def test(server, stand_in):
+            doc_type = server.collection('c').doc_type('t')
+            self.assertEqual(await doc_type.add_doc({'id': '1'}, doc_id='1'),
+                             {'ok': 1})
+            doc = await doc_type.get_doc('1')
+            self.assertEqual(doc.data, {'id': ['1']})
+            try:
+                await doc_type.get_doc('2')
+                self.fail("Expected ResourceNotFound")
+            except ResourceNotFound as e:
+                self.assertEqual(e.msg, 'Resource not found')
+            try:
+                await doc_type.get_doc('gone')
+                self.fail("Expected ResourceGone")
+            except ResourceGone as e:
+                self.assertEqual(e.msg, 'Resource gone')
+        self.run_with_server(test)
+
+    def test_checkpoint(self):
+        async def test(server, stand_in):
+            chk = await server.collection('c').checkpoint()
+            self.assertEqual(chk.check_id, 'abc')
+            self.assertEqual(chk.errors, None)
+            self.assertTrue(chk is await chk.wait())
+            self.assertEqual(chk.errors, [])
+            self.assertEqual(chk.total_errors, 0)
+            self.assertEqual(stand_in.checkpoint_polls, 3)
+        self.run_with_server(test)
+
+    def test_retry_stale_connection(self):
+        async def test(server, stand_in):
+            stand_in.drop_reused = True
+            doc_type = server.collection('c').doc_type('t')
+            await doc_type.get_doc('1')
+            # The server drops the pooled connection without responding, so
+            # the GET is sent again on a new connection.
+            doc = await doc_type.get_doc('1')
+            self.assertEqual(doc.data, {'id': ['1']})
+            self.assertEqual(stand_in.connections, 2)
+            self.assertEqual(len(stand_in.requests), 3)
+
+            # A POST isn't idempotent, so isn't sent again.
+            with self.assertRaises(RequestError):
+                await server.collection('c').checkpoint()
+            self.assertEqual(stand_in.connections, 2)
+            self.assertEqual(len(stand_in.requests), 4)
+        self.run_with_server(test)
+
+    def test_bad_header(self):
+        async def test(server, stand_in):
+            with self.assertRaises(RequestError) as cm:
+                await server._resource.get('/bad-header')
+            self.assertTrue('Bad header line' in str(cm.exception))
+        self.run_with_server(test)
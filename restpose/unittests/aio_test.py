@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+import sys
+from unittest import TestCase, skip
+
+if sys.version_info >= (3, 7):
+    # The tests use syntax which earlier versions of Python can't parse, so
+    # are kept in a module which test discovery doesn't import.
+    from .aio_cases import AsyncClientTest
+else:
+    @skip("restpose.aio requires Python 3.7 or later")
+    class AsyncClientTest(TestCase):
+        def test_aio(self):
+            pass
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+from unittest import TestCase
+from .. import Server
+from ..balancer import BalancedResource
+from ..bulk import BulkIndexer
+from ..codec import JsonCodec
+from restkit import RequestError, RequestFailed
+
+class FakeResource(object):
+    """A resource which records requests instead of making them.
+
+    Setting `down` makes every request fail with a connection error.
+
+    """
+    def __init__(self, uri, **client_opts):
+        self.uri = uri
+        self.requests = []
+        self.down = False
+
+    def request(self, method, path=None, payload=None, headers=None,
+                **params):
+        self.requests.append((method, path))
+        if self.down:
+            raise RequestError("connection refused")
+        if path == '/fail':
+            raise RequestFailed("server error", http_code=500)
+        return self
+
+    def get(self, path=None, **params):
+        return self.request("GET", path=path, **params)
+
+    def expect_status(self, *expected):
+        return self
+
+    json = {}
+
+
+class BalancerTest(TestCase):
+
+    uris = ['http://a:7777', 'http://b:7777', 'http://c:7777']
+
+    def make(self, **kwargs):
+        return BalancedResource(self.uris, resource_class=FakeResource,
+                                **kwargs)
+
+    def counts(self, balanced):
+        return [len(e.resource.requests) for e in balanced.endpoints]
+
+    def test_writes_go_to_primary(self):
+        b = self.make()
+        b.put('/coll/c/type/t/id/1', payload={})
+        b.post('/coll/c/type/t', payload={})
+        b.delete('/coll/c/type/t/id/1')
+        b.post('/coll/c/checkpoint')
+        b.get('/coll/c/checkpoint/abc')
+        self.assertEqual(self.counts(b), [5, 0, 0])
+
+    def test_reads_are_spread(self):
+        b = self.make()
+        for _ in range(30):
+            b.post('/coll/c/search', payload={})
+            b.get('/coll/c/type/t/id/1')
+        counts = self.counts(b)
+        self.assertEqual(sum(counts), 60)
+        self.assertTrue(min(counts) > 0)
+        self.assertEqual(sum(e.outstanding for e in b.endpoints), 0)
+
+        b = self.make(read_from_primary=False)
+        for _ in range(10):
+            b.get('/status')
+        self.assertEqual(self.counts(b)[0], 0)
+
+    def test_ewma_prefers_fast_endpoint(self):
+        b = self.make(balance_policy='ewma')
+        for endpoint, latency in zip(b.endpoints, (0.5, 0.01, 0.3)):
+            endpoint.latency = latency
+        b._record = lambda endpoint, elapsed=None, failed=False: None
+        for _ in range(10):
+            b.get('/status')
+        self.assertEqual(self.counts(b), [0, 10, 0])
+
+    def test_failover_and_ejection(self):
+        b = self.make(max_failures=2, eject_time=1000)
+        b.endpoints[1].resource.down = True
+        for _ in range(20):
+            b.get('/status')
+        self.assertFalse(b.endpoints[1].healthy)
+        self.assertEqual(len(b.endpoints[1].resource.requests), 2)
+        self.assertTrue(b.endpoints[0].healthy)
+        self.assertTrue(b.endpoints[2].healthy)
+
+        # Writes to a failed primary are not sent elsewhere.
+        b.endpoints[0].resource.down = True
+        before = self.counts(b)
+        self.assertRaises(RequestError, b.put, '/coll/c/type/t/id/1',
+                          payload={})
+        self.assertEqual(self.counts(b),
+                         [before[0] + 1, before[1], before[2]])
+
+    def test_all_down(self):
+        b = self.make()
+        for endpoint in b.endpoints:
+            endpoint.resource.down = True
+        self.assertRaises(RequestError, b.get, '/status')
+        self.assertEqual(self.counts(b), [1, 1, 1])
+
+    def test_server_errors(self):
+        b = self.make(max_failures=1)
+        self.assertRaises(RequestFailed, b.get, '/fail')
+        self.assertEqual(len([e for e in b.endpoints if not e.healthy]), 1)
+
+    def test_probe(self):
+        b = self.make(max_failures=1, eject_time=1000)
+        b.endpoints[2].resource.down = True
+        b.probe()
+        self.assertEqual([e.healthy for e in b.endpoints],
+                         [True, True, False])
+        b.endpoints[2].resource.down = False
+        b.probe()
+        self.assertEqual([e.healthy for e in b.endpoints],
+                         [True, True, True])
+
+    def test_codec(self):
+        # Documents are encoded with the codec given to a Server with
+        # several URIs.
+        codec = JsonCodec()
+        server = Server(self.uris, codec=codec)
+        self.assertTrue(server._resource.codec is codec)
+        indexer = BulkIndexer(server.collection('c'), checkpoint=False)
+        self.assertTrue(indexer._codec is codec)
+        indexer.abort()
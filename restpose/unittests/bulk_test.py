@@ -0,0 +1,484 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+from unittest import TestCase
+from .. import Server
+from ..bulk import BulkIndexer, AdaptiveIndexer, EncodingPool
+from ..errors import BulkIndexError, CopyVerificationError
+from ..ratelimit import TokenBucket
+from restkit import RequestFailed
+import json
+import sys
+import threading
+import time
+
+class IndexingResource(object):
+    """A resource which records document updates, and answers checkpoints.
+
+    Documents whose body contains "bad" are rejected.
+
+    """
+    def __init__(self, uri, **client_opts):
+        self.uri = uri
+        self.client_opts = client_opts
+        self.lock = threading.Lock()
+        self.updates = []
+        self.checkpoints = []
+        self.checkpoint_errors = []
+        self.delay = 0
+
+    def request(self, method, path=None, payload=None, headers=None,
+                **params):
+        if method == 'POST' and path.endswith('/checkpoint'):
+            self.checkpoints.append((path, params))
+            return Response(201, {'checkid': 'c1'})
+        if '/checkpoint/' in path:
+            return Response(200, {'reached': True,
+                                  'errors': self.checkpoint_errors,
+                                  'total_errors':
+                                  len(self.checkpoint_errors)})
+        time.sleep(self.delay)
+        if payload is not None and b'bad' in bytes(payload):
+            raise RequestFailed("bad document", http_code=400)
+        with self.lock:
+            self.updates.append((method, path, payload, params))
+        return Response(202, {'ok': 1})
+
+    def get(self, path=None, **params):
+        return self.request('GET', path, **params)
+
+    def post(self, path=None, payload=None, **params):
+        return self.request('POST', path, payload, **params)
+
+    def put(self, path=None, payload=None, **params):
+        return self.request('PUT', path, payload, **params)
+
+    def delete(self, path=None, **params):
+        return self.request('DELETE', path, **params)
+
+
+class SearchingResource(IndexingResource):
+    """A resource which answers searches with a fixed list of documents.
+
+    """
+    def __init__(self, uri, **client_opts):
+        super(SearchingResource, self).__init__(uri, **client_opts)
+        self.docs = [{'type': ['t'], 'id': [str(num)], 'num': [num]}
+                     for num in range(25)]
+        self.searches = []
+
+    def request(self, method, path=None, payload=None, headers=None,
+                **params):
+        if method == 'GET' and path.count('/') == 2:
+            # Collection status; documents added count once indexed.
+            added = set(u[1] for u in self.updates if u[0] == 'PUT')
+            return Response(200, {'doc_count': len(self.docs) + len(added)})
+        if path.endswith('/search'):
+            self.searches.append(payload)
+            start = payload.get('from', 0)
+            items = self.docs[start:start + payload['size']]
+            return Response(200, {'from': start, 'items': items,
+                                  'matches_upper_bound': len(self.docs)})
+        return super(SearchingResource, self).request(method, path, payload,
+                                                      headers, **params)
+
+
+class Response(object):
+    def __init__(self, status, body):
+        self.status_int = status
+        self.json = body
+
+    def expect_status(self, *expected):
+        assert self.status_int in expected
+        return self
+
+
+def make_item(num):
+    """Make a document to index, in an EncodingPool worker process.
+
+    """
+    return {'num': num}, 't', str(num)
+
+
+class BulkIndexerTest(TestCase):
+
+    def setUp(self):
+        self.server = Server(resource_class=IndexingResource)
+        self.resource = self.server._resource
+        self.coll = self.server.collection('c')
+
+    def test_collection(self):
+        with BulkIndexer(self.coll, workers=3, batch_size=5) as indexer:
+            for num in range(20):
+                indexer.add({'num': num}, doc_type='t', doc_id=str(num))
+            indexer.add({'type': 't', 'id': '20'})
+            indexer.delete('3', doc_type='t')
+            self.assertRaises(ValueError, indexer.delete, '3')
+
+        updates = self.resource.updates
+        self.assertEqual(len(updates), 22)
+        self.assertEqual(sorted(u[1] for u in updates if u[0] == 'PUT'),
+                         sorted('/coll/c/type/t/id/%d' % num
+                                for num in range(20)))
+        self.assertEqual([u[1] for u in updates if u[0] == 'POST'],
+                         ['/coll/c'])
+        self.assertTrue('num' in json.loads(updates[0][2].decode('utf-8')))
+        self.assertEqual(updates[0][3], {'wait': 'process'})
+
+        # Updates to the same document are applied in order.
+        paths = [(u[0], u[1]) for u in updates]
+        self.assertTrue(paths.index(('PUT', '/coll/c/type/t/id/3')) <
+                        paths.index(('DELETE', '/coll/c/type/t/id/3')))
+
+        self.assertEqual(self.resource.checkpoints,
+                         [('/coll/c/checkpoint',
+                           {'params_dict': {'wait': 'process',
+                                            'commit': '1'}})])
+        stats = indexer.stats
+        self.assertEqual((stats.added, stats.deleted, stats.failed),
+                         (21, 1, 0))
+        self.assertTrue(stats.batches >= 4)
+        self.assertEqual((indexer.submitted, indexer.acknowledged), (22, 22))
+
+    def test_order_with_ids_in_documents(self):
+        self.resource.delay = 0.001
+        with BulkIndexer(self.coll, workers=4, batch_size=1,
+                         checkpoint=False) as indexer:
+            for num in range(12):
+                doc_id = str(num)
+                indexer.add({'type': 't', 'id': doc_id, 'v': 1})
+                if num % 3 == 0:
+                    indexer.add({'type': 't', 'v': 2}, doc_id=doc_id)
+                elif num % 3 == 1:
+                    indexer.add(b'{"type":["t"],"id":[%d],"v":2}' % num)
+                indexer.delete(doc_id, doc_type='t')
+
+        # Each document's updates are sent in the order they were given.
+        seen = dict((str(num), []) for num in range(12))
+        for method, path, payload, _ in self.resource.updates:
+            if method == 'DELETE':
+                seen[path.rsplit('/', 1)[1]].append('deleted')
+            else:
+                doc = json.loads(bytes(payload).decode('utf-8'))
+                doc_id = path.rsplit('/', 1)[1] if 'id' not in doc \
+                    else str(doc['id'][0] if isinstance(doc['id'], list)
+                             else doc['id'])
+                seen[doc_id].append(doc['v'])
+        for num in range(12):
+            expected = [1, 2, 'deleted'] if num % 3 != 2 else [1, 'deleted']
+            self.assertEqual(seen[str(num)], expected)
+
+    def test_batches_queued_in_order(self):
+        indexer = BulkIndexer(self.coll, workers=1, checkpoint=False)
+        indexer.add({'v': 1}, doc_type='t', doc_id='1')
+        with indexer._lock:
+            first, first_seq = indexer._batches[0], indexer._take_batch(0)
+        indexer.add({'v': 2}, doc_type='t', doc_id='1')
+        with indexer._lock:
+            second, second_seq = indexer._batches[0], indexer._take_batch(0)
+
+        # The later batch waits for the earlier one to be queued.
+        thread = threading.Thread(target=indexer._dispatch,
+                                  args=(0, second, second_seq))
+        thread.start()
+        time.sleep(0.02)
+        self.assertEqual(self.resource.updates, [])
+        indexer._dispatch(0, first, first_seq)
+        thread.join()
+        indexer.close()
+        self.assertEqual([json.loads(u[2].decode('utf-8'))['v']
+                          for u in self.resource.updates], [1, 2])
+
+    def test_doc_type(self):
+        doc_type = self.coll.doc_type('t')
+        with BulkIndexer(doc_type, wait='none', checkpoint=False) as indexer:
+            indexer.add({'a': 1}, doc_id='1')
+            indexer.add({'id': '2'})
+            indexer.delete('1')
+            self.assertRaises(ValueError, indexer.add, {}, doc_type='u')
+        self.assertEqual(sorted((u[0], u[1], u[3]['wait'])
+                                for u in self.resource.updates),
+                         [('DELETE', '/coll/c/type/t/id/1', 'none'),
+                          ('POST', '/coll/c/type/t', 'none'),
+                          ('PUT', '/coll/c/type/t/id/1', 'none')])
+        self.assertEqual(self.resource.checkpoints, [])
+
+    def test_errors(self):
+        self.resource.checkpoint_errors = [{'msg': 'indexing failed'}]
+        indexer = BulkIndexer(self.coll)
+        indexer.add({'text': 'bad'}, doc_type='t', doc_id='1')
+        indexer.add({'text': 'good'}, doc_type='t', doc_id='2')
+        try:
+            indexer.close()
+        except BulkIndexError:
+            e = sys.exc_info()[1]
+        else:
+            self.fail("BulkIndexError not raised")
+        self.assertEqual(e.total_errors, 1)
+        self.assertEqual(e.errors[0][:2], ('PUT', '/coll/c/type/t/id/1'))
+        self.assertEqual(e.checkpoint_errors, [{'msg': 'indexing failed'}])
+        self.assertEqual(e.checkpoint_total_errors, 1)
+        self.assertRaises(ValueError, indexer.add, {}, doc_type='t')
+
+    def test_flush_interval(self):
+        indexer = BulkIndexer(self.coll, flush_interval=0.05)
+        indexer.add({'a': 1}, doc_type='t', doc_id='1')
+        deadline = time.time() + 5
+        while not self.resource.updates and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(self.resource.updates), 1)
+        indexer.close()
+
+    def test_backpressure(self):
+        self.resource.delay = 0.01
+        indexer = BulkIndexer(self.coll, workers=1, batch_size=1,
+                              max_pending=1, checkpoint=False)
+        start = time.time()
+        for num in range(10):
+            indexer.add({'a': num}, doc_type='t', doc_id=str(num))
+        # At most two updates can be held (one sending, one queued), so
+        # most of the sending happens before add() returns.
+        self.assertTrue(time.time() - start >= 0.07)
+        indexer.close()
+        self.assertEqual(len(self.resource.updates), 10)
+
+    def test_encoded(self):
+        with BulkIndexer(self.coll, checkpoint=False) as indexer:
+            indexer.add(b'{"a":1}', doc_type='t', doc_id='1')
+            indexer.add(bytearray(b'{"a":2}'), doc_type='t', doc_id='2')
+            view = memoryview(b'{"a":3}')
+            indexer.add_encoded(view, doc_type='t', doc_id='3')
+        payloads = dict((u[1], u[2]) for u in self.resource.updates)
+        self.assertEqual(payloads['/coll/c/type/t/id/1'], b'{"a":1}')
+        self.assertEqual(payloads['/coll/c/type/t/id/2'],
+                         bytearray(b'{"a":2}'))
+        # Buffers are passed through without being copied.
+        self.assertTrue(payloads['/coll/c/type/t/id/3'] is view)
+        self.assertEqual(indexer.stats.bytes_sent, 21)
+
+    def test_encoding_pool(self):
+        items = [({'num': num}, 't', str(num)) for num in range(50)]
+        items.append((b'{"num":50}', 't', '50'))
+        with EncodingPool(processes=2, chunk_size=7, max_chunks=2) as pool:
+            encoded = list(pool.imap(iter(items)))
+            self.assertEqual([(doc_type, doc_id)
+                              for (_, doc_type, doc_id) in encoded],
+                             [('t', str(num)) for num in range(51)])
+            self.assertEqual(json.loads(encoded[3][0].decode('utf-8')),
+                             {'num': 3})
+
+            with BulkIndexer(self.coll, checkpoint=False) as indexer:
+                indexer.add_many(items, encoder=pool)
+        self.assertEqual(sorted(json.loads(u[2].decode('utf-8'))['num']
+                                for u in self.resource.updates),
+                         list(range(51)))
+
+    def test_encoding_pool_builds_docs(self):
+        with EncodingPool(processes=2, chunk_size=7) as pool:
+            encoded = list(pool.imap(range(20), func=make_item))
+            self.assertEqual([doc_id for (_, _, doc_id) in encoded],
+                             [str(num) for num in range(20)])
+            with BulkIndexer(self.coll, checkpoint=False) as indexer:
+                indexer.add_many(range(20), encoder=pool, func=make_item)
+        with BulkIndexer(self.coll, checkpoint=False) as indexer:
+            indexer.add_many(range(20, 30), func=make_item)
+        self.assertEqual(sorted(json.loads(u[2].decode('utf-8'))['num']
+                                for u in self.resource.updates),
+                         list(range(30)))
+
+    def test_abort(self):
+        try:
+            with BulkIndexer(self.coll) as indexer:
+                indexer.add({'a': 1}, doc_type='t', doc_id='1')
+                raise KeyError()
+        except KeyError:
+            pass
+        self.assertEqual(self.resource.updates, [])
+        self.assertEqual(self.resource.checkpoints, [])
+
+
+class DeleteMatchingTest(TestCase):
+
+    def setUp(self):
+        self.server = Server(resource_class=SearchingResource)
+        self.resource = self.server._resource
+        self.coll = self.server.collection('c')
+
+    def test_collection(self):
+        waits = []
+        bucket = TokenBucket(1000, burst=5, clock=lambda: 0.0,
+                             sleep=waits.append)
+        query = self.coll.field.tag.equals('old')
+        self.assertEqual(self.coll.delete_matching(query, rate=bucket,
+                                                   page_size=10), 25)
+        self.assertEqual(sorted(u[1] for u in self.resource.updates),
+                         sorted('/coll/c/type/t/id/%d' % num
+                                for num in range(25)))
+        self.assertTrue(all(u[0] == 'DELETE' for u in self.resource.updates))
+        self.assertEqual([s.get('from', 0) for s in self.resource.searches],
+                         [0, 10, 20])
+        self.assertEqual(self.resource.searches[0]['query'],
+                         query._build_search()['query'])
+        # The rate limit made the deletions after the first five wait.
+        self.assertEqual(len(waits), 20)
+        self.assertEqual(len(self.resource.checkpoints), 1)
+
+    def test_doc_type(self):
+        doc_type = self.coll.doc_type('t')
+        self.assertEqual(doc_type.matching_ids(doc_type.all(),
+                                               page_size=25)[:2],
+                         [('t', '0'), ('t', '1')])
+        self.assertEqual(len(self.resource.searches), 1)
+        self.assertEqual(doc_type.delete_matching(doc_type.all(), rate=1e6,
+                                                  checkpoint=False), 25)
+        self.assertEqual(self.resource.checkpoints, [])
+
+
+class CopyTest(TestCase):
+
+    def setUp(self):
+        self.source = Server(resource_class=SearchingResource)
+        self.target = Server(resource_class=SearchingResource)
+        self.target._resource.docs = []
+
+    def test_copy(self):
+        def transform(doc):
+            if doc['id'] == ['3']:
+                return None
+            doc = dict(doc)
+            doc['num'] = doc['num'][0] * 2
+            return doc
+        stats = self.source.collection('c').copy_to(
+            self.target.collection('c'), transform=transform, partitions=3,
+            page_size=4)
+        self.assertEqual(stats.as_dict(),
+                         {'source_count': 25, 'read': 25, 'written': 24,
+                          'skipped': 1, 'target_count': 24})
+        updates = self.target._resource.updates
+        self.assertEqual(sorted(u[1] for u in updates),
+                         sorted('/coll/c/type/t/id/%d' % num
+                                for num in range(25) if num != 3))
+        doc = [json.loads(u[2].decode('utf-8')) for u in updates
+               if u[1] == '/coll/c/type/t/id/7'][0]
+        self.assertEqual(doc, {'type': ['t'], 'id': ['7'], 'num': 14})
+        # Three partitions of nine documents, in pages of four.
+        self.assertEqual(sorted(s.get('from', 0) for s in
+                                self.source._resource.searches),
+                         [0, 4, 8, 9, 13, 17, 18, 22])
+        self.assertEqual(len(self.target._resource.checkpoints), 1)
+
+    def test_failed_range_stops_copy(self):
+        failed = threading.Event()
+        def transform(doc):
+            if doc['id'] == ['18']:
+                failed.set()
+                raise ValueError("bad document")
+            # The other ranges are part way through a page when the third
+            # range fails.
+            failed.wait(5)
+            time.sleep(0.05)
+            return doc
+        partitions = 3
+        self.assertRaises(ValueError, self.source.collection('c').copy_to,
+                          self.target.collection('c'), transform=transform,
+                          partitions=partitions, page_size=1)
+        # The ranges stop after the page they are reading, rather than
+        # reading all 25 documents.
+        self.assertTrue(len(self.source._resource.searches) <=
+                        partitions * 2)
+        self.assertEqual(self.target._resource.checkpoints, [])
+
+    def test_verify(self):
+        # Documents go missing on the way.
+        self.target._resource.updates = FixedList()
+        self.assertRaises(CopyVerificationError,
+                          self.source.collection('c').copy_to,
+                          self.target.collection('c'))
+        stats = self.source.collection('c').copy_to(
+            self.target.collection('c'), verify=False)
+        self.assertEqual(stats.target_count, -1)
+
+    def test_verify_with_replica(self):
+        # The replica never receives the documents, but the counts are read
+        # from the primary.
+        target = Server(['http://primary:7777', 'http://replica:7777'],
+                        resource_class=SearchingResource,
+                        read_from_primary=False)
+        for endpoint in target._resource.endpoints:
+            endpoint.resource.docs = []
+        stats = self.source.collection('c').copy_to(target.collection('c'))
+        self.assertEqual(stats.target_count, 25)
+        self.assertEqual(target._resource.endpoints[1].resource.updates, [])
+
+
+class FixedList(list):
+    """A list which ignores appends after the first ten."""
+    def append(self, item):
+        if len(self) < 10:
+            super(FixedList, self).append(item)
+
+
+class BusyResource(IndexingResource):
+    """A resource which refuses updates when too many are in progress.
+
+    """
+    capacity = 4
+
+    def __init__(self, uri, **client_opts):
+        super(BusyResource, self).__init__(uri, **client_opts)
+        self.active = 0
+        self.peak = 0
+
+    def request(self, method, path=None, payload=None, headers=None,
+                **params):
+        if 'checkpoint' in path:
+            return super(BusyResource, self).request(method, path, payload,
+                                                     headers, **params)
+        with self.lock:
+            if self.active >= self.capacity:
+                raise RequestFailed("queue full", http_code=503)
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            time.sleep(0.002)
+            return super(BusyResource, self).request(method, path, payload,
+                                                     headers, **params)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+class AdaptiveIndexerTest(TestCase):
+
+    def test_aimd(self):
+        server = Server(resource_class=BusyResource)
+        resource = server._resource
+        coll = server.collection('c')
+        indexer = AdaptiveIndexer(coll, initial_concurrency=1,
+                                  max_concurrency=16, resend_delay=0.001,
+                                  rate_window=0.05)
+        self.assertEqual(indexer.concurrency, 1)
+        with indexer:
+            for num in range(400):
+                indexer.add({'a': num}, doc_type='t', doc_id=str(num))
+        self.assertEqual(len(resource.updates), 400)
+        self.assertEqual(indexer.stats.failed, 0)
+        self.assertEqual(indexer.in_flight, 0)
+
+        # The concurrency grew until the server started refusing updates,
+        # and was then cut back.
+        self.assertEqual(resource.peak, BusyResource.capacity)
+        self.assertTrue(indexer.refused > 0)
+        self.assertTrue(indexer.concurrency < 16)
+        self.assertTrue(indexer.throughput > 0)
+        self.assertEqual(resource.updates[0][3], {'wait': 'none'})
+
+    def test_other_errors(self):
+        server = Server(resource_class=IndexingResource)
+        indexer = AdaptiveIndexer(server.collection('c'), checkpoint=False)
+        indexer.add({'text': 'bad'}, doc_type='t', doc_id='1')
+        self.assertRaises(BulkIndexError, indexer.close)
+        self.assertEqual(indexer.refused, 0)
+        self.assertEqual(indexer.concurrency, 4)
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+from unittest import TestCase
+from .. import Server, CheckPointExpiredError, CheckPointTimeoutError
+from .bulk_test import Response
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import urlsplit, parse_qs
+import json
+import threading
+import time
+
+class PollingResource(object):
+    """A resource whose checkpoints are reached after a number of polls.
+
+    If `reached_after` is None, checkpoints are never reached.  Each poll
+    takes `delay` seconds; `max_active` records the most polls which were
+    in progress at once.
+
+    """
+    def __init__(self, uri, **client_opts):
+        self.client_opts = client_opts
+        self.reached_after = 3
+        self.expired = False
+        self.polls = []
+        self.delay = 0
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def request(self, method, path=None, payload=None, headers=None,
+                **params):
+        if method == 'POST':
+            return Response(201, {'checkid': 'c1'})
+        with self.lock:
+            self.polls.append(time.time())
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delay)
+        finally:
+            with self.lock:
+                self.active -= 1
+        if self.expired:
+            return Response(200, None)
+        if self.reached_after is None or \
+           len(self.polls) < self.reached_after:
+            return Response(200, {'reached': False})
+        return Response(200, {'reached': True, 'errors': [],
+                              'total_errors': 0})
+
+    def get(self, path=None, **params):
+        return self.request('GET', path, **params)
+
+    def post(self, path=None, payload=None, **params):
+        return self.request('POST', path, payload, **params)
+
+
+class CheckPointWaitTest(TestCase):
+
+    def setUp(self):
+        self.server = Server(resource_class=PollingResource)
+        self.resource = self.server._resource
+        self.coll = self.server.collection('c')
+
+    def test_backoff(self):
+        self.resource.reached_after = 5
+        checkpoint = self.coll.checkpoint()
+        started = time.time()
+        self.assertTrue(checkpoint.wait(poll=0.01) is checkpoint)
+        # The polls back off from 10ms: 10, 20, 40 and 80ms.
+        self.assertTrue(time.time() - started < 0.5)
+        self.assertEqual(checkpoint.polls, 5)
+        polls = self.resource.polls
+        gaps = [b - a for a, b in zip(polls, polls[1:])]
+        self.assertTrue(gaps[-1] > gaps[0])
+        self.assertTrue(checkpoint.waited >= sum(gaps))
+
+        # Once reached, waiting doesn't contact the server again.
+        checkpoint.wait()
+        self.assertEqual(checkpoint.polls, 5)
+        self.assertEqual(checkpoint.total_errors, 0)
+
+    def test_timeout(self):
+        self.resource.reached_after = None
+        checkpoint = self.coll.checkpoint()
+        checkpoint.max_poll = 0.02
+        started = time.time()
+        try:
+            checkpoint.wait(timeout=0.1)
+            self.fail("CheckPointTimeoutError not raised")
+        except CheckPointTimeoutError as e:
+            self.assertEqual(e.check_id, 'c1')
+            self.assertEqual(e.timeout, 0.1)
+        elapsed = time.time() - started
+        self.assertTrue(0.1 <= elapsed < 0.5)
+        self.assertTrue(checkpoint.polls > 3)
+        self.assertTrue(checkpoint.waited >= 0.1)
+
+        self.resource.expired = True
+        self.assertRaises(CheckPointExpiredError, checkpoint.wait, 1)
+
+    def test_shared_wait(self):
+        # Threads waiting on the same checkpoint don't poll the server
+        # concurrently, and share the result of each poll.
+        self.resource.reached_after = 4
+        self.resource.delay = 0.02
+        checkpoint = self.coll.checkpoint()
+        results = []
+
+        def wait():
+            results.append(checkpoint.wait(timeout=5, poll=0.001))
+
+        threads = [threading.Thread(target=wait) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [checkpoint] * 8)
+        self.assertEqual(self.resource.max_active, 1)
+        self.assertEqual(len(self.resource.polls), 4)
+        self.assertEqual(checkpoint.polls, 4)
+        self.assertTrue(checkpoint.reached)
+        self.assertEqual(checkpoint.errors, [])
+        self.assertEqual(len(self.resource.polls), 4)
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers checkpoint requests, holding them open if the server can
+    long-poll and the client asks it to.
+
+    """
+    def do_POST(self):
+        self.reply(201, {'checkid': 'c1'})
+
+    def do_GET(self):
+        server = self.server
+        query = parse_qs(urlsplit(self.path).query)
+        hold = query.get('long_poll')
+        server.requests.append(hold)
+        headers = {}
+        if hold and server.long_poll:
+            server.reached.wait(float(hold[0]))
+            headers['X-Restpose-Long-Poll'] = hold[0]
+        self.reply(200, {'reached': server.reached.is_set(), 'errors': [],
+                         'total_errors': 0}, headers)
+
+    def reply(self, status, body, headers={}):
+        body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class LongPollTest(TestCase):
+
+    def setUp(self):
+        self.httpd = StandInServer(('127.0.0.1', 0), StandInHandler)
+        self.httpd.requests = []
+        self.httpd.reached = threading.Event()
+        self.httpd.long_poll = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        # Requests are made with the real resource, to check that the
+        # long_poll parameter and the X-Restpose-Long-Poll header get
+        # through restkit.
+        self.server = Server('http://127.0.0.1:%d' % self.httpd.server_port,
+                             checkpoint_long_poll=30)
+        self.coll = self.server.collection('c')
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reach_after(self, delay):
+        timer = threading.Timer(delay, self.httpd.reached.set)
+        timer.start()
+        return timer
+
+    def test_long_poll(self):
+        checkpoint = self.coll.checkpoint()
+        started = time.time()
+        timer = self.reach_after(0.3)
+        checkpoint.wait()
+        timer.join()
+        # A single request was held open until the checkpoint was reached.
+        self.assertTrue(0.25 < time.time() - started < 2)
+        self.assertEqual(self.httpd.requests, [['30.000']])
+        self.assertEqual(checkpoint.polls, 1)
+        self.assertEqual(self.server._long_poll_supported, True)
+
+        # The hold is cut short by the deadline.
+        self.httpd.reached.clear()
+        checkpoint = self.coll.checkpoint()
+        self.assertRaises(CheckPointTimeoutError, checkpoint.wait, 0.2)
+        self.assertEqual(checkpoint.polls, 1)
+        self.assertTrue(float(self.httpd.requests[-1][0]) <= 0.2)
+
+    def test_fallback(self):
+        self.httpd.long_poll = False
+        checkpoint = self.coll.checkpoint()
+        checkpoint.max_poll = 0.05
+        timer = self.reach_after(0.3)
+        checkpoint.wait()
+        timer.join()
+        self.assertEqual(self.server._long_poll_supported, False)
+        # Only the first request asked for long-polling.
+        requests = self.httpd.requests
+        self.assertTrue(len(requests) > 3)
+        self.assertEqual(requests[0], ['30.000'])
+        self.assertEqual(requests[1:], [None] * (len(requests) - 1))
+
+        # Long-polling is off by default.
+        server = Server('http://127.0.0.1:%d' % self.httpd.server_port)
+        server.collection('c').checkpoint().wait()
+        self.assertEqual(requests[-1], None)
+        self.assertEqual(server._long_poll_supported, None)
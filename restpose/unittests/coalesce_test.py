@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+from unittest import TestCase
+from .. import Server
+from .bulk_test import Response
+from ..coalesce import SingleFlight, CheckPointCoalescer, search_key
+from ..codec import available_codecs
+import sys
+import threading
+import time
+
+class Interrupt(BaseException):
+    """An exception which isn't an Exception, like KeyboardInterrupt.
+
+    """
+
+
+class SlowSearchResource(object):
+    """A resource which answers searches once released.
+
+    """
+    def __init__(self, uri, **client_opts):
+        self.client_opts = client_opts
+        self.searches = []
+        self.release = threading.Event()
+
+    def post(self, path, payload=None, **params):
+        self.searches.append((path, payload))
+        self.release.wait(5)
+        if payload.get('fail'):
+            raise ValueError("search failed")
+        return self
+
+    def expect_status(self, *expected):
+        return self
+
+    @property
+    def json(self):
+        return {'total_docs': 1, 'items': [{'id': ['1']}]}
+
+
+class SlowCheckPointResource(object):
+    """A resource which sets checkpoints once released.
+
+    The first checkpoint request blocks until `release` is set.
+
+    """
+    def __init__(self, uri, **client_opts):
+        self.client_opts = client_opts
+        self.lock = threading.Lock()
+        self.checkpoints = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.fail = False
+
+    def post(self, path, payload=None, params_dict=None, **params):
+        with self.lock:
+            self.checkpoints.append(params_dict['commit'])
+            checkid = 'c%d' % len(self.checkpoints)
+        self.started.set()
+        self.release.wait(5)
+        if self.fail:
+            raise ValueError("checkpoint failed")
+        return Response(201, {'checkid': checkid})
+
+
+class CoalesceTest(TestCase):
+
+    def run_searches(self, server, bodies):
+        coll = server.collection('c')
+        results = [None] * len(bodies)
+        def search(i):
+            try:
+                results[i] = coll.search(bodies[i])
+            except Exception:
+                results[i] = sys.exc_info()[1]
+        threads = [threading.Thread(target=search, args=(i,))
+                   for i in range(len(bodies))]
+        for thread in threads:
+            thread.start()
+        # Wait for every search to reach the coalescing layer.
+        deadline = time.time() + 5
+        while server.search_flight.stats.calls < len(bodies) and \
+              time.time() < deadline:
+            time.sleep(0.001)
+        server._resource.release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_identical_searches_share_request(self):
+        server = Server(resource_class=SlowSearchResource,
+                        coalesce_searches=True)
+        bodies = [{'query': {'matchall': True}, 'size': 10}] * 3 + \
+                 [{'size': 10, 'query': {'matchall': True}}] * 3
+        results = self.run_searches(server, bodies)
+        self.assertEqual(len(server._resource.searches), 1)
+        self.assertEqual(server.search_flight.stats.shared, 5)
+
+        # Every caller has its own results, and its own copy of the data.
+        self.assertEqual(len(set(id(r) for r in results)), 6)
+        results[0].items[0].data['id'] = ['changed']
+        self.assertEqual(results[1].items[0].data['id'], ['1'])
+
+    def test_different_searches(self):
+        server = Server(resource_class=SlowSearchResource,
+                        coalesce_searches=True)
+        bodies = [{'query': {'matchall': True}}, {'query': {'matchnone': True}}]
+        self.run_searches(server, bodies)
+        self.assertEqual(len(server._resource.searches), 2)
+        self.assertEqual(server.search_flight.stats.executed, 2)
+
+    def test_errors_are_shared(self):
+        server = Server(resource_class=SlowSearchResource,
+                        coalesce_searches=True)
+        results = self.run_searches(server, [{'fail': True}] * 3)
+        self.assertEqual(len(server._resource.searches), 1)
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+        self.assertEqual(server.search_flight.stats.errors, 1)
+
+        # A later call is made afresh.
+        flight = server.search_flight
+        self.assertEqual(flight.do('key', lambda: 1), (1, False))
+
+    def run_flight(self, flight, func, count):
+        """Make calls to flight.do() from several threads.
+
+        The first call is made before the others, and `func` should block
+        until they are all waiting for it.
+
+        """
+        results = [None] * count
+        def call(i):
+            try:
+                results[i] = flight.do('key', func)
+            except BaseException:
+                results[i] = sys.exc_info()[1]
+        threads = [threading.Thread(target=call, args=(i,))
+                   for i in range(count)]
+        threads[0].start()
+        while flight.stats.calls < 1:
+            time.sleep(0.001)
+        for thread in threads[1:]:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_performed_result_shared(self):
+        flight = SingleFlight()
+        result = {'items': []}
+        def func():
+            while flight.stats.calls < 3:
+                time.sleep(0.001)
+            return result
+        # The caller which performed the call is told its result is shared,
+        # so it doesn't change it while others are copying it.
+        results = self.run_flight(flight, func, 3)
+        self.assertEqual(results, [(result, True)] * 3)
+        self.assertEqual(flight.stats.shared, 2)
+
+    def test_base_exceptions_shared(self):
+        flight = SingleFlight()
+        def func():
+            while flight.stats.calls < 3:
+                time.sleep(0.001)
+            raise Interrupt()
+        results = self.run_flight(flight, func, 3)
+        self.assertTrue(all(isinstance(r, Interrupt) for r in results))
+        self.assertEqual(flight.stats.errors, 1)
+
+    def test_search_key(self):
+        uri = 'http://127.0.0.1:7777'
+        self.assertEqual(search_key(uri, '/coll/c', {'a': 1, 'b': [1, 2]}),
+                         search_key(uri, '/coll/c', {'b': [1, 2], 'a': 1}))
+        self.assertNotEqual(search_key(uri, '/coll/c', {'a': 1}),
+                            search_key(uri, '/coll/d', {'a': 1}))
+        self.assertNotEqual(search_key(uri, '/coll/c', {'a': 1}),
+                            search_key('http://127.0.0.1:7778', '/coll/c',
+                                       {'a': 1}))
+        for name in available_codecs():
+            self.assertEqual(
+                search_key(uri, '/coll/c', {'a': 1, 'b': [1, 2]}, name),
+                search_key(uri, '/coll/c', {'b': [1, 2], 'a': 1}, name))
+
+    def test_shared_between_servers(self):
+        flight = SingleFlight()
+        servers = [Server(uri, resource_class=SlowSearchResource,
+                          coalesce_searches=flight)
+                   for uri in ('http://127.0.0.1:7777',
+                               'http://127.0.0.1:7778')]
+        colls = [server.collection('c') for server in servers]
+        body = {'query': {'matchall': True}}
+        results = [None] * 4
+        def search(i):
+            results[i] = colls[i % 2].search(body)
+        threads = [threading.Thread(target=search, args=(i,))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        deadline = time.time() + 5
+        while flight.stats.calls < 4 and time.time() < deadline:
+            time.sleep(0.001)
+        for server in servers:
+            server._resource.release.set()
+        for thread in threads:
+            thread.join()
+
+        # Each server is sent the search once.
+        self.assertEqual([len(server._resource.searches)
+                          for server in servers], [1, 1])
+        self.assertEqual(flight.stats.executed, 2)
+        self.assertEqual(flight.stats.shared, 2)
+        self.assertTrue(all(r is not None for r in results))
+
+    def test_disabled_by_default(self):
+        self.assertTrue(Server(resource_class=SlowSearchResource)
+                        .search_flight is None)
+        flight = SingleFlight()
+        server = Server(resource_class=SlowSearchResource,
+                        coalesce_searches=flight)
+        self.assertTrue(server.search_flight is flight)
+
+
+class CheckPointCoalesceTest(TestCase):
+
+    def run_checkpoints(self, server, commits, release=True):
+        coll = server.collection('c')
+        results = [None] * len(commits)
+        def checkpoint(i):
+            try:
+                results[i] = coll.checkpoint(commit=commits[i])
+            except Exception:
+                results[i] = sys.exc_info()[1]
+        threads = [threading.Thread(target=checkpoint, args=(i,))
+                   for i in range(len(commits))]
+        for thread in threads:
+            thread.start()
+        deadline = time.time() + 5
+        while server.checkpoint_coalescer.stats.requested < len(commits) \
+              and time.time() < deadline:
+            time.sleep(0.001)
+        if release:
+            server._resource.release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_in_flight(self):
+        server = Server(resource_class=SlowCheckPointResource,
+                        coalesce_checkpoints=True)
+        resource = server._resource
+        coll = server.collection('c')
+        first = []
+        thread = threading.Thread(
+            target=lambda: first.append(coll.checkpoint(commit=False)))
+        thread.start()
+        resource.started.wait(5)
+
+        # Requests made while a checkpoint is being set share the next one.
+        results = self.run_checkpoints(server, [False] * 9 + [True])
+        thread.join()
+        self.assertEqual(resource.checkpoints, ['0', '1'])
+        self.assertEqual(first[0].check_id, 'c1')
+        self.assertEqual(set(r.check_id for r in results), set(['c2']))
+        self.assertTrue(all(r is results[0] for r in results))
+        stats = server.checkpoint_coalescer.stats
+        self.assertEqual((stats.requested, stats.sent, stats.commits),
+                         (11, 2, 1))
+        self.assertEqual(server.checkpoint_coalescer._keys, {})
+
+    def test_window(self):
+        server = Server(resource_class=SlowCheckPointResource,
+                        coalesce_checkpoints=0.05)
+        server._resource.release.set()
+        results = self.run_checkpoints(server, [True] * 10)
+        self.assertEqual(server._resource.checkpoints, ['1'])
+        self.assertEqual(set(r.check_id for r in results), set(['c1']))
+
+        # Different collections aren't merged.
+        server.collection('d').checkpoint()
+        self.assertEqual(len(server._resource.checkpoints), 2)
+
+    def test_errors_are_shared(self):
+        server = Server(resource_class=SlowCheckPointResource,
+                        coalesce_checkpoints=0.05)
+        server._resource.fail = True
+        results = self.run_checkpoints(server, [True] * 3)
+        self.assertEqual(len(server._resource.checkpoints), 1)
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+        self.assertEqual(server.checkpoint_coalescer.stats.errors, 1)
+
+    def test_base_exceptions_shared(self):
+        coalescer = CheckPointCoalescer(window=0.05)
+        def func(commit):
+            raise Interrupt()
+        results = [None] * 3
+        def checkpoint(i):
+            try:
+                results[i] = coalescer.checkpoint('key', func)
+            except BaseException:
+                results[i] = sys.exc_info()[1]
+        threads = [threading.Thread(target=checkpoint, args=(i,))
+                   for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(coalescer.stats.sent, 1)
+        self.assertEqual(coalescer.stats.errors, 1)
+        self.assertTrue(all(isinstance(r, Interrupt) for r in results))
+
+        # A later checkpoint is set afresh.
+        self.assertEqual(coalescer.checkpoint('key', lambda commit: 'c2'),
+                         'c2')
+
+    def test_disabled_by_default(self):
+        self.assertTrue(Server(resource_class=SlowCheckPointResource)
+                        .checkpoint_coalescer is None)
+        coalescer = CheckPointCoalescer()
+        server = Server(resource_class=SlowCheckPointResource,
+                        coalesce_checkpoints=coalescer)
+        self.assertTrue(server.checkpoint_coalescer is coalescer)
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+from unittest import TestCase
+from ..codec import available_codecs, get_codec, JsonCodec
+import six
+
+class CodecTest(TestCase):
+
+    doc = {
+        'id': '1',
+        'text': six.u('Caf\xe9 society'),
+        'tags': ['a', 'b'],
+        'num': 10,
+        'nested': {'lat': 51.5, 'lon': -0.15, 'flag': True, 'none': None},
+    }
+
+    def test_available(self):
+        names = available_codecs()
+        self.assertTrue('json' in names)
+        self.assertEqual(names[-1], 'json')
+
+    def test_roundtrip(self):
+        for name in available_codecs():
+            codec = get_codec(name)
+            self.assertEqual(codec.name, name)
+            encoded = codec.dumps(self.doc)
+            self.assertTrue(isinstance(encoded, six.binary_type))
+            self.assertEqual(codec.loads(encoded), self.doc)
+            self.assertEqual(codec.loads(encoded.decode('utf-8')), self.doc)
+
+            # Output of every codec must be readable by every other codec.
+            self.assertEqual(JsonCodec().loads(encoded), self.doc)
+            self.assertEqual(codec.loads(JsonCodec().dumps(self.doc)),
+                             self.doc)
+
+    def test_dumps_sorted(self):
+        for name in available_codecs():
+            codec = get_codec(name)
+            a = codec.dumps_sorted({'b': 1, 'a': {'d': 2, 'c': 3}})
+            b = codec.dumps_sorted({'a': {'c': 3, 'd': 2}, 'b': 1})
+            self.assertEqual(a, b)
+            self.assertTrue(isinstance(a, six.binary_type))
+            self.assertEqual(codec.loads(a), {'a': {'c': 3, 'd': 2}, 'b': 1})
+
+    def test_get_codec(self):
+        self.assertEqual(get_codec().name, available_codecs()[0])
+        self.assertTrue(get_codec() is get_codec())
+        codec = JsonCodec()
+        self.assertTrue(get_codec(codec) is codec)
+        self.assertRaises(ValueError, get_codec, 'nosuchcodec')
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+from unittest import TestCase
+from ..compression import Compression
+from .instrument_test import StubRequest, StubResponse
+import gzip
+import io
+import zlib
+
+class CompressionTest(TestCase):
+
+    body = b'{"_text":"' + b'hello world ' * 500 + b'"}'
+
+    def test_threshold(self):
+        c = Compression(threshold=len(self.body) + 1)
+        self.assertEqual(c.compress(self.body), (self.body, None))
+        self.assertEqual(c.stats.requests, 1)
+        self.assertEqual(c.stats.requests_compressed, 0)
+        self.assertEqual(c.stats.request_bytes_sent, len(self.body))
+
+    def test_gzip(self):
+        c = Compression(threshold=100)
+        compressed, encoding = c.compress(self.body)
+        self.assertEqual(encoding, 'gzip')
+        self.assertTrue(len(compressed) < len(self.body) / 10)
+        self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(compressed)).read(),
+                         self.body)
+        self.assertEqual(c.decompress(compressed, 'gzip'), self.body)
+
+        stats = c.stats
+        self.assertEqual(stats.requests_compressed, 1)
+        self.assertEqual(stats.request_bytes_raw, len(self.body))
+        self.assertEqual(stats.request_bytes_sent, len(compressed))
+        self.assertEqual(stats.responses_compressed, 1)
+        self.assertEqual(stats.response_bytes_received, len(compressed))
+        self.assertEqual(stats.response_bytes_raw, len(self.body))
+
+    def test_deflate(self):
+        c = Compression(threshold=100, method='deflate')
+        compressed, encoding = c.compress(self.body)
+        self.assertEqual(encoding, 'deflate')
+        self.assertEqual(zlib.decompress(compressed), self.body)
+        self.assertEqual(c.decompress(compressed, 'deflate'), self.body)
+
+        # Raw deflate streams are accepted too.
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        raw = compressor.compress(self.body) + compressor.flush()
+        self.assertEqual(c.decompress(raw, 'deflate'), self.body)
+
+    def test_identity(self):
+        c = Compression()
+        self.assertEqual(c.decompress(self.body, None), self.body)
+        self.assertEqual(c.stats.responses, 1)
+        self.assertEqual(c.stats.responses_compressed, 0)
+        self.assertRaises(ValueError, c.decompress, self.body, 'br')
+        self.assertRaises(ValueError, Compression, method='br')
+
+    def test_accept_encoding(self):
+        self.assertEqual(Compression().accept_encoding, 'gzip, deflate')
+        self.assertEqual(Compression(accept_compressed=False).accept_encoding,
+                         None)
+
+    def test_response_charset(self):
+        body = b'caf\xc3\xa9 \xff'
+        response = StubResponse(StubRequest('GET', '/status'), body)
+        self.assertRaises(UnicodeDecodeError, response.body_string, 'utf-8')
+        self.assertEqual(response.body_string('utf-8', 'replace'),
+                         u'caf\xe9 \ufffd')
+        self.assertEqual(response.body_string(), body)
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+from unittest import TestCase
+from .. import Server
+from ..digest import ChangeFilter, DigestStore, canonical_encode, digest
+from ..errors import BulkIndexError
+from .bulk_test import IndexingResource
+import os
+import shutil
+import tempfile
+
+class DigestStoreTest(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'digests.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_canonical(self):
+        self.assertEqual(canonical_encode({'b': [1, u'\xe9'], 'a': None}),
+                         b'{"a":null,"b":[1,"\\u00e9"]}')
+        self.assertEqual(digest(canonical_encode({'a': 1, 'b': 2})),
+                         digest(canonical_encode({'b': 2, 'a': 1})))
+
+    def test_runs(self):
+        store = DigestStore(self.path)
+        self.assertRaises(ValueError, store.compare, [])
+        store.begin_run()
+        self.assertEqual(store.compare([('t', '1', b'a'), ('t', '2', b'b')]),
+                         [True, True])
+        # Digests aren't recorded until the run is committed.
+        self.assertEqual(store.get('t', '1'), None)
+        store.commit_run()
+        self.assertEqual(store.get('t', '1'), b'a')
+        self.assertEqual(len(store), 2)
+        store.close()
+
+        store = DigestStore(self.path)
+        store.begin_run()
+        self.assertEqual(store.compare([('t', '1', b'a'), ('t', '3', b'c')]),
+                         [False, True])
+        self.assertEqual(list(store.stale()), [('t', '2')])
+        store.abort_run()
+        self.assertEqual(store.get('t', '3'), None)
+
+        store.begin_run()
+        self.assertEqual(store.compare([('t', '1', b'x'), ('u', '2', b'b')]),
+                         [True, True])
+        self.assertEqual(list(store.stale()), [('t', '2')])
+        self.assertEqual(list(store.stale('u')), [])
+        store.commit_run(remove_stale=True)
+        self.assertEqual(store.get('t', '1'), b'x')
+        self.assertEqual(store.get('t', '2'), None)
+        self.assertEqual(len(store), 2)
+        store.close()
+
+
+class ChangeFilterTest(TestCase):
+
+    def setUp(self):
+        self.server = Server(resource_class=IndexingResource)
+        self.resource = self.server._resource
+        self.coll = self.server.collection('c')
+        self.store = DigestStore(':memory:')
+
+    def sent(self):
+        result = sorted((u[0], u[1]) for u in self.resource.updates)
+        self.resource.updates = []
+        return result
+
+    def test_changes(self):
+        with ChangeFilter(self.coll, self.store, compare_batch=2) as changes:
+            for num in range(5):
+                changes.add({'num': num}, doc_type='t', doc_id=str(num))
+            changes.add({'type': 'u', 'id': 'a'})
+            self.assertRaises(ValueError, changes.add, {'num': 1})
+        self.assertEqual(len(self.sent()), 6)
+        self.assertEqual(changes.stats.as_dict(),
+                         {'seen': 6, 'changed': 6, 'unchanged': 0,
+                          'deleted': 0})
+
+        with ChangeFilter(self.coll, self.store,
+                          delete_missing=True) as changes:
+            changes.add({'num': 0}, doc_type='t', doc_id='0')
+            changes.add({'num': 10}, doc_type='t', doc_id='1')
+            changes.add({'num': 2}, doc_type='t', doc_id='2')
+        self.assertEqual(self.sent(), [('DELETE', '/coll/c/type/t/id/3'),
+                                       ('DELETE', '/coll/c/type/t/id/4'),
+                                       ('DELETE', '/coll/c/type/u/id/a'),
+                                       ('PUT', '/coll/c/type/t/id/1')])
+        self.assertEqual(changes.stats.as_dict(),
+                         {'seen': 3, 'changed': 1, 'unchanged': 2,
+                          'deleted': 3})
+        self.assertEqual(len(self.store), 3)
+
+    def test_doc_type(self):
+        with ChangeFilter(self.coll, self.store) as changes:
+            changes.add({'a': 1}, doc_type='other', doc_id='1')
+        doc_type = self.coll.doc_type('t')
+        with ChangeFilter(doc_type, self.store) as changes:
+            changes.add({'a': 1}, doc_id='1')
+        with ChangeFilter(doc_type, self.store,
+                          delete_missing=True) as changes:
+            pass
+        # Only documents of the target type are deleted.
+        self.assertEqual(self.sent(), [('DELETE', '/coll/c/type/t/id/1'),
+                                       ('PUT', '/coll/c/type/other/id/1'),
+                                       ('PUT', '/coll/c/type/t/id/1')])
+        self.assertEqual(self.store.get('t', '1'), None)
+        self.assertTrue(self.store.get('other', '1') is not None)
+
+    def test_failure(self):
+        changes = ChangeFilter(self.coll, self.store)
+        changes.add({'text': 'bad'}, doc_type='t', doc_id='1')
+        changes.add({'text': 'good'}, doc_type='t', doc_id='2')
+        self.assertRaises(BulkIndexError, changes.close)
+        # Nothing is recorded, so both documents are sent again next time.
+        self.assertEqual(len(self.store), 0)
+        self.assertEqual(self.store.run, None)
+
+        try:
+            with ChangeFilter(self.coll, self.store) as changes:
+                changes.add({'text': 'good'}, doc_type='t', doc_id='2')
+                raise KeyError()
+        except KeyError:
+            pass
+        self.assertEqual(len(self.store), 0)
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+from unittest import TestCase
+from .. import Server
+from ..hedge import HedgePolicy
+from concurrent import futures
+import threading
+import time
+
+class SlowFirst(object):
+    """A callable whose first call is slow, and later calls are fast.
+
+    """
+    def __init__(self, slow=0.5, fail_first=False):
+        self.slow = slow
+        self.fail_first = fail_first
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            self.calls += 1
+            call = self.calls
+        if call == 1:
+            time.sleep(self.slow)
+            if self.fail_first:
+                raise ValueError("first failed")
+            return 'first'
+        return 'second'
+
+
+class LateFuture(futures.Future):
+    """A future whose call runs when its result is first asked for, just as
+    any wait for it times out.
+
+    """
+    def __init__(self, func):
+        super(LateFuture, self).__init__()
+        self.func = func
+
+    def result(self, timeout=None):
+        if not self.done():
+            self.set_running_or_notify_cancel()
+            self.set_result(self.func())
+            if timeout is not None:
+                raise futures.TimeoutError()
+        return super(LateFuture, self).result()
+
+
+class HedgeTest(TestCase):
+
+    def setUp(self):
+        self.policies = []
+
+    def tearDown(self):
+        for policy in self.policies:
+            policy.close()
+
+    def make(self, **kwargs):
+        policy = HedgePolicy(**kwargs)
+        self.policies.append(policy)
+        return policy
+
+    def test_fast_requests_not_hedged(self):
+        policy = self.make(delay=1)
+        self.assertEqual(policy.call(lambda: 'result'), 'result')
+        self.assertEqual(policy.stats.requests, 1)
+        self.assertEqual(policy.stats.hedged, 0)
+
+    def test_hedge_wins(self):
+        policy = self.make(delay=0.01, budget=1)
+        func = SlowFirst()
+        start = time.time()
+        self.assertEqual(policy.call(func), 'second')
+        self.assertTrue(time.time() - start < 0.4)
+        self.assertEqual(func.calls, 2)
+        stats = policy.stats
+        self.assertEqual((stats.hedged, stats.hedge_wins), (1, 1))
+        self.assertEqual(stats.hedge_rate, 1.0)
+
+    def test_failed_first_request(self):
+        policy = self.make(delay=0.01, budget=1)
+        self.assertEqual(policy.call(SlowFirst(0.05, fail_first=True)),
+                         'second')
+
+        def fail():
+            raise ValueError("failed")
+        self.assertRaises(ValueError, policy.call, fail)
+
+    def test_finish_at_delay(self):
+        policy = self.make(delay=0.01, budget=0)
+        policy._submit = lambda func: LateFuture(func)
+        # A request finishing just as the delay expires returns its result.
+        self.assertEqual(policy.call(lambda: 'ok'), 'ok')
+        self.assertEqual(policy.stats.hedged, 0)
+
+    def test_budget(self):
+        policy = self.make(delay=0.01, budget=0.5)
+        # With one request made, hedging it would exceed the budget.
+        self.assertEqual(policy.call(SlowFirst(0.05)), 'first')
+        self.assertEqual(policy.stats.budget_exhausted, 1)
+        self.assertEqual(policy.call(SlowFirst(0.05)), 'second')
+        self.assertEqual(policy.stats.hedged, 1)
+
+    def test_concurrent_callers_not_serialized(self):
+        policy = self.make(delay=1, budget=1, max_workers=1)
+        # More callers than threads: the requests still run at once, rather
+        # than one after another, with those which find no free thread run
+        # by their callers.
+        results = []
+        def call():
+            results.append(policy.call(lambda: time.sleep(0.1) or 'ok'))
+        threads = [threading.Thread(target=call) for _ in range(8)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(time.time() - start < 0.4)
+        self.assertEqual(results, ['ok'] * 8)
+        self.assertEqual(policy.stats.hedged, 0)
+        self.assertTrue(policy.stats.overflowed > 0)
+        self.assertEqual(len(policy._executor._threads), 1)
+
+    def test_hedge_not_queued(self):
+        policy = self.make(delay=0.02, budget=1, max_workers=2)
+        start = time.time()
+        # The duplicate request doesn't wait behind the slow first call.
+        self.assertEqual(policy.call(SlowFirst(slow=0.3)), 'second')
+        self.assertTrue(time.time() - start < 0.25)
+
+        # With no thread free for it, no duplicate is sent.
+        policy = self.make(delay=0.02, budget=1, max_workers=1)
+        self.assertEqual(policy.call(SlowFirst(slow=0.1)), 'first')
+        self.assertEqual(policy.stats.hedged, 0)
+        self.assertEqual(policy.stats.overflowed, 1)
+
+    def test_percentile_delay(self):
+        policy = self.make(percentile=90, min_samples=10, min_delay=0.001,
+                           max_delay=2)
+        self.assertEqual(policy.current_delay(), 2)
+        for n in range(1, 11):
+            policy.record(n * 0.01)
+        self.assertAlmostEqual(policy.current_delay(), 0.1)
+        policy.record(0.0)
+        self.assertAlmostEqual(policy.current_delay(), 0.1)
+
+    def test_server_option(self):
+        policy = self.make()
+        server = Server(hedge=policy)
+        self.assertTrue(server.hedge is policy)
+        doc = server.collection('c').doc_type('t').get_doc('1')
+        self.assertTrue(doc._hedge is policy)
+        self.assertTrue(Server().hedge is None)
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+from unittest import TestCase
+from .. import Server
+from ..errors import BulkIndexError
+from ..importer import Importer, RecordMapper, read_chunks, guess_format
+from ..journal import ImportJournal
+from .bulk_test import IndexingResource, Response
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+
+CSV_DATA = b'''ID,name,lat,labels
+1,Zoo,51.5,"animals, family"
+2,"The ""Old""
+Theatre",51.4,
+,No ID,1.0,
+
+3,Tower,bad,history
+'''
+
+class TracingResource(IndexingResource):
+    """A resource whose checkpoints report an error for each document sent
+    since the previous checkpoint whose body contains "oops".
+
+    """
+    def __init__(self, uri, **client_opts):
+        super(TracingResource, self).__init__(uri, **client_opts)
+        self.pending_errors = []
+        self.check_errors = {}
+
+    def request(self, method, path=None, payload=None, headers=None,
+                **params):
+        if method == 'POST' and path.endswith('/checkpoint'):
+            with self.lock:
+                self.checkpoints.append((path, params))
+                checkid = 'c%d' % len(self.checkpoints)
+                self.check_errors[checkid] = self.pending_errors
+                self.pending_errors = []
+            return Response(201, {'checkid': checkid})
+        if '/checkpoint/' in path:
+            errors = self.check_errors[path.rsplit('/', 1)[1]]
+            return Response(200, {'reached': True, 'errors': errors,
+                                  'total_errors': len(errors)})
+        if payload is not None and b'oops' in bytes(payload):
+            parts = path.split('/')
+            with self.lock:
+                self.pending_errors.append({'msg': 'oops',
+                                            'doc_type': parts[4],
+                                            'doc_id': parts[6]})
+        return super(TracingResource, self).request(
+            method, path, payload, headers, **params)
+
+
+class ImporterTest(TestCase):
+
+    def setUp(self):
+        self.server = Server(resource_class=IndexingResource)
+        self.resource = self.server._resource
+        self.coll = self.server.collection('c')
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, data):
+        path = os.path.join(self.tmpdir, name)
+        if name.endswith('.gz'):
+            fd = gzip.open(path, 'wb')
+        else:
+            fd = open(path, 'wb')
+        fd.write(data)
+        fd.close()
+        return path
+
+    def docs(self):
+        return sorted((u[1], json.loads(u[2].decode('utf-8')))
+                      for u in self.resource.updates)
+
+    def test_mapper(self):
+        mapper = RecordMapper.from_spec({
+            'type': 'place', 'id': 'ID',
+            'fields': {'name_text': 'name',
+                       'lat': {'column': 'lat', 'convert': 'float'},
+                       'label_tag': {'column': 'labels', 'split': ','}},
+        })
+        self.assertEqual(mapper({'ID': '1', 'name': 'Zoo', 'lat': '51.5',
+                                 'labels': 'a, b,', 'other': 'x'}),
+                         ('place', '1', {'name_text': 'Zoo', 'lat': 51.5,
+                                         'label_tag': ['a', 'b']}))
+        self.assertEqual(mapper({'ID': 2, 'lat': ''}), ('place', '2', {}))
+        self.assertRaises(ValueError, mapper, {'name': 'No ID'})
+        self.assertRaises(ValueError, mapper, {'ID': '1', 'lat': 'x'})
+        self.assertRaises(ValueError, mapper, ['not', 'an', 'object'])
+        self.assertRaises(ValueError, RecordMapper.from_spec, {'typo': 1})
+        self.assertRaises(ValueError, RecordMapper,
+                          {'a': {'convert': 'complex'}})
+
+        mapper = RecordMapper({'num': {'convert': 'int'}}, type_column='t',
+                              keep_unmapped=True)
+        self.assertEqual(mapper({'t': 'a', 'num': '3', 'x': 'y', 'e': ''}),
+                         ('a', None, {'t': 'a', 'num': 3, 'x': 'y'}))
+
+    def test_read_chunks(self):
+        stream = io.BytesIO(b'a,"b\n\nc"\n\nd\ne\n')
+        self.assertEqual(list(read_chunks(stream, 'csv', 2)),
+                         [([1, 5], [b'a,"b\n\nc"\n', b'd\n'], (6, 12)),
+                          ([6], [b'e\n'], (7, 14))])
+        stream = io.BytesIO(b'{}\n\n{}\n\n')
+        self.assertEqual(list(read_chunks(stream, 'jsonl', 5, 10, 100)),
+                         [([10, 12], [b'{}\n', b'{}\n'], (14, 108))])
+        stream = io.BytesIO(b'a,"b\nc"\nd\ne\n')
+        self.assertEqual(list(read_chunks(stream, 'csv', 5, last_offset=3)),
+                         [([1], [b'a,"b\nc"\n'], (3, 8))])
+        self.assertEqual(guess_format('a.tsv.gz'), ('csv', '\t'))
+        self.assertEqual(guess_format('a.ndjson'), ('jsonl', None))
+        self.assertEqual(guess_format('a.txt'), (None, None))
+
+    def check_csv(self, processes):
+        path = self.write('places.csv.gz', CSV_DATA)
+        mapper = RecordMapper({'name_text': 'name',
+                               'lat': {'convert': 'float'}},
+                              id_column='ID', doc_type='place')
+        importer = Importer(self.coll, mapper=mapper, processes=processes,
+                            chunk_size=2, checkpoint=False)
+        importer.import_file(path)
+        importer.close()
+        self.assertEqual(self.docs(), [
+            ('/coll/c/type/place/id/1', {'name_text': 'Zoo', 'lat': 51.5}),
+            ('/coll/c/type/place/id/2',
+             {'name_text': 'The "Old"\nTheatre', 'lat': 51.4}),
+        ])
+        self.assertEqual(importer.stats.as_dict(),
+                         {'files': 1, 'records': 4, 'skipped': 2,
+                          'resumed': 0})
+        self.assertEqual([error[:2] for error in importer.errors],
+                         [(path, 5), (path, 7)])
+        self.assertTrue(importer.docs_per_sec > 0)
+
+    def test_csv_inline(self):
+        self.check_csv(0)
+
+    def test_csv_processes(self):
+        self.check_csv(2)
+
+    def test_jsonl(self):
+        path = self.write('docs.data', b'{"type": "t", "id": "1"}\n'
+                          b'{"type": "t", "id": "2", "x": "\\u00e9"}\n'
+                          b'not json\n')
+        reports = []
+        importer = Importer(self.coll, processes=0, report=reports.append,
+                            report_interval=0)
+        self.assertRaises(ValueError, importer.import_file, path)
+        importer.import_file(path, fmt='jsonl')
+        importer.close()
+        docs = [json.loads(u[2].decode('utf-8'))
+                for u in self.resource.updates]
+        self.assertEqual(sorted(docs, key=lambda doc: doc['id']),
+                         [{'type': 't', 'id': '1'},
+                          {'type': 't', 'id': '2', 'x': u'\xe9'}])
+        self.assertEqual(importer.errors[0][1], 3)
+        self.assertEqual(reports, [importer])
+        self.assertEqual(len(self.resource.checkpoints), 1)
+
+    def test_trace_errors(self):
+        server = Server(resource_class=TracingResource)
+        resource = server._resource
+        records = []
+        for num in range(40):
+            doc = {'num': num}
+            if num in (7, 31):
+                doc['text'] = 'oops'
+            elif num == 20:
+                doc['text'] = 'bad'
+            records.append(json.dumps(doc).encode('utf-8') + b'\n')
+        path = self.write('docs.jsonl', b''.join(records))
+
+        importer = Importer(server.collection('c'),
+                            mapper=RecordMapper(id_column='num',
+                                                doc_type='t'),
+                            processes=0, chunk_size=5, checkpoint_every=10,
+                            poll_interval=0, workers=1, batch_size=1)
+        importer.import_file(path)
+        self.assertRaises(BulkIndexError, importer.close)
+        # Checkpoints without a journal don't commit.
+        self.assertEqual(resource.checkpoints[0][1],
+                         {'params_dict': {'wait': 'process', 'commit': '0'}})
+        self.assertTrue(len(resource.checkpoints) > 2, resource.checkpoints)
+        self.assertEqual(importer.checkpoint_total_errors, 2)
+        self.assertEqual(sorted(error[:2] for error in importer.record_errors),
+                         [(path, 8), (path, 21), (path, 32)])
+
+        # Re-importing the failed ranges retries just the failed records and
+        # their neighbours.
+        ranges = importer.failed_ranges
+        for line_number in (8, 21, 32):
+            self.assertTrue(any(start[0] <= line_number < end[0]
+                                for _, start, end in ranges))
+        self.assertEqual(len(resource.updates), 39)
+        resource.updates = []
+        importer = Importer(server.collection('c'),
+                            mapper=RecordMapper(id_column='num',
+                                                doc_type='t'),
+                            processes=0, checkpoint=False)
+        for range_path, start, end in ranges:
+            importer.import_file(range_path, start=start, end=end)
+        self.assertRaises(BulkIndexError, importer.close)
+        sent = sorted(int(u[1].rsplit('/', 1)[1]) for u in resource.updates)
+        self.assertTrue(7 in sent and 31 in sent)
+        self.assertTrue(len(sent) < 30)
+
+        # Errors which don't name a document can't be traced to a record,
+        # and nothing can be traced without intermediate checkpoints.
+        resource.pending_errors = [{'msg': 'unknown'}]
+        importer = Importer(server.collection('c'),
+                            mapper=RecordMapper(id_column='num',
+                                                doc_type='t'),
+                            processes=0, checkpoint_every=0)
+        importer.import_file(path)
+        self.assertRaises(BulkIndexError, importer.close)
+        self.assertEqual(sorted(importer.record_errors),
+                         [(None, None, 'oops'), (None, None, 'oops'),
+                          (None, None, 'unknown')])
+        self.assertEqual(importer.failed_ranges, [])
+
+    def test_journal_final_checkpoint_only(self):
+        records = [json.dumps({'num': num}).encode('utf-8') + b'\n'
+                   for num in range(20)]
+        path = self.write('docs.jsonl', b''.join(records))
+        journal_path = os.path.join(self.tmpdir, 'import.journal')
+
+        def run_import():
+            journal = ImportJournal(journal_path)
+            importer = Importer(self.coll, journal=journal,
+                                mapper=RecordMapper(id_column='num',
+                                                    doc_type='t'),
+                                processes=0, chunk_size=3,
+                                checkpoint_every=0)
+            importer.import_file(path)
+            importer.close()
+            journal.close()
+            return importer
+
+        run_import()
+        self.assertEqual(len(self.resource.updates), 20)
+        self.assertEqual(len(self.resource.checkpoints), 1)
+        # Only the final position is journaled.
+        with open(journal_path, 'rb') as fd:
+            entries = [json.loads(line.decode('utf-8')) for line in fd]
+        self.assertEqual([(entry['line'], entry['done'])
+                          for entry in entries], [(21, True)])
+
+        # A finished file is skipped when the import is run again.
+        self.resource.updates = []
+        importer = run_import()
+        self.assertEqual(self.resource.updates, [])
+        self.assertEqual(importer.stats.resumed, 1)
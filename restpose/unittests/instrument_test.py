@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+from unittest import TestCase
+from ..instrument import Instrumentation, TimingClient, path_template
+from ..resource import RestPoseResponse
+import restkit
+from restkit.client import Client
+import time
+
+class StubRequest(object):
+    def __init__(self, method, path, body=b''):
+        self.method = method
+        self.parsed_url = StubParsedUrl(path)
+        self.path = path
+        self.body = body
+        self.headers = StubHeaders({'content-length': str(len(body))})
+
+
+class StubHeaders(dict):
+    def iget(self, key):
+        return self.get(key.lower())
+
+
+class StubParsedUrl(object):
+    def __init__(self, path):
+        self.path = path
+
+
+class StubClientBase(Client):
+    """Stands in for the network parts of a restkit client.
+
+    """
+    def __init__(self):
+        pass
+
+    def perform(self, request):
+        conn = self.get_connection(request)
+        return self.get_response(request, conn)
+
+    def get_connection(self, request):
+        time.sleep(0.01)
+        return 'connection'
+
+    def get_response(self, request, connection):
+        time.sleep(0.02)
+        if request.path.endswith('/broken'):
+            raise restkit.RequestError("connection reset")
+        return StubResponse(request, b'{"ok":1}')
+
+
+class StubTimingClient(TimingClient, StubClientBase):
+    pass
+
+
+class StubResponseBase(restkit.Response):
+    def __init__(self, request, body):
+        self.request = request
+        self.status_int = 200
+        self.headers = {'Content-Type': 'application/json'}
+        self._stub_body = body
+
+    def body_string(self, charset=None, unicode_errors="strict"):
+        return self._stub_body
+
+
+class StubResponse(RestPoseResponse, StubResponseBase):
+    pass
+
+
+class InstrumentTest(TestCase):
+
+    def test_path_template(self):
+        self.assertEqual(path_template('/status'), '/status')
+        self.assertEqual(path_template('/coll'), '/coll')
+        self.assertEqual(path_template('/coll/test/type/blurb/id/1?wait=1'),
+                         '/coll/{coll}/type/{type}/id/{id}')
+        self.assertEqual(path_template('/coll/test/search'),
+                         '/coll/{coll}/search')
+        self.assertEqual(path_template('/coll/c/checkpoint/abc'),
+                         '/coll/{coll}/checkpoint/{checkid}')
+        self.assertEqual(path_template('/coll/c/taxonomy/t/id/a/parent/b'),
+                         '/coll/{coll}/taxonomy/{taxonomy}/id/{id}'
+                         '/parent/{parent}')
+        # A collection called "type" is still a collection.
+        self.assertEqual(path_template('/coll/type/type/id/id/1'),
+                         '/coll/{coll}/type/{type}/id/{id}')
+
+    def test_hooks(self):
+        timings = []
+        instrument = Instrumentation()
+        client = StubTimingClient()
+        client.instrument = instrument
+
+        # Nothing is recorded until a hook is added.
+        request = StubRequest('GET', '/status')
+        client.perform(request).json
+        self.assertFalse(hasattr(request, 'restpose_timing'))
+
+        instrument.add_hook(timings.append)
+        request = StubRequest('POST', '/coll/c/search', b'{}')
+        self.assertEqual(client.perform(request).json, {'ok': 1})
+        self.assertEqual(len(timings), 1)
+        timing = timings[0]
+        self.assertEqual(timing.method, 'POST')
+        self.assertEqual(timing.path_template, '/coll/{coll}/search')
+        self.assertEqual(timing.status, 200)
+        self.assertEqual(timing.request_bytes, 2)
+        self.assertEqual(timing.response_bytes, 8)
+        self.assertTrue(timing.connect_time >= 0.009)
+        self.assertTrue(timing.ttfb >= 0.019)
+        self.assertTrue(timing.read_time is not None)
+        self.assertTrue(timing.decode_time is not None)
+        self.assertTrue(timing.total_time >= 0.029)
+
+        # Reading the body without decoding it also reports the timing.
+        client.perform(StubRequest('GET', '/status')).body_string()
+        self.assertEqual(len(timings), 2)
+        self.assertTrue(timings[1].decode_time is None)
+
+        self.assertRaises(restkit.RequestError, client.perform,
+                          StubRequest('GET', '/broken'))
+        self.assertEqual(len(timings), 3)
+        self.assertTrue(isinstance(timings[2].error, restkit.RequestError))
+        self.assertTrue(timings[2].status is None)
+
+        instrument.remove_hook(timings.append)
+        client.perform(StubRequest('GET', '/status')).json
+        self.assertEqual(len(timings), 3)
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+from unittest import TestCase
+from .. import Server
+from ..errors import BulkIndexError
+from ..importer import Importer, RecordMapper
+from ..journal import ImportJournal
+from .bulk_test import IndexingResource
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+class SlowMapper(RecordMapper):
+    """A mapper which gives the indexer time to send each document."""
+    def __call__(self, record):
+        time.sleep(0.005)
+        return super(SlowMapper, self).__call__(record)
+
+
+class ImportJournalTest(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'import.journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_journal(self):
+        journal = ImportJournal(self.path)
+        self.assertEqual(journal.position('a'), None)
+        journal.record('a', 10, 100, checkid='c1', size=5, mtime=1.5)
+        journal.record('b', 3, 30)
+        journal.record('a', 20, 200, checkid='c2', done=True)
+        journal.close()
+
+        # A partly written entry is ignored.
+        with open(self.path, 'ab') as fd:
+            fd.write(b'{"source": "b", "li')
+
+        journal = ImportJournal(self.path)
+        self.assertEqual(journal.sources(), ['a', 'b'])
+        entry = journal.position('a')
+        self.assertEqual((entry['line'], entry['offset'], entry['checkid'],
+                          entry['done']), (20, 200, 'c2', True))
+        self.assertEqual(journal.position('b')['line'], 3)
+
+        journal.reset('a')
+        journal.record('b', 4, 40)
+        journal.close()
+        with open(self.path, 'rb') as fd:
+            self.assertEqual(len(fd.readlines()), 2)
+        journal = ImportJournal(self.path)
+        self.assertEqual(journal.sources(), ['b'])
+        self.assertEqual(journal.position('b')['offset'], 40)
+        journal.close()
+
+
+class ResumeTest(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.server = Server(resource_class=IndexingResource)
+        self.resource = self.server._resource
+        self.coll = self.server.collection('c')
+        self.data = os.path.join(self.tmpdir, 'docs.jsonl')
+        with open(self.data, 'wb') as fd:
+            for num in range(20):
+                fd.write(json.dumps({'num': num}).encode('utf-8') + b'\n')
+        self.journal_path = os.path.join(self.tmpdir, 'import.journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def run_import(self, mapper=None, **kwargs):
+        journal = ImportJournal(self.journal_path)
+        importer = Importer(self.coll, processes=0, journal=journal,
+                            mapper=mapper or RecordMapper(id_column='num',
+                                                          doc_type='t'),
+                            **kwargs)
+        importer.import_file(self.data)
+        importer.close()
+        journal.close()
+        return importer
+
+    def sent(self):
+        result = sorted(int(u[1].rsplit('/', 1)[1])
+                        for u in self.resource.updates)
+        self.resource.updates = []
+        return result
+
+    def test_checkpoints(self):
+        importer = self.run_import(SlowMapper(id_column='num', doc_type='t'),
+                                   chunk_size=2, checkpoint_every=5,
+                                   poll_interval=0, workers=1, batch_size=1)
+        self.assertEqual(self.sent(), list(range(20)))
+        # Several checkpoints were set while importing, before the final one.
+        self.assertTrue(len(self.resource.checkpoints) > 2)
+        self.assertEqual(self.resource.checkpoints[0][1],
+                         {'params_dict': {'wait': 'process', 'commit': '1'}})
+        with open(self.journal_path, 'rb') as fd:
+            entries = [json.loads(line.decode('utf-8')) for line in fd]
+        self.assertTrue(len(entries) > 2)
+        self.assertTrue(all(entry['checkid'] == 'c1' for entry in entries))
+        lines = [entry['line'] for entry in entries]
+        self.assertEqual(lines, sorted(lines))
+        self.assertEqual(entries[-1]['line'], 21)
+        self.assertEqual(entries[-1]['done'], True)
+
+        # A finished file is skipped when the import is run again.
+        importer = self.run_import()
+        self.assertEqual(self.sent(), [])
+        self.assertEqual(importer.stats.resumed, 1)
+
+    def test_resume(self):
+        info = os.stat(self.data)
+        journal = ImportJournal(self.journal_path)
+        journal.record(self.data, 16, len(b''.join(
+            json.dumps({'num': num}).encode('utf-8') + b'\n'
+            for num in range(15))), size=info.st_size, mtime=info.st_mtime)
+        journal.close()
+
+        self.run_import()
+        self.assertEqual(self.sent(), list(range(15, 20)))
+        self.assertTrue(ImportJournal(self.journal_path)
+                        .position(self.data)['done'])
+
+        # If the file changes, the journal can't be used, and the import is
+        # aborted, leaving no threads running.
+        with open(self.data, 'ab') as fd:
+            fd.write(b'{"num": 20}\n')
+        threads = set(threading.enumerate())
+        self.assertRaises(ValueError, self.run_import)
+        self.assertEqual(set(threading.enumerate()) - threads, set())
+
+    def test_failures(self):
+        with open(self.data, 'ab') as fd:
+            fd.write(b'{"num": 20, "text": "bad"}\n')
+        self.assertRaises(BulkIndexError, self.run_import)
+        # Nothing is recorded after a request fails.
+        self.assertEqual(ImportJournal(self.journal_path).position(self.data),
+                         None)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+from unittest import TestCase
+from .. import Server
+from ..monitor import LagMonitor
+from ..watcher import CheckPointWatcher
+from .watcher_test import CheckingResource
+import time
+
+class LagMonitorTest(TestCase):
+
+    def setUp(self):
+        self.server = Server(resource_class=CheckingResource)
+        self.resource = self.server._resource
+        self.reports = []
+        self.watcher = CheckPointWatcher(min_poll=0.001, max_poll=0.002)
+
+    def tearDown(self):
+        self.watcher.close()
+
+    def sample(self, monitor):
+        return [future.result(5) for future in monitor.sample()]
+
+    def test_sample(self):
+        colls = [self.server.collection('a'), self.server.collection('b')]
+        monitor = LagMonitor(colls, callback=self.reports.append,
+                             percentiles=(50, 90), threshold=0.5,
+                             watcher=self.watcher)
+        # Checkpoint "c<n>" is reached on its n'th poll, so each collection
+        # lags a little more each time.
+        for _ in range(5):
+            self.sample(monitor)
+        self.assertEqual(len(self.reports), 10)
+        self.assertEqual(self.resource.polls['c10'], 10)
+        self.assertEqual(sorted(set(r.collection for r in self.reports)),
+                         ['a', 'b'])
+        last = self.reports[-1]
+        self.assertEqual(last.samples, 5)
+        self.assertEqual(sorted(last.percentiles), [50, 90, 95])
+        # With 5 samples, the 90th percentile is the largest lag.
+        self.assertTrue(last.lag <= last.percentiles[90])
+        self.assertTrue(last.percentiles[50] <= last.percentiles[90])
+        self.assertFalse(any(r.alerting or r.timed_out
+                             for r in self.reports))
+        self.assertEqual(monitor.stats.samples, 10)
+
+    def test_alerts(self):
+        coll = self.server.collection('a')
+        monitor = LagMonitor([coll], callback=self.reports.append,
+                             window=2, threshold=0.05, timeout=0.1,
+                             watcher=self.watcher)
+        self.resource.stuck.add('c1')
+        report, = self.sample(monitor)
+        self.assertTrue(report.timed_out)
+        self.assertTrue(report.lag >= 0.1)
+        self.assertTrue(report.alerting and report.alert_changed)
+
+        # The alert is cleared once the slow measurement leaves the window.
+        reports = self.sample(monitor) + self.sample(monitor)
+        self.assertEqual([(r.alerting, r.alert_changed) for r in reports],
+                         [(True, False), (False, True)])
+        self.assertEqual((monitor.stats.alerts, monitor.stats.timeouts),
+                         (1, 1))
+
+        # Collections whose checkpoints expire aren't reported.
+        self.resource.expired.add('c4')
+        self.assertEqual(self.sample(monitor), [None])
+        self.assertEqual(monitor.stats.errors, 1)
+
+    def test_background(self):
+        monitor = LagMonitor([self.server.collection('a')], interval=0.01,
+                             callback=self.reports.append)
+        with monitor:
+            deadline = time.time() + 5
+            while len(self.reports) < 3 and time.time() < deadline:
+                time.sleep(0.01)
+        self.assertTrue(len(self.reports) >= 3)
+        self.assertRaises(ValueError, monitor.start)
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+from unittest import TestCase
+from .. import Server
+from ..pool import RestPosePool, UnixConnection
+import functools
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+
+class FakeConnection(object):
+    """A stand-in for a connection, which doesn't open a socket.
+
+    """
+    def __init__(self, host, port, pool=None, **options):
+        self.host = host
+        self.port = port
+        self.connected = True
+        self.life = time.time()
+
+    def matches(self, **options):
+        return options.get('host') == self.host and \
+               options.get('port') == self.port
+
+    def is_connected(self):
+        return self.connected
+
+    def get_lifetime(self):
+        return self.life
+
+    def invalidate(self):
+        self.connected = False
+
+
+class PoolTest(TestCase):
+
+    def make_pool(self, **kwargs):
+        return RestPosePool(factory=FakeConnection, reap_connections=False,
+                            **kwargs)
+
+    def test_reuse(self):
+        pool = self.make_pool(max_idle=2)
+        c1 = pool.get(host='h', port=1)
+        c2 = pool.get(host='h', port=1)
+        self.assertTrue(c1 is not c2)
+        stats = pool.stats
+        self.assertEqual(stats.created, 2)
+        self.assertEqual(stats.checked_out, 2)
+        self.assertEqual(stats.idle, 0)
+
+        pool.release_connection(c1)
+        self.assertEqual(pool.stats.idle, 1)
+        self.assertTrue(pool.get(host='h', port=1) is c1)
+        stats = pool.stats
+        self.assertEqual(stats.created, 2)
+        self.assertEqual(stats.reused, 1)
+        self.assertEqual(stats.peak_checked_out, 2)
+
+    def test_overflow(self):
+        pool = self.make_pool(max_idle=1)
+        conns = [pool.get(host='h', port=1) for _ in range(3)]
+        for conn in conns:
+            pool.release_connection(conn)
+        stats = pool.stats
+        self.assertEqual(stats.idle, 1)
+        self.assertEqual(stats.checked_out, 0)
+        self.assertEqual(stats.overflowed, 2)
+        self.assertEqual(stats.discarded, 2)
+        self.assertEqual(len([c for c in conns if c.connected]), 1)
+
+    def test_idle_timeout(self):
+        pool = self.make_pool(max_idle=2, idle_timeout=0.01)
+        c1 = pool.get(host='h', port=1)
+        pool.release_connection(c1)
+        time.sleep(0.02)
+        c2 = pool.get(host='h', port=1)
+        self.assertTrue(c2 is not c1)
+        self.assertFalse(c1.connected)
+        self.assertEqual(pool.stats.discarded, 1)
+
+    def test_prewarm(self):
+        pool = self.make_pool(max_idle=3)
+        pool.prewarm('h', 1, 5)
+        stats = pool.stats
+        self.assertEqual(stats.created, 3)
+        self.assertEqual(stats.idle, 3)
+        pool.get(host='h', port=1)
+        self.assertEqual(pool.stats.created, 3)
+
+    def test_prewarm_hosts(self):
+        pool = self.make_pool(max_idle=5)
+        pool.prewarm('h1', 1, 2)
+        pool.prewarm('h2', 1, 2)
+        self.assertEqual(pool.stats.idle, 4)
+        # Connections already open to a host count towards its number.
+        pool.prewarm('h1', 1, 2)
+        self.assertEqual(pool.stats.created, 4)
+        # The pool still holds no more than max_idle.
+        pool.prewarm('h3', 1, 2)
+        self.assertEqual(pool.stats.idle, 5)
+        for host in ('h1', 'h1', 'h2', 'h2', 'h3'):
+            pool.get(host=host, port=1)
+        self.assertEqual(pool.stats.created, 5)
+        self.assertEqual(pool.stats.checked_out, 5)
+
+    def test_max_per_host(self):
+        pool = self.make_pool(max_idle=2, max_per_host=1)
+        c1 = pool.get(host='h', port=1)
+        # Other hosts have limits of their own.
+        c2 = pool.get(host='h2', port=1)
+        got = []
+        thread = threading.Thread(
+            target=lambda: got.append(pool.get(host='h', port=1)))
+        thread.start()
+        thread.join(0.05)
+        self.assertEqual(got, [])
+        pool.release_connection(c1)
+        thread.join(5)
+        self.assertEqual(got, [c1])
+
+        # A connection which is closed without being released frees its
+        # place.
+        c1.invalidate()
+        self.assertTrue(pool.get(host='h', port=1) is not c1)
+        self.assertEqual(pool.stats.checked_out, 2)
+        pool.release_connection(c2)
+
+
+class PrewarmServerTest(TestCase):
+
+    def setUp(self):
+        self.listeners = []
+        for _ in range(2):
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.bind(('127.0.0.1', 0))
+            listener.listen(5)
+            self.listeners.append(listener)
+
+    def tearDown(self):
+        for listener in self.listeners:
+            listener.close()
+
+    def test_replicas(self):
+        uris = ['http://127.0.0.1:%d' % listener.getsockname()[1]
+                for listener in self.listeners]
+        server = Server(uris, max_idle=3, prewarm=2)
+        pool = server._resource.client_opts['pool']
+        self.assertEqual(pool.max_idle, 6)
+        self.assertEqual(pool.stats.idle, 4)
+        for listener in self.listeners:
+            listener.settimeout(5)
+            accepted = [listener.accept()[0] for _ in range(2)]
+            for conn in accepted:
+                conn.close()
+        pool.release_all()
+
+
+class UnixConnectionTest(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'restpose.sock')
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.path)
+        self.listener.listen(5)
+
+    def tearDown(self):
+        self.listener.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_connect(self):
+        pool = RestPosePool(factory=functools.partial(UnixConnection,
+                                                      socket_path=self.path),
+                            reap_connections=False)
+        conn = pool.get(host='localhost', port=80)
+        accepted = self.listener.accept()[0]
+        conn.send(b'ping')
+        self.assertEqual(accepted.recv(4), b'ping')
+        accepted.sendall(b'pong')
+        self.assertEqual(conn.recv(4), b'pong')
+        self.assertTrue(conn.is_connected())
+
+        pool.release_connection(conn)
+        self.assertTrue(pool.get(host='localhost', port=80) is conn)
+        accepted.close()
+        conn.invalidate()
+
+    def test_server_uri(self):
+        server = Server('unix://' + self.path, max_idle=3)
+        self.assertEqual(server.uri, 'unix://' + self.path)
+        self.assertEqual(server._resource.initial['uri'], 'http://localhost')
+        pool = server._resource.client_opts['pool']
+        self.assertEqual(pool.max_idle, 3)
+        self.assertEqual(pool._factory.keywords, {'socket_path': self.path})
+        self.assertRaises(ValueError, Server,
+                          ['unix://' + self.path, 'http://localhost:7777'])
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+from unittest import TestCase
+from .. import Server
+from ..bulk import BulkIndexer
+from ..errors import RateLimitExceeded
+from ..ratelimit import TokenBucket, WriteLimiter
+from .bulk_test import IndexingResource
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now += delay
+
+
+class TokenBucketTest(TestCase):
+
+    def test_acquire(self):
+        clock = FakeClock()
+        bucket = TokenBucket(10, burst=5, clock=clock, sleep=clock.sleep)
+        # The bucket starts full.
+        for _ in range(5):
+            self.assertEqual(bucket.acquire(), 0)
+        self.assertEqual(clock.sleeps, [])
+        self.assertAlmostEqual(bucket.acquire(), 0.1)
+        self.assertAlmostEqual(bucket.acquire(2), 0.2)
+        self.assertAlmostEqual(bucket.tokens, 0)
+
+        # Tokens build up to the burst size.
+        clock.now += 10
+        self.assertAlmostEqual(bucket.tokens, 5)
+
+    def test_debt(self):
+        clock = FakeClock()
+        bucket = TokenBucket(2, burst=1, clock=clock, sleep=lambda d: None)
+        self.assertEqual(bucket.acquire(), 0)
+        # Callers waiting at the same time queue up behind each other.
+        self.assertAlmostEqual(bucket.acquire(), 0.5)
+        self.assertAlmostEqual(bucket.acquire(), 1.0)
+        self.assertAlmostEqual(bucket.tokens, -2)
+
+    def test_try_acquire(self):
+        clock = FakeClock()
+        bucket = TokenBucket(1, burst=2, clock=clock, sleep=clock.sleep)
+        self.assertTrue(bucket.try_acquire(2))
+        self.assertFalse(bucket.try_acquire())
+        clock.now += 1
+        self.assertTrue(bucket.try_acquire())
+        self.assertRaises(ValueError, TokenBucket, 0)
+        # More than the burst size can be taken from a full bucket.
+        clock.now += 2
+        self.assertTrue(bucket.try_acquire(5))
+        self.assertFalse(bucket.try_acquire())
+
+    def test_set_rate(self):
+        clock = FakeClock()
+        bucket = TokenBucket(10, clock=clock, sleep=clock.sleep)
+        bucket.set_rate(2, burst=4)
+        self.assertAlmostEqual(bucket.tokens, 4)
+        self.assertEqual(bucket.reserve(5), 0.5)
+        self.assertEqual(clock.sleeps, [])
+
+
+class WriteLimiterTest(TestCase):
+
+    def test_blocking(self):
+        clock = FakeClock()
+        limiter = WriteLimiter(rate=10, bytes_rate=100, burst=1,
+                               clock=clock, sleep=clock.sleep)
+        self.assertEqual(limiter.acquire(50), 0)
+        # The wait is the longer of the waits for each limit.
+        self.assertAlmostEqual(limiter.acquire(100), 0.5)
+        self.assertAlmostEqual(limiter.acquire(), 0)
+        self.assertAlmostEqual(limiter.acquire(), 0.1)
+        self.assertEqual(limiter.allowed, 4)
+        self.assertAlmostEqual(limiter.waited, 0.6)
+
+        # Limits may be changed or removed while in use.
+        limiter.bytes_rate = None
+        clock.now += 1
+        self.assertEqual(limiter.acquire(10 ** 6), 0)
+        limiter.rate = 1
+        self.assertAlmostEqual(limiter.acquire(), 1.0)
+        self.assertEqual((limiter.rate, limiter.bytes_rate), (1, None))
+        limiter.set_rates(None, 10)
+        self.assertEqual(limiter.acquire(5), 0)
+
+    def test_fail_fast(self):
+        clock = FakeClock()
+        limiter = WriteLimiter(rate=2, bytes_rate=100, block=False,
+                               clock=clock, sleep=clock.sleep)
+        limiter.acquire(80)
+        try:
+            limiter.acquire(40)
+            self.fail("RateLimitExceeded not raised")
+        except RateLimitExceeded as e:
+            self.assertAlmostEqual(e.retry_after, 0.2)
+        self.assertEqual((limiter.allowed, limiter.refused), (1, 1))
+        limiter.acquire()
+        self.assertRaises(RateLimitExceeded, limiter.acquire)
+        # A write larger than the burst is allowed when the bucket is full.
+        clock.now += 10
+        limiter.acquire(1000)
+        self.assertEqual(clock.sleeps, [])
+
+    def test_client(self):
+        limiter = WriteLimiter(rate=1000, bytes_rate=10 ** 6)
+        server = Server(resource_class=IndexingResource, write_limit=limiter)
+        coll = server.collection('c')
+        coll.add_doc({'a': 1}, doc_type='t', doc_id='1')
+        coll.doc_type('t').add_doc({'a': 2}, doc_id='2')
+        coll.doc_type('t').delete_doc('1')
+        coll.delete_doc('t', '2')
+        self.assertEqual(limiter.allowed, 4)
+        updates = server._resource.updates
+        self.assertEqual([(u[0], u[1]) for u in updates],
+                         [('PUT', '/coll/c/type/t/id/1'),
+                          ('PUT', '/coll/c/type/t/id/2'),
+                          ('DELETE', '/coll/c/type/t/id/1'),
+                          ('DELETE', '/coll/c/type/t/id/2')])
+        self.assertTrue(isinstance(updates[0][2], bytes))
+
+        # A collection may have its own limit.
+        own = WriteLimiter(rate=1, block=False)
+        coll = server.collection('c', write_limit=own)
+        coll.add_doc({'a': 1}, doc_type='t', doc_id='1')
+        self.assertRaises(RateLimitExceeded, coll.delete_doc, 't', '1')
+        self.assertEqual(limiter.allowed, 4)
+
+        # Bulk indexers use the limit of their target by default.
+        indexer = BulkIndexer(coll.doc_type('t'), checkpoint=False)
+        self.assertTrue(indexer.rate_limit is own)
+        indexer.close()
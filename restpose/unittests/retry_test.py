@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+from unittest import TestCase
+from ..retry import RetryPolicy
+from restkit import RequestError, RequestFailed, ResourceNotFound
+
+class Flaky(object):
+    """A callable which fails a number of times before succeeding.
+
+    """
+    def __init__(self, failures):
+        self.failures = list(failures)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.failures:
+            raise self.failures.pop(0)
+        return 'ok'
+
+
+def busy():
+    return RequestFailed("queue full", http_code=503)
+
+
+class RetryTest(TestCase):
+
+    def make(self, **kwargs):
+        self.sleeps = []
+        return RetryPolicy(sleep=self.sleeps.append, **kwargs)
+
+    def test_busy_is_retried(self):
+        policy = self.make(jitter=False, initial_backoff=0.1)
+        func = Flaky([busy(), busy()])
+        self.assertEqual(policy.call(func, 'POST', '/coll/c/type/t'), 'ok')
+        self.assertEqual(func.calls, 3)
+        self.assertEqual(self.sleeps, [0.1, 0.2])
+        stats = policy.stats
+        self.assertEqual(stats.retries, 2)
+        self.assertEqual(stats.retries_busy, 2)
+        self.assertEqual(stats.recovered, 1)
+        self.assertEqual(stats.give_ups, 0)
+
+    def test_idempotency(self):
+        policy = self.make()
+        for method, path in (('GET', '/coll/c/type/t/id/1'),
+                             ('PUT', '/coll/c/type/t/id/1'),
+                             ('DELETE', '/coll/c/type/t/id/1'),
+                             ('POST', '/coll/c/search')):
+            func = Flaky([RequestError("connection reset")])
+            self.assertEqual(policy.call(func, method, path), 'ok')
+
+        for path in ('/coll/c/type/t', '/coll/c/checkpoint'):
+            func = Flaky([RequestError("connection reset")])
+            self.assertRaises(RequestError, policy.call, func, 'POST', path)
+            self.assertEqual(func.calls, 1)
+        self.assertEqual(policy.stats.retries_connection, 4)
+
+    def test_other_errors_not_retried(self):
+        policy = self.make()
+        func = Flaky([ResourceNotFound("missing", http_code=404)])
+        self.assertRaises(ResourceNotFound, policy.call, func, 'GET', '/x')
+        self.assertEqual(func.calls, 1)
+        func = Flaky([ValueError()])
+        self.assertRaises(ValueError, policy.call, func, 'GET', '/x')
+        self.assertEqual(policy.stats.retries, 0)
+
+    def test_give_up(self):
+        policy = self.make(max_attempts=3)
+        func = Flaky([busy()] * 5)
+        self.assertRaises(RequestFailed, policy.call, func, 'PUT', '/x')
+        self.assertEqual(func.calls, 3)
+        self.assertEqual(policy.stats.give_ups, 1)
+
+        policy = self.make(max_elapsed=0.5, initial_backoff=1, jitter=False)
+        func = Flaky([busy()])
+        self.assertRaises(RequestFailed, policy.call, func, 'PUT', '/x')
+        self.assertEqual(func.calls, 1)
+        self.assertEqual(self.sleeps, [])
+
+    def test_backoff(self):
+        policy = self.make(initial_backoff=1, max_backoff=5, jitter=False)
+        self.assertEqual([policy.backoff(n) for n in range(1, 6)],
+                         [1, 2, 4, 5, 5])
+        policy = self.make(initial_backoff=1, max_backoff=5)
+        for n in range(1, 6):
+            self.assertTrue(0 <= policy.backoff(n) <= 5)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+from unittest import TestCase
+from .. import Server, CheckPointExpiredError, CheckPointTimeoutError
+from ..watcher import CheckPointWatcher
+from .bulk_test import Response
+import threading
+
+class CheckingResource(object):
+    """A resource whose checkpoints are reached after a number of polls.
+
+    Checkpoint "c<n>" is reached on its n'th poll.  Checkpoints listed in
+    `expired` have expired, and those in `stuck` are never reached.
+
+    """
+    def __init__(self, uri, **client_opts):
+        self.client_opts = client_opts
+        self.lock = threading.Lock()
+        self.created = 0
+        self.polls = {}
+        self.expired = set()
+        self.stuck = set()
+
+    def request(self, method, path=None, payload=None, headers=None,
+                **params):
+        with self.lock:
+            if method == 'POST':
+                self.created += 1
+                return Response(201, {'checkid': 'c%d' % self.created})
+            checkid = path.rsplit('/', 1)[1]
+            polls = self.polls[checkid] = self.polls.get(checkid, 0) + 1
+        if checkid in self.expired:
+            return Response(200, None)
+        if checkid in self.stuck or polls < int(checkid[1:]):
+            return Response(200, {'reached': False})
+        return Response(200, {'reached': True, 'errors': [],
+                              'total_errors': 0})
+
+    def get(self, path=None, **params):
+        return self.request('GET', path, **params)
+
+    def post(self, path=None, payload=None, **params):
+        return self.request('POST', path, payload, **params)
+
+
+class CheckPointWatcherTest(TestCase):
+
+    def setUp(self):
+        self.server = Server(resource_class=CheckingResource)
+        self.resource = self.server._resource
+        self.coll = self.server.collection('c')
+
+    def test_watch(self):
+        threads = threading.active_count()
+        with CheckPointWatcher(min_poll=0.001, max_poll=0.01,
+                               batch_size=5, rate=2000) as watcher:
+            self.assertEqual(threading.active_count(), threads + 1)
+            checkpoints = [self.coll.checkpoint() for _ in range(30)]
+            pending = [watcher.watch(checkpoint)
+                       for checkpoint in checkpoints]
+            # A single thread polls every checkpoint.
+            self.assertEqual(threading.active_count(), threads + 1)
+            for checkpoint, future in zip(checkpoints, pending):
+                self.assertTrue(future.result(5) is checkpoint)
+            self.assertEqual(watcher.pending, 0)
+        self.assertEqual(threading.active_count(), threads)
+        stats = watcher.stats
+        self.assertEqual((stats.watched, stats.reached), (30, 30))
+        # Each checkpoint was polled until it was reached, and no more.
+        self.assertEqual(stats.polls, sum(range(1, 31)))
+        self.assertEqual(self.resource.polls['c30'], 30)
+
+    def test_failures(self):
+        self.resource.expired.add('c1')
+        self.resource.stuck.update(['c2', 'c3'])
+        watcher = CheckPointWatcher(min_poll=0.001, max_poll=0.01)
+        expired = watcher.watch(self.coll.checkpoint())
+        late = watcher.watch(self.coll.checkpoint(), timeout=0.05)
+        cancelled = watcher.watch(self.coll.checkpoint())
+        self.assertRaises(CheckPointExpiredError, expired.result, 5)
+        self.assertRaises(CheckPointTimeoutError, late.result, 5)
+        self.assertTrue(cancelled.cancel())
+        stuck = watcher.watch(self.coll.checkpoint())
+        watcher.close()
+        self.assertTrue(stuck.cancelled())
+        self.assertEqual(watcher.pending, 0)
+        self.assertRaises(ValueError, watcher.watch, self.coll.checkpoint())
+        stats = watcher.stats
+        self.assertEqual((stats.expired, stats.timed_out), (1, 1))
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -
+#
+# This file is part of the restpose python module, released under the MIT
+# license.  See the COPYING file for more information.
+
+"""
+Waiting for many checkpoints at once.
+
+:meth:`restpose.client.CheckPoint.wait` blocks the calling thread until its
+checkpoint is reached, so waiting for checkpoints on many collections at
+once needs a thread for each.  A :class:`CheckPointWatcher` instead polls
+any number of checkpoints from a single background thread, and returns a
+future for each, which resolves to the checkpoint once it is reached::
+
+    with CheckPointWatcher() as watcher:
+        pending = [watcher.watch(coll.checkpoint()) for coll in colls]
+        for future in pending:
+            checkpoint = future.result()
+            print(checkpoint.check_id, checkpoint.total_errors)
+
+Each checkpoint is polled with an exponentially increasing interval, as in
+:meth:`restpose.client.CheckPoint.wait`, and a random fraction is added to
+each interval so that checkpoints set at the same time are not all polled
+at once.  At most `batch_size` polls are made each time the watcher wakes,
+and at most `rate` polls are made per second, so the server sees a steady
+trickle of requests however many checkpoints are watched.
+
+The futures are :class:`concurrent.futures.Future` objects.  On Python 2
+this requires the `futures` package.
+
+"""
+
+from .errors import CheckPointExpiredError, CheckPointTimeoutError
+from concurrent import futures
+import heapq
+import itertools
+import random
+import sys
+import threading
+import time
+
+
+class WatcherStats(object):
+    """Counters for a :class:`CheckPointWatcher`.
+
+    """
+    def __init__(self):
+        #: The number of checkpoints given to the watcher.
+        self.watched = 0
+
+        #: The number of requests made to check the state of checkpoints.
+        self.polls = 0
+
+        #: The number of checkpoints which were reached.
+        self.reached = 0
+
+        #: The number of checkpoints which expired.
+        self.expired = 0
+
+        #: The number of checkpoints which were not reached in time.
+        self.timed_out = 0
+
+        #: The number of checkpoints whose polls failed with other errors.
+        self.failed = 0
+
+    def as_dict(self):
+        """Get the counters as a dictionary.
+
+        """
+        return dict(self.__dict__)
+
+    def __repr__(self):
+        return '<WatcherStats %s>' % ' '.join(
+            '%s=%d' % item for item in sorted(self.__dict__.items()))
+
+
+class _Watch(object):
+    __slots__ = ('checkpoint', 'future', 'timeout', 'deadline', 'interval')
+
+    def __init__(self, checkpoint, future, timeout, deadline, interval):
+        self.checkpoint = checkpoint
+        self.future = future
+        self.timeout = timeout
+        self.deadline = deadline
+        self.interval = interval
+
+
+class CheckPointWatcher(object):
+    """Polls checkpoints from a single background thread.
+
+    """
+    def __init__(self, min_poll=0.005, max_poll=1.0, jitter=0.25,
+                 batch_size=20, rate=200):
+        """
+        :param min_poll: The initial interval between polls of each
+               checkpoint, in seconds.
+
+        :param max_poll: The maximum interval between polls of each
+               checkpoint, in seconds.
+
+        :param jitter: The largest random fraction of each interval to add
+               to it.
+
+        :param batch_size: The most checkpoints to poll each time the
+               watcher wakes.
+
+        :param rate: The most polls to make per second, or None for no
+               limit.
+
+        """
+        self.min_poll = min_poll
+        self.max_poll = max_poll
+        self.jitter = jitter
+        self.batch_size = batch_size
+        self.rate = rate
+
+        #: Counters of checkpoints and polls.
+        self.stats = WatcherStats()
+
+        # Watched checkpoints, as a heap of (due, seq, watch) tuples.
+        self._due = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run,
+                                        name='CheckPointWatcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def pending(self):
+        """The number of checkpoints being watched."""
+        with self._cond:
+            return len(self._due)
+
+    def watch(self, checkpoint, timeout=None):
+        """Watch a checkpoint.
+
+        :param checkpoint: The :class:`restpose.client.CheckPoint` to watch.
+
+        :param timeout: The longest time to wait for the checkpoint to be
+               reached, in seconds, or None to wait until it is reached or
+               expires.
+
+        :returns: A :class:`concurrent.futures.Future`, whose result is the
+                  checkpoint once it has been reached.  If the checkpoint
+                  expires, the future's exception is a
+                  :exc:`restpose.errors.CheckPointExpiredError`; if it isn't
+                  reached within `timeout`, a
+                  :exc:`restpose.errors.CheckPointTimeoutError`.  The future
+                  may be cancelled, to stop watching the checkpoint.
+
+        """
+        future = futures.Future()
+        now = time.time()
+        deadline = None
+        if timeout is not None:
+            deadline = now + timeout
+        watch = _Watch(checkpoint, future, timeout, deadline, self.min_poll)
+        with self._cond:
+            if self._closed:
+                raise ValueError("CheckPointWatcher has been closed")
+            self.stats.watched += 1
+            heapq.heappush(self._due, (now, next(self._seq), watch))
+            self._cond.notify()
+        return future
+
+    def close(self):
+        """Stop the background thread, cancelling the futures of any
+        checkpoints still being watched.
+
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        for _, _, watch in self._due:
+            watch.future.cancel()
+        self._due = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _run(self):
+        spacing = 0.0
+        if self.rate:
+            spacing = 1.0 / self.rate
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if self._due:
+                        delay = self._due[0][0] - time.time()
+                        if delay <= 0:
+                            break
+                        self._cond.wait(delay)
+                    else:
+                        self._cond.wait()
+                if self._closed:
+                    return
+                now = time.time()
+                batch = []
+                while self._due and self._due[0][0] <= now and \
+                      len(batch) < self.batch_size:
+                    batch.append(heapq.heappop(self._due)[2])
+            for index, watch in enumerate(batch):
+                if index and spacing:
+                    time.sleep(spacing)
+                self._poll(watch)
+            if len(batch) == self.batch_size and spacing:
+                time.sleep(spacing)
+
+    def _poll(self, watch):
+        if watch.future.cancelled():
+            return
+        checkpoint = watch.checkpoint
+        stats = self.stats
+        polls = checkpoint.polls
+        try:
+            reached = checkpoint.reached
+        except CheckPointExpiredError:
+            stats.expired += 1
+            self._finish(watch, exception=sys.exc_info()[1])
+            return
+        except Exception:
+            stats.failed += 1
+            self._finish(watch, exception=sys.exc_info()[1])
+            return
+        finally:
+            stats.polls += checkpoint.polls - polls
+        if reached:
+            stats.reached += 1
+            self._finish(watch, result=checkpoint)
+            return
+
+        now = time.time()
+        if watch.deadline is not None and now >= watch.deadline:
+            stats.timed_out += 1
+            self._finish(watch, exception=CheckPointTimeoutError(
+                "Checkpoint %s not reached after %.3gs" %
+                (checkpoint.check_id, watch.timeout), checkpoint.check_id,
+                watch.timeout))
+            return
+        due = now + watch.interval * (1 + random.uniform(0, self.jitter))
+        if watch.deadline is not None:
+            due = min(due, watch.deadline)
+        watch.interval = min(watch.interval * 2, self.max_poll)
+        with self._cond:
+            if self._closed:
+                watch.future.cancel()
+                return
+            heapq.heappush(self._due, (due, next(self._seq), watch))
+
+    def _finish(self, watch, result=None, exception=None):
+        future = watch.future
+        if not future.set_running_or_notify_cancel():
+            return
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
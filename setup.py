@@ -1,8 +1,17 @@
+import sys
+
 try:
     from setuptools import setup, find_packages
 except ImportError:
     from distutils.core import setup, find_packages
 
+install_requires = [
+    'restkit>=4.0',
+    'six',
+]
+if sys.version_info < (3, 2):
+    install_requires.append('futures')
+
 setup(name="Restpose",
       version='0.7.8dev',
       packages=find_packages(),
@@ -22,10 +31,12 @@ setup(name="Restpose",
         'Programming Language :: Python :: 2.7',
         'Operating System :: Unix',
       ],
-      install_requires=[
-        'restkit>=3.2.3',
-        'six',
-      ],
+      install_requires=install_requires,
+      entry_points={
+        'console_scripts': [
+          'restpose-import = restpose.importer:main',
+        ],
+      },
       setup_requires=[
       ],
       tests_require=[